@@ -0,0 +1,99 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+# Import time of long BVH takes, not loaded by the addon. Runs inside Blender,
+# writes a generated take (a chain of bones, random rotations) and times its
+# parsing and the armature F-Curves it's imported to, with quaternion and
+# euler rotations.
+#
+#     blender -b -P benchmark.py -- [bones] [frames]
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+import bpy
+
+
+def write_take(filepath, bones, frames):
+    """A chain of bones, the root with locations, random rotations at every frame"""
+    rand = random.Random(0)
+
+    with open(filepath, 'w') as file:
+        fw = file.write
+        fw("HIERARCHY\n")
+        for i in range(bones):
+            indent = "  " * i
+            fw("%s%s bone_%02d\n%s{\n" % (indent, "ROOT" if i == 0 else "JOINT", i, indent))
+            fw("%s  OFFSET 0.0 %.6f 0.0\n" % (indent, 0.0 if i == 0 else 1.0))
+            if i == 0:
+                fw("%s  CHANNELS 6 Xposition Yposition Zposition Zrotation Xrotation Yrotation\n" % indent)
+            else:
+                fw("%s  CHANNELS 3 Zrotation Xrotation Yrotation\n" % indent)
+
+        indent = "  " * bones
+        fw("%sEnd Site\n%s{\n%s  OFFSET 0.0 1.0 0.0\n%s}\n" % (indent, indent, indent, indent))
+        for i in reversed(range(bones)):
+            fw("%s}\n" % ("  " * i))
+
+        fw("MOTION\nFrames: %d\nFrame Time: 0.033333\n" % frames)
+        channel_count = 3 + bones * 3
+        for frame in range(frames):
+            fw(" ".join("%.4f" % rand.uniform(-90.0, 90.0) for i in range(channel_count)))
+            fw("\n")
+
+
+def import_times(bones=20, frames=20000):
+    from io_anim_bvh import import_bvh
+
+    context = bpy.context
+    directory = tempfile.mkdtemp()
+    filepath = os.path.join(directory, "benchmark.bvh")
+
+    try:
+        write_take(filepath, bones, frames)
+
+        print("BVH import, %i bones x %i frames" % (bones, frames))
+
+        start = time.time()
+        import_bvh.read_bvh(context, filepath)
+        print("\tread_bvh:           %6.2f s" % (time.time() - start))
+
+        for rotate_mode in ('QUATERNION', 'NATIVE'):
+            bvh_nodes, bvh_frame_time = import_bvh.read_bvh(context, filepath, rotate_mode=rotate_mode)
+
+            start = time.time()
+            import_bvh.bvh_node_dict2armature(context, "benchmark", bvh_nodes, bvh_frame_time,
+                                              rotate_mode=rotate_mode)
+            print("\tarmature %-10s %6.2f s" % (rotate_mode.lower() + ":", time.time() - start))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    try:
+        start = sys.argv.index("--") + 1
+    except ValueError:
+        start = len(sys.argv)
+
+    import_times(*[int(arg) for arg in sys.argv[start:start + 2]])
@@ -20,11 +20,18 @@
 
 # Script copyright (C) Campbell Barton
 
+import gc
+import array
 from math import radians
 
 import bpy
 from mathutils import Vector, Euler, Matrix
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class BVH_Node(object):
     __slots__ = (
@@ -38,7 +45,7 @@ class BVH_Node(object):
         'channels',  # list of 6 ints, -1 for an unused channel, otherwise an index for the BVH motion data lines, loc triple then rot triple
         'rot_order',  # a triple of indices as to the order rotation is applied. [0,1,2] is x/y/z - [None, None, None] if no rotation.
         'rot_order_str',  # same as above but a string 'XYZ' format.
-        'anim_data',  # a list one tuple's one for each frame. (locx, locy, locz, rotx, roty, rotz), euler rotation ALWAYS stored xyz order, even when native used.
+        'anim_data',  # BVH_AnimData, (locx, locy, locz, rotx, roty, rotz) for each frame, euler rotation ALWAYS stored xyz order, even when native used.
         'has_loc',  # Convenience function, bool, same as (channels[0]!=-1 or channels[1]!=-1 or channels[2]!=-1)
         'has_rot',  # Convenience function, bool, same as (channels[3]!=-1 or channels[4]!=-1 or channels[5]!=-1)
         'index',  # index from the file, not strictly needed but nice to maintain order
@@ -73,10 +80,8 @@ class BVH_Node(object):
 
         self.children = []
 
-        # list of 6 length tuples: (lx,ly,lz, rx,ry,rz)
-        # even if the channels aren't used they will just be zero
-        #
-        self.anim_data = [(0, 0, 0, 0, 0, 0)]
+        # set once the motion data is read
+        self.anim_data = None
 
     def __repr__(self):
         return ('BVH name:"%s", rest_loc:(%.3f,%.3f,%.3f), rest_tail:(%.3f,%.3f,%.3f)' %
@@ -85,6 +90,68 @@ class BVH_Node(object):
                  self.rest_head_world.x, self.rest_head_world.y, self.rest_head_world.z))
 
 
+class BVH_AnimData(object):
+    """
+    Animation of one node, read from the motion data of the whole file.
+
+    The motion data is one flat array of floats, a row of all channels for
+    each frame, frame 0 being the rest pose (all zeros). Indexing a frame
+    gives (lx, ly, lz, rx, ry, rz) scaled and in radians, unused channels
+    are zero.
+    """
+    __slots__ = (
+        'motion_data',  # array of floats, shared by all nodes
+        'channel_count',  # values per frame in motion_data
+        'channels',  # the channels of the node, indices into a frame
+        'global_scale',
+        )
+
+    def __init__(self, motion_data, channel_count, channels, global_scale):
+        self.motion_data = motion_data
+        self.channel_count = channel_count
+        self.channels = channels
+        self.global_scale = global_scale
+
+    def __len__(self):
+        return len(self.motion_data) // self.channel_count
+
+    def __getitem__(self, frame):
+        if frame < 0:
+            frame += len(self)
+        if not 0 <= frame < len(self):
+            raise IndexError("frame out of range")
+
+        offset = frame * self.channel_count
+        motion_data = self.motion_data
+        lx, ly, lz, rx, ry, rz = [0.0 if channel == -1 else motion_data[offset + channel] for channel in self.channels]
+
+        global_scale = self.global_scale
+        return (global_scale * lx, global_scale * ly, global_scale * lz,
+                radians(rx), radians(ry), radians(rz))
+
+    def to_array(self, start=0, stop=None):
+        """Frames from start to stop as an (n, 6) numpy array, needs numpy"""
+        motion_data = numpy.frombuffer(self.motion_data, dtype=numpy.float64).reshape(-1, self.channel_count)
+        motion_data = motion_data[start:stop]
+
+        anim_data = numpy.zeros((len(motion_data), 6))
+        for i, channel in enumerate(self.channels):
+            if channel != -1:
+                anim_data[:, i] = motion_data[:, channel]
+
+        anim_data[:, :3] *= self.global_scale
+        anim_data[:, 3:] = numpy.radians(anim_data[:, 3:])
+        return anim_data
+
+
+def bvh_lines(file):
+    """Words of each non empty line, read as they're needed"""
+    for line in file:
+        words = line.split()
+        if words:
+            yield words
+
+
 def sorted_nodes(bvh_nodes):
     bvh_nodes_list = list(bvh_nodes.values())
     bvh_nodes_list.sort(key=lambda bvh_node: bvh_node.index)
@@ -93,24 +160,19 @@ def sorted_nodes(bvh_nodes):
 
 def read_bvh(context, file_path, rotate_mode='XYZ', global_scale=1.0):
     # File loading stuff
-    # Open the file for importing
-    file = open(file_path, 'rU')
-
-    # Seperate into a list of lists, each line a list of words.
-    file_lines = file.readlines()
-    # Non standard carrage returns?
-    if len(file_lines) == 1:
-        file_lines = file_lines[0].split('\r')
-
-    # Split by whitespace.
-    file_lines = [ll for ll in [l.split() for l in file_lines] if ll]
+    # Open the file for importing,
+    # universal newlines also handles non standard carrage returns.
+    file = open(file_path, 'r')
+    file_lines = bvh_lines(file)
 
     # Create hierarchy as empties
-    if file_lines[0][0].lower() == 'hierarchy':
+    words = next(file_lines, None)
+    if words and words[0].lower() == 'hierarchy':
         #print 'Importing the BVH Hierarchy for:', file_path
         pass
     else:
-        raise 'ERROR: This is not a BVH file'
+        file.close()
+        raise Exception("ERROR: This is not a BVH file")
 
     bvh_nodes = {None: None}
     bvh_nodes_serial = [None]
@@ -118,35 +180,30 @@ def read_bvh(context, file_path, rotate_mode='XYZ', global_scale=1.0):
 
     channelIndex = -1
 
-    lineIdx = 0  # An index for the file.
-    while lineIdx < len(file_lines) - 1:
+    for words in file_lines:
         #...
-        if file_lines[lineIdx][0].lower() == 'root' or file_lines[lineIdx][0].lower() == 'joint':
+        if words[0].lower() == 'root' or words[0].lower() == 'joint':
 
             # Join spaces into 1 word with underscores joining it.
-            if len(file_lines[lineIdx]) > 2:
-                file_lines[lineIdx][1] = '_'.join(file_lines[lineIdx][1:])
-                file_lines[lineIdx] = file_lines[lineIdx][:2]
-
             # MAY NEED TO SUPPORT MULTIPLE ROOTS HERE! Still unsure weather multiple roots are possible?
 
             # Make sure the names are unique - Object names will match joint names exactly and both will be unique.
-            name = file_lines[lineIdx][1]
+            name = '_'.join(words[1:])
 
             #print '%snode: %s, parent: %s' % (len(bvh_nodes_serial) * '  ', name,  bvh_nodes_serial[-1])
 
-            lineIdx += 2  # Increment to the next line (Offset)
-            rest_head_local = Vector((float(file_lines[lineIdx][1]), float(file_lines[lineIdx][2]), float(file_lines[lineIdx][3]))) * global_scale
-            lineIdx += 1  # Increment to the next line (Channels)
+            next(file_lines)  # Skip the brace
+            words = next(file_lines)  # Offset
+            rest_head_local = Vector((float(words[1]), float(words[2]), float(words[3]))) * global_scale
+            words = next(file_lines)  # Channels
 
             # newChannel[Xposition, Yposition, Zposition, Xrotation, Yrotation, Zrotation]
             # newChannel references indices to the motiondata,
-            # if not assigned then -1 refers to the last value that will be added on loading at a value of zero, this is appended
-            # We'll add a zero value onto the end of the MotionDATA so this always refers to a value.
+            # if not assigned then -1, the channel is zero for all frames.
             my_channel = [-1, -1, -1, -1, -1, -1]
             my_rot_order = [None, None, None]
             rot_count = 0
-            for channel in file_lines[lineIdx][2:]:
+            for channel in words[2:]:
                 channel = channel.lower()
                 channelIndex += 1  # So the index points to the right channel
                 if channel == 'xposition':
@@ -169,8 +226,6 @@ def read_bvh(context, file_path, rotate_mode='XYZ', global_scale=1.0):
                     my_rot_order[rot_count] = 2
                     rot_count += 1
 
-            channels = file_lines[lineIdx][2:]
-
             my_parent = bvh_nodes_serial[-1]  # account for none
 
             # Apply the parents offset accumulatively
@@ -185,9 +240,10 @@ def read_bvh(context, file_path, rotate_mode='XYZ', global_scale=1.0):
             bvh_nodes_serial.append(bvh_node)
 
         # Account for an end node
-        if file_lines[lineIdx][0].lower() == 'end' and file_lines[lineIdx][1].lower() == 'site':  # There is sometimes a name after 'End Site' but we will ignore it.
-            lineIdx += 2  # Increment to the next line (Offset)
-            rest_tail = Vector((float(file_lines[lineIdx][1]), float(file_lines[lineIdx][2]), float(file_lines[lineIdx][3]))) * global_scale
+        elif words[0].lower() == 'end' and words[1].lower() == 'site':  # There is sometimes a name after 'End Site' but we will ignore it.
+            next(file_lines)  # Skip the brace
+            words = next(file_lines)  # Offset
+            rest_tail = Vector((float(words[1]), float(words[2]), float(words[3]))) * global_scale
 
             bvh_nodes_serial[-1].rest_tail_world = bvh_nodes_serial[-1].rest_head_world + rest_tail
             bvh_nodes_serial[-1].rest_tail_local = bvh_nodes_serial[-1].rest_head_local + rest_tail
@@ -196,7 +252,7 @@ def read_bvh(context, file_path, rotate_mode='XYZ', global_scale=1.0):
             # so this is a placeholder
             bvh_nodes_serial.append(None)
 
-        if len(file_lines[lineIdx]) == 1 and file_lines[lineIdx][0] == '}':  # == ['}']
+        elif len(words) == 1 and words[0] == '}':  # == ['}']
             bvh_nodes_serial.pop()  # Remove the last item
 
         # End of the hierarchy. Begin the animation section of the file with
@@ -204,20 +260,36 @@ def read_bvh(context, file_path, rotate_mode='XYZ', global_scale=1.0):
         #  MOTION
         #  Frames: n
         #  Frame Time: dt
-        if len(file_lines[lineIdx]) == 1 and file_lines[lineIdx][0].lower() == 'motion':
-            lineIdx += 2  # Read frame rate.
-
-            if (len(file_lines[lineIdx]) == 3 and
-                file_lines[lineIdx][0].lower() == 'frame' and
-                file_lines[lineIdx][1].lower() == 'time:'):
+        elif len(words) == 1 and words[0].lower() == 'motion':
+            next(file_lines, None)  # Frame count, not needed
+            words = next(file_lines, ())  # Read frame rate.
 
-                bvh_frame_time = float(file_lines[lineIdx][2])
+            if (len(words) == 3 and
+                words[0].lower() == 'frame' and
+                words[1].lower() == 'time:'):
 
-            lineIdx += 1  # Set the cursor to the first frame
+                bvh_frame_time = float(words[2])
 
             break
 
-        lineIdx += 1
+    # Read all frames into one array, a row of channelCount values for each
+    # frame, starting with the rest pose.
+    channelCount = max(channelIndex + 1, 1)
+    motion_data = array.array('d', [0.0]) * channelCount
+
+    for line in file:
+        values = line.split()
+        if not values:
+            continue
+
+        if len(values) < channelCount:
+            file.close()
+            raise Exception("ERROR: BVH frame %i has %i values, expected %i" %
+                            (len(motion_data) // channelCount, len(values), channelCount))
+
+        motion_data.extend(map(float, values[:channelCount]))
+
+    file.close()
 
     # Remove the None value used for easy parent reference
     del bvh_nodes[None]
@@ -228,31 +300,8 @@ def read_bvh(context, file_path, rotate_mode='XYZ', global_scale=1.0):
     # second life expects it, which isn't to spec.
     bvh_nodes_list = sorted_nodes(bvh_nodes)
 
-    while lineIdx < len(file_lines):
-        line = file_lines[lineIdx]
-        for bvh_node in bvh_nodes_list:
-            #for bvh_node in bvh_nodes_serial:
-            lx = ly = lz = rx = ry = rz = 0.0
-            channels = bvh_node.channels
-            anim_data = bvh_node.anim_data
-            if channels[0] != -1:
-                lx = global_scale * float(line[channels[0]])
-
-            if channels[1] != -1:
-                ly = global_scale * float(line[channels[1]])
-
-            if channels[2] != -1:
-                lz = global_scale * float(line[channels[2]])
-
-            if channels[3] != -1 or channels[4] != -1 or channels[5] != -1:
-
-                rx = radians(float(line[channels[3]]))
-                ry = radians(float(line[channels[4]]))
-                rz = radians(float(line[channels[5]]))
-
-            # Done importing motion data #
-            anim_data.append((lx, ly, lz, rx, ry, rz))
-        lineIdx += 1
+    for bvh_node in bvh_nodes_list:
+        bvh_node.anim_data = BVH_AnimData(motion_data, channelCount, bvh_node.channels, global_scale)
 
     # Assign children
     for bvh_node in bvh_nodes_list:
@@ -358,6 +407,115 @@ def bvh_node_dict2objects(context, bvh_name, bvh_nodes, rotate_mode='NATIVE', fr
     return objects
 
 
+def euler_matrices(rot, order):
+    """
+    Rotation matrices of an (n, 3) array of xyz euler angles,
+    the same as Euler(rot[i], order).to_matrix() for every row.
+    """
+    cos = numpy.cos(rot)
+    sin = numpy.sin(rot)
+
+    axis_matrices = []
+    for axis, (i, j) in enumerate(((1, 2), (2, 0), (0, 1))):
+        mat = numpy.zeros((len(rot), 3, 3))
+        mat[:, axis, axis] = 1.0
+        mat[:, i, i] = mat[:, j, j] = cos[:, axis]
+        mat[:, i, j] = -sin[:, axis]
+        mat[:, j, i] = sin[:, axis]
+        axis_matrices.append(mat)
+
+    # first axis of the order is applied first
+    axis_x, axis_y, axis_z = ("XYZ".index(axis) for axis in order)
+    return numpy.matmul(axis_matrices[axis_z], numpy.matmul(axis_matrices[axis_y], axis_matrices[axis_x]))
+
+
+def matrices_to_quaternions(mat):
+    """(w, x, y, z) quaternions of an (n, 3, 3) array of rotation matrices"""
+    quat = numpy.empty((len(mat), 4))
+    m00, m11, m22 = mat[:, 0, 0], mat[:, 1, 1], mat[:, 2, 2]
+
+    # start from the largest component, to stay away from dividing by small numbers
+    trace = 1.0 + m00 + m11 + m22
+    use_w = trace > 4.0 * numpy.finfo(numpy.float32).eps
+    use_x = ~use_w & (m00 > m11) & (m00 > m22)
+    use_y = ~use_w & ~use_x & (m11 > m22)
+    use_z = ~use_w & ~use_x & ~use_y
+
+    for use, diagonal, (i, j, k) in ((use_x, 1.0 + m00 - m11 - m22, (1, 2, 3)),
+                                     (use_y, 1.0 + m11 - m00 - m22, (2, 3, 1)),
+                                     (use_z, 1.0 + m22 - m00 - m11, (3, 1, 2))):
+        m = mat[use]
+        s = 2.0 * numpy.sqrt(diagonal[use])
+        a, b, c = i - 1, j - 1, k - 1
+        quat[use, 0] = (m[:, c, b] - m[:, b, c]) / s
+        quat[use, i] = 0.25 * s
+        quat[use, j] = (m[:, a, b] + m[:, b, a]) / s
+        quat[use, k] = (m[:, a, c] + m[:, c, a]) / s
+
+    m = mat[use_w]
+    s = 2.0 * numpy.sqrt(trace[use_w])
+    quat[use_w, 0] = 0.25 * s
+    quat[use_w, 1] = (m[:, 2, 1] - m[:, 1, 2]) / s
+    quat[use_w, 2] = (m[:, 0, 2] - m[:, 2, 0]) / s
+    quat[use_w, 3] = (m[:, 1, 0] - m[:, 0, 1]) / s
+
+    quat /= numpy.sqrt((quat * quat).sum(axis=1))[:, None]
+    return quat
+
+
+def matrices_to_eulers(mat, order):
+    """
+    Eulers of an (n, 3, 3) array of rotation matrices, each one compatible
+    with the previous one, so this stays a loop over the frames.
+    """
+    # only acyclic objects are created, don't collect while doing so
+    use_gc = gc.isenabled()
+    gc.disable()
+
+    try:
+        eulers = []
+        prev_euler = Euler((0.0, 0.0, 0.0))
+        for bone_rotation_matrix in mat.tolist():
+            prev_euler = Matrix(bone_rotation_matrix).to_euler(order, prev_euler)
+            eulers.append(prev_euler[:])
+    finally:
+        if use_gc:
+            gc.enable()
+
+    return numpy.array(eulers)
+
+
+def fcurves_add(action, data_path, time, values):
+    """
+    Add one linear F-Curve per column of *values* (one row per frame),
+    setting all keyframes of a curve at once.
+    """
+    num_frame = len(time)
+    for axis_i in range(len(values[0])):
+        curve = action.fcurves.new(data_path=data_path, index=axis_i)
+        keyframe_points = curve.keyframe_points
+        keyframe_points.add(num_frame)
+
+        if numpy is not None:
+            co = numpy.empty((num_frame, 2), dtype=numpy.float32)
+            co[:, 0] = time
+            co[:, 1] = values[:, axis_i]
+            co = co.ravel()
+        else:
+            co = [0.0] * (num_frame * 2)
+            co[0::2] = time
+            co[1::2] = [value[axis_i] for value in values]
+
+        keyframe_points.foreach_set("co", co)
+
+        try:
+            keyframe_points.foreach_set("interpolation", [1] * num_frame)  # 'LINEAR'
+        except (TypeError, RuntimeError):
+            # no raw access to enums
+            for bez in keyframe_points:
+                bez.interpolation = 'LINEAR'
+
+
 def bvh_node_dict2armature(context,
                            bvh_name,
                            bvh_nodes,
@@ -506,14 +664,17 @@ def bvh_node_dict2armature(context,
         num_frame = num_frame - skip_frame
 
     # Create a shared time axis for all animation curves.
-    time = [float(frame_start)] * num_frame
     if use_fps_scale:
         dt = scene.render.fps * bvh_frame_time
-        for frame_i in range(1, num_frame):
-            time[frame_i] += float(frame_i) * dt
     else:
+        dt = 1.0
+
+    if numpy is not None:
+        time = frame_start + numpy.arange(num_frame) * dt
+    else:
+        time = [float(frame_start)] * num_frame
         for frame_i in range(1, num_frame):
-            time[frame_i] += float(frame_i)
+            time[frame_i] += float(frame_i) * dt
 
     #print("bvh_frame_time = %f, dt = %f, num_frame = %d"
     #      % (bvh_frame_time, dt, num_frame]))
@@ -521,29 +682,31 @@ def bvh_node_dict2armature(context,
     for i, bvh_node in enumerate(bvh_nodes_list):
         pose_bone, bone, bone_rest_matrix, bone_rest_matrix_inv = bvh_node.temp
 
+        if numpy is not None:
+            # all frames of the bone at once
+            anim_data = bvh_node.anim_data.to_array(skip_frame, skip_frame + num_frame)
+            rest_matrix = numpy.array(bone_rest_matrix.to_3x3())
+            rest_matrix_inv = numpy.array(bone_rest_matrix_inv.to_3x3())
+
         if bvh_node.has_loc:
             # Not sure if there is a way to query this or access it in the
             # PoseBone structure.
             data_path = 'pose.bones["%s"].location' % pose_bone.name
 
-            location = [(0.0, 0.0, 0.0)] * num_frame
-            for frame_i in range(num_frame):
-                bvh_loc = bvh_node.anim_data[frame_i + skip_frame][:3]
+            if numpy is not None:
+                location = numpy.dot(anim_data[:, :3] - tuple(bvh_node.rest_head_local), rest_matrix_inv.T)
+            else:
+                location = [(0.0, 0.0, 0.0)] * num_frame
+                for frame_i in range(num_frame):
+                    bvh_loc = bvh_node.anim_data[frame_i + skip_frame][:3]
 
-                bone_translate_matrix = Matrix.Translation(
-                        Vector(bvh_loc) - bvh_node.rest_head_local)
-                location[frame_i] = (bone_rest_matrix_inv *
-                                     bone_translate_matrix).to_translation()
+                    bone_translate_matrix = Matrix.Translation(
+                            Vector(bvh_loc) - bvh_node.rest_head_local)
+                    location[frame_i] = (bone_rest_matrix_inv *
+                                         bone_translate_matrix).to_translation()
 
             # For each location x, y, z.
-            for axis_i in range(3):
-                curve = action.fcurves.new(data_path=data_path, index=axis_i)
-                keyframe_points = curve.keyframe_points
-                keyframe_points.add(num_frame)
-
-                for frame_i in range(num_frame):
-                    keyframe_points[frame_i].co = \
-                            (time[frame_i], location[frame_i][axis_i])
+            fcurves_add(action, data_path, time, location)
 
         if bvh_node.has_rot:
             data_path = None
@@ -558,41 +721,41 @@ def bvh_node_dict2armature(context,
                 data_path = ('pose.bones["%s"].rotation_euler' %
                              pose_bone.name)
 
-            prev_euler = Euler((0.0, 0.0, 0.0))
-            for frame_i in range(num_frame):
-                bvh_rot = bvh_node.anim_data[frame_i + skip_frame][3:]
-
+            if numpy is not None:
                 # apply rotation order and convert to XYZ
                 # note that the rot_order_str is reversed.
-                euler = Euler(bvh_rot, bvh_node.rot_order_str[::-1])
-                bone_rotation_matrix = euler.to_matrix().to_4x4()
-                bone_rotation_matrix = (bone_rest_matrix_inv *
-                                        bone_rotation_matrix *
-                                        bone_rest_matrix)
-
-                if 4 == len(rotate[frame_i]):
-                    rotate[frame_i] = bone_rotation_matrix.to_quaternion()
+                rotation = euler_matrices(anim_data[:, 3:], bvh_node.rot_order_str[::-1])
+                rotation = numpy.matmul(rest_matrix_inv, numpy.matmul(rotation, rest_matrix))
+
+                if 'QUATERNION' == rotate_mode:
+                    rotate = matrices_to_quaternions(rotation)
                 else:
-                    rotate[frame_i] = bone_rotation_matrix.to_euler(
-                            pose_bone.rotation_mode, prev_euler)
-                    prev_euler = rotate[frame_i]
+                    rotate = matrices_to_eulers(rotation, pose_bone.rotation_mode)
+            else:
+                prev_euler = Euler((0.0, 0.0, 0.0))
+                for frame_i in range(num_frame):
+                    bvh_rot = bvh_node.anim_data[frame_i + skip_frame][3:]
+
+                    # apply rotation order and convert to XYZ
+                    # note that the rot_order_str is reversed.
+                    euler = Euler(bvh_rot, bvh_node.rot_order_str[::-1])
+                    bone_rotation_matrix = euler.to_matrix().to_4x4()
+                    bone_rotation_matrix = (bone_rest_matrix_inv *
+                                            bone_rotation_matrix *
+                                            bone_rest_matrix)
+
+                    if 4 == len(rotate[frame_i]):
+                        rotate[frame_i] = bone_rotation_matrix.to_quaternion()
+                    else:
+                        rotate[frame_i] = bone_rotation_matrix.to_euler(
+                                pose_bone.rotation_mode, prev_euler)
+                        prev_euler = rotate[frame_i]
 
             # For each Euler angle x, y, z (or Quaternion w, x, y, z).
-            for axis_i in range(len(rotate[0])):
-                curve = action.fcurves.new(data_path=data_path, index=axis_i)
-                keyframe_points = curve.keyframe_points
-                curve.keyframe_points.add(num_frame)
-
-                for frame_i in range(0, num_frame):
-                    keyframe_points[frame_i].co = \
-                            (time[frame_i], rotate[frame_i][axis_i])
-
-    for cu in action.fcurves:
-        if IMPORT_LOOP:
-            pass  # 2.5 doenst have cyclic now?
+            fcurves_add(action, data_path, time, rotate)
 
-        for bez in cu.keyframe_points:
-            bez.interpolation = 'LINEAR'
+    if IMPORT_LOOP:
+        pass  # 2.5 doenst have cyclic now?
 
     # finally apply matrix
     arm_ob.matrix_world = global_matrix
@@ -40,7 +40,7 @@ cacheFile -pc2 1 -pcf "<insert filepath of source>" -f "<insert target filename
 
 import bpy
 from bpy.props import *
-import mathutils, math, struct
+import mathutils, math
 from os import remove
 import time
 from bpy_extras.io_utils import ExportHelper
@@ -51,6 +51,8 @@ def getSampling(start, end, sampling):
     return samples
 
 def do_export(context, props, filepath):
+    import point_cache
+
     mat_x90 = mathutils.Matrix.Rotation(-math.pi/2, 4, 'X')
     ob = context.active_object
     sc = context.scene
@@ -58,44 +60,31 @@ def do_export(context, props, filepath):
     end = props.range_end
     sampling = float(props.sampling)
     apply_modifiers = props.apply_modifiers
-    me = ob.to_mesh(sc, apply_modifiers, 'PREVIEW')
-    vertCount = len(me.vertices)
     sampletimes = getSampling(start, end, sampling)
     sampleCount = len(sampletimes)
     
-    # Create the header
-    headerFormat='<12siiffi'
-    headerStr = struct.pack(headerFormat, b'POINTCACHE2\0',
-                            1, vertCount, start, sampling, sampleCount)
+    # Create the header once the vertex count is known
+    def writeHeader(vertCount):
+        point_cache.write_pc2_header(file, vertCount, start, sampling, sampleCount)
 
     file = open(filepath, "wb")
-    file.write(headerStr)
     
-    for frame in sampletimes:
-        sc.frame_set(frame)
-        me = ob.to_mesh(sc, apply_modifiers, 'PREVIEW')
-        
-        if len(me.vertices) != vertCount:
-            file.close()
-            try:
-                remove(filepath)
-            except:
-                empty = open(filepath, 'w')
-                empty.write('DUMMIFILE - export failed\n')
-                empty.close()
-            print('Export failed. Vertexcount of Object is not constant')
-            return False
-        
-        if props.world_space:
-            me.transform(ob.matrix_world)
-        if props.rot_x90:
-            me.transform(mat_x90)
-        
-        for v in me.vertices:
-            thisVertex = struct.pack('<fff', float(v.co[0]),
-                                             float(v.co[1]),
-                                             float(v.co[2]))
-            file.write(thisVertex)
+    try:
+        point_cache.write_object(file, sc, ob, sampletimes, 'little', writeHeader,
+                                 apply_modifiers=apply_modifiers,
+                                 world_space=props.world_space,
+                                 matrix=mat_x90 if props.rot_x90 else None,
+                                 use_workers=props.use_parallel)
+    except ValueError:
+        file.close()
+        try:
+            remove(filepath)
+        except:
+            empty = open(filepath, 'w')
+            empty.write('DUMMIFILE - export failed\n')
+            empty.close()
+        print('Export failed. Vertexcount of Object is not constant')
+        return False
     
     file.flush()
     file.close()
@@ -122,6 +111,10 @@ class Export_pc2(bpy.types.Operator, ExportHelper):
             description="Applies the Modifiers",
             default=True,
             )
+    use_parallel = BoolProperty(name="Parallel Export",
+            description="Sample long frame ranges in background Blender processes, one for each processor core",
+            default=False,
+            )
     range_start = IntProperty(name='Start Frame',
             description='First frame to use for Export',
             default=1,
@@ -74,6 +74,13 @@ class ImportPLY(bpy.types.Operator, ImportHelper):
     filename_ext = ".ply"
     filter_glob = StringProperty(default="*.ply", options={'HIDDEN'})
 
+    use_cache = BoolProperty(
+            name="Cache Geometry",
+            description="Keep the parsed geometry in a disk cache, "
+                        "importing the unchanged file again skips parsing",
+            default=False,
+            )
+
     def execute(self, context):
         paths = [os.path.join(self.directory, name.name)
                  for name in self.files]
@@ -83,7 +90,7 @@ class ImportPLY(bpy.types.Operator, ImportHelper):
         from . import import_ply
 
         for path in paths:
-            import_ply.load(self, context, path)
+            import_ply.load(self, context, path, self.use_cache)
 
         return {'FINISHED'}
 
@@ -120,6 +127,12 @@ class ExportPLY(bpy.types.Operator, ExportHelper):
             description="Export the active vertex color layer",
             default=True,
             )
+    use_ascii = BoolProperty(
+            name="ASCII",
+            description="Export using the ASCII format, "
+                        "otherwise binary (smaller and faster)",
+            default=True,
+            )
 
     axis_forward = EnumProperty(
             name="Forward",
@@ -183,6 +196,7 @@ class ExportPLY(bpy.types.Operator, ExportHelper):
         row = layout.row()
         row.prop(self, "use_uv_coords")
         row.prop(self, "use_colors")
+        layout.prop(self, "use_ascii")
 
         layout.prop(self, "axis_forward")
         layout.prop(self, "axis_up")
@@ -26,6 +26,176 @@ Only one mesh can be exported at a time.
 
 import bpy
 import os
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _unique_rows(keys):
+    """
+    Return (first_use, indices) for a 2d uint64 array of keys,
+    first_use being the row where each distinct key is first seen
+    (in order) and indices the distinct key of each row.
+    """
+    # sort rows on a hash of their values, falling back to a lexsort
+    # of all the columns if two distinct rows have the same hash
+    factors = (numpy.arange(1, keys.shape[1] + 1, dtype=numpy.uint64) *
+               numpy.uint64(0x9E3779B97F4A7C15)) | numpy.uint64(1)
+    hashed = keys * factors
+    hashed = numpy.bitwise_xor.reduce(hashed, axis=1)
+
+    order = numpy.argsort(hashed)
+    hashed = hashed[order]
+
+    starts = numpy.empty(len(order), dtype=bool)
+    starts[:1] = True
+    starts[1:] = hashed[1:] != hashed[:-1]
+    del hashed
+
+    first_use, indices = _group_rows(order, starts, False)
+
+    if not (keys[first_use][indices] == keys).all():
+        order = numpy.lexsort(keys.T[::-1])
+        sorted_keys = keys[order]
+
+        starts = numpy.empty(len(order), dtype=bool)
+        starts[:1] = True
+        starts[1:] = (sorted_keys[1:] != sorted_keys[:-1]).any(1)
+
+        first_use, indices = _group_rows(order, starts, True)
+
+    return first_use, indices
+
+
+def _group_rows(order, starts, stable):
+    group = numpy.cumsum(starts) - 1
+    starts = numpy.flatnonzero(starts)
+
+    if stable:
+        first_use = order[starts]
+    elif len(order):
+        first_use = numpy.minimum.reduceat(order, starts)
+    else:
+        first_use = order
+
+    # number the groups in order of first use
+    rank = numpy.empty(len(first_use), dtype=numpy.int64)
+    rank[numpy.argsort(first_use)] = numpy.arange(len(first_use))
+
+    indices = numpy.empty(len(order), dtype=numpy.int64)
+    indices[order] = rank[group]
+
+    return numpy.sort(first_use), indices
+
+
+def _round_key(values):
+    # same as round(value, 6) on the float32 values as doubles, -0.0 being 0.0,
+    # a float32 times 1e6 is exact as a double so numpy.round rounds the same
+    return (numpy.round(values.astype(numpy.float64), 6) + 0.0).view(numpy.uint64)
+
+
+def mesh_arrays(mesh,
+                use_normals,
+                active_uv_layer,
+                active_col_layer,
+                ):
+    """
+    Return (vertices, faces) of a mesh as numpy arrays laid out like
+    binary PLY elements, vertices split the way save_mesh does it.
+
+    vertices is a structured array with the properties in the file
+    order, faces the bytes of the face list element.
+    """
+    tessfaces = mesh.tessfaces
+    face_count = len(tessfaces)
+
+    co = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+    mesh.vertices.foreach_get("co", co)
+    co.shape = (-1, 3)
+
+    raw = numpy.empty(face_count * 4, dtype=numpy.int32)
+    tessfaces.foreach_get("vertices_raw", raw)
+    raw.shape = (-1, 4)
+
+    # the last index of triangles is 0, it never is for quads
+    sides = numpy.where(raw[:, 3] != 0, 4, 3)
+    corners = numpy.ones((face_count, 4), dtype=bool)
+    corners[:, 3] = sides == 4
+
+    corner_verts = raw[corners]
+    corner_faces = numpy.repeat(numpy.arange(face_count), sides)
+
+    dtype = [("x", "<f4"), ("y", "<f4"), ("z", "<f4")]
+    keys = [corner_verts.astype(numpy.uint64)[:, None]]
+
+    if use_normals:
+        vert_normals = numpy.empty(len(mesh.vertices) * 3,
+                                   dtype=numpy.float32)
+        mesh.vertices.foreach_get("normal", vert_normals)
+        vert_normals.shape = (-1, 3)
+
+        face_normals = numpy.empty(face_count * 3, dtype=numpy.float32)
+        tessfaces.foreach_get("normal", face_normals)
+        face_normals.shape = (-1, 3)
+
+        smooth = numpy.empty(face_count, dtype=bool)
+        tessfaces.foreach_get("use_smooth", smooth)
+
+        normals = numpy.where(smooth[corner_faces, None],
+                              vert_normals[corner_verts],
+                              face_normals[corner_faces])
+        keys.append(_round_key(normals))
+        dtype += [("nx", "<f4"), ("ny", "<f4"), ("nz", "<f4")]
+
+    if active_uv_layer:
+        uvs = numpy.empty(face_count * 8, dtype=numpy.float32)
+        active_uv_layer.foreach_get("uv_raw", uvs)
+        uvs = uvs.reshape(-1, 4, 2)[corners]
+        keys.append(_round_key(uvs))
+        dtype += [("s", "<f4"), ("t", "<f4")]
+
+    if active_col_layer:
+        colors = numpy.empty((face_count, 4, 3), dtype=numpy.float32)
+        for i in range(4):
+            color = numpy.empty(face_count * 3, dtype=numpy.float32)
+            active_col_layer.foreach_get("color%d" % (i + 1), color)
+            colors[:, i] = color.reshape(-1, 3)
+
+        colors = (colors[corners].astype(numpy.float64) * 255.0)
+        colors = colors.astype(numpy.uint8)
+        keys.append(colors.astype(numpy.uint64))
+        dtype += [("red", "u1"), ("green", "u1"), ("blue", "u1")]
+
+    first_use, indices = _unique_rows(numpy.hstack(keys))
+
+    vertices = numpy.empty(len(first_use), dtype=dtype)
+    vertices["x"], vertices["y"], vertices["z"] = \
+        co[corner_verts[first_use]].T
+    if use_normals:
+        vertices["nx"], vertices["ny"], vertices["nz"] = \
+            normals[first_use].T
+    if active_uv_layer:
+        vertices["s"], vertices["t"] = uvs[first_use].T
+    if active_col_layer:
+        vertices["red"], vertices["green"], vertices["blue"] = \
+            colors[first_use].T
+
+    # each face is its corner count then a uint per corner
+    sizes = 1 + 4 * sides
+    starts = numpy.cumsum(sizes) - sizes
+    faces = numpy.empty(int(sizes.sum()), dtype=numpy.uint8)
+    faces[starts] = sides
+
+    corner_index = (numpy.arange(len(corner_verts)) -
+                    numpy.repeat(numpy.cumsum(sides) - sides, sides))
+    positions = numpy.repeat(starts, sides) + 1 + 4 * corner_index
+    faces[positions[:, None] + numpy.arange(4)] = \
+        indices.astype("<u4").view(numpy.uint8).reshape(-1, 4)
+
+    return vertices, faces
 
 
 def save_mesh(filepath,
@@ -33,6 +203,7 @@ def save_mesh(filepath,
               use_normals=True,
               use_uv_coords=True,
               use_colors=True,
+              use_ascii=True,
               ):
 
     def rvec3d(v):
@@ -41,9 +212,6 @@ def save_mesh(filepath,
     def rvec2d(v):
         return round(v[0], 6), round(v[1], 6)
 
-    file = open(filepath, "w", encoding="utf8", newline="\n")
-    fw = file.write
-
     # Be sure tessface & co are available!
     if not mesh.tessfaces and mesh.polygons:
         mesh.calc_tessface()
@@ -86,7 +254,20 @@ def save_mesh(filepath,
     vdict = [{} for i in range(len(mesh_verts))]
     ply_faces = [[] for f in range(len(mesh.tessfaces))]
     vert_count = 0
-    for i, f in enumerate(mesh.tessfaces):
+
+    if not use_ascii and numpy is not None:
+        # bulk path, the loop below builds the same vertices one by one
+        vertices, faces = mesh_arrays(mesh,
+                                      use_normals,
+                                      active_uv_layer if has_uv else None,
+                                      active_col_layer if has_vcol else None,
+                                      )
+        vert_count = len(vertices)
+        tessfaces = ()
+    else:
+        tessfaces = mesh.tessfaces
+
+    for i, f in enumerate(tessfaces):
 
         smooth = not use_normals or f.use_smooth
         if not smooth:
@@ -132,13 +313,25 @@ def save_mesh(filepath,
 
             pf.append(pf_vidx)
 
+    if use_ascii:
+        file = open(filepath, "w", encoding="utf8", newline="\n")
+        fw = file.write
+    else:
+        file = open(filepath, "wb")
+
+        def fw(text):
+            file.write(text.encode("utf8"))
+
     fw("ply\n")
-    fw("format ascii 1.0\n")
+    if use_ascii:
+        fw("format ascii 1.0\n")
+    else:
+        fw("format binary_little_endian 1.0\n")
     fw("comment Created by Blender %s - "
        "www.blender.org, source file: %r\n" %
        (bpy.app.version_string, os.path.basename(bpy.data.filepath)))
 
-    fw("element vertex %d\n" % len(ply_verts))
+    fw("element vertex %d\n" % vert_count)
 
     fw("property float x\n"
        "property float y\n"
@@ -160,21 +353,37 @@ def save_mesh(filepath,
     fw("property list uchar uint vertex_indices\n")
     fw("end_header\n")
 
-    for i, v in enumerate(ply_verts):
-        fw("%.6f %.6f %.6f" % mesh_verts[v[0]].co[:])  # co
-        if use_normals:
-            fw(" %.6f %.6f %.6f" % v[1])  # no
-        if use_uv_coords:
-            fw(" %.6f %.6f" % v[2])  # uv
-        if use_colors:
-            fw(" %u %u %u" % v[3])  # col
-        fw("\n")
-
-    for pf in ply_faces:
-        if len(pf) == 3:
-            fw("3 %d %d %d\n" % tuple(pf))
-        else:
-            fw("4 %d %d %d %d\n" % tuple(pf))
+    if use_ascii:
+        for i, v in enumerate(ply_verts):
+            fw("%.6f %.6f %.6f" % mesh_verts[v[0]].co[:])  # co
+            if use_normals:
+                fw(" %.6f %.6f %.6f" % v[1])  # no
+            if use_uv_coords:
+                fw(" %.6f %.6f" % v[2])  # uv
+            if use_colors:
+                fw(" %u %u %u" % v[3])  # col
+            fw("\n")
+
+        for pf in ply_faces:
+            if len(pf) == 3:
+                fw("3 %d %d %d\n" % tuple(pf))
+            else:
+                fw("4 %d %d %d %d\n" % tuple(pf))
+    elif numpy is not None:
+        vertices.tofile(file)
+        faces.tofile(file)
+    else:
+        for i, v in enumerate(ply_verts):
+            file.write(struct.pack("<3f", *mesh_verts[v[0]].co))  # co
+            if use_normals:
+                file.write(struct.pack("<3f", *v[1]))  # no
+            if use_uv_coords:
+                file.write(struct.pack("<2f", *v[2]))  # uv
+            if use_colors:
+                file.write(struct.pack("<3B", *v[3]))  # col
+
+        for pf in ply_faces:
+            file.write(struct.pack("<B%dI" % len(pf), len(pf), *pf))
 
     file.close()
     print("writing %r done" % filepath)
@@ -189,6 +398,7 @@ def save(operator,
          use_normals=True,
          use_uv_coords=True,
          use_colors=True,
+         use_ascii=True,
          global_matrix=None
          ):
 
@@ -218,6 +428,7 @@ def save(operator,
                     use_normals=use_normals,
                     use_uv_coords=use_uv_coords,
                     use_colors=use_colors,
+                    use_ascii=use_ascii,
                     )
 
     if use_mesh_modifiers:
@@ -21,6 +21,11 @@
 import re
 import struct
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class element_spec(object):
     __slots__ = ("name",
@@ -44,6 +49,77 @@ class element_spec(object):
                 return i
         return -1
 
+    def dtype(self, format, list_counts=()):
+        """
+        Numpy dtype of one element in a binary file, lists being of the
+        given lengths (in order), None for variable size elements.
+        """
+        fields = []
+        list_counts = list(list_counts)
+        for p in self.properties:
+            if p.numeric_type == 's' or p.list_type == 's':
+                return None
+            name = field_name(p.name)
+            if p.list_type is not None:
+                if not list_counts:
+                    return None
+                fields.append(("count " + name, format + p.list_type))
+                fields.append((name, format + p.numeric_type, (list_counts.pop(0),)))
+            else:
+                fields.append((name, format + p.numeric_type))
+        return numpy.dtype(fields)
+
+    def array_to_lists(self, array):
+        """Elements of an array mapped by load_array, as load returns them"""
+        fields = [array[field_name(p.name)].tolist() for p in self.properties]
+        return [list(values) for values in zip(*fields)]
+
+    def load_array(self, format, filepath, stream):
+        """
+        Map the elements in a binary file as a numpy array, starting at
+        the stream position, lists must all have the same length.
+
+        Return None if that's not the case, the stream is then left as is.
+        Otherwise the stream is moved after the elements.
+        """
+        offset = stream.tell()
+
+        # list lengths of the first element
+        list_counts = []
+        position = offset
+        for p in self.properties:
+            if p.numeric_type == 's' or p.list_type == 's':
+                return None
+            if p.list_type is not None:
+                stream.seek(position)
+                fmt = format + p.list_type
+                count = struct.unpack(fmt, stream.read(struct.calcsize(fmt)))[0]
+                list_counts.append(count)
+                position += struct.calcsize(fmt) + count * struct.calcsize(p.numeric_type)
+            else:
+                position += struct.calcsize(p.numeric_type)
+
+        stream.seek(offset)
+
+        if self.count == 0:
+            return None
+
+        dtype = self.dtype(format, list_counts)
+        if dtype is None:
+            return None
+
+        try:
+            array = numpy.memmap(filepath, dtype, 'r', offset, (self.count,))
+        except ValueError:  # truncated file
+            return None
+
+        for p, count in zip([p for p in self.properties if p.list_type is not None], list_counts):
+            if not (array["count " + field_name(p.name)] == count).all():
+                return None
+
+        stream.seek(offset + self.count * dtype.itemsize)
+        return array
+
 
 class property_spec(object):
     __slots__ = ("name",
@@ -111,6 +187,21 @@ class object_spec(object):
     def load(self, format, stream):
         return dict([(i.name, [i.load(format, stream) for j in range(i.count)]) for i in self.specs])
 
+    def load_arrays(self, format, filepath, stream):
+        """
+        Like load, fixed size elements of binary files are mapped as numpy
+        arrays, others are loaded as lists.
+        """
+        answer = {}
+        for i in self.specs:
+            array = None
+            if format != b'ascii':
+                array = i.load_array(format, filepath, stream)
+            if array is None:
+                array = [i.load(format, stream) for j in range(i.count)]
+            answer[i.name] = array
+        return answer
+
         '''
         # Longhand for above LC
         answer = {}
@@ -124,7 +215,64 @@ class object_spec(object):
             '''
 
 
-def read(filepath):
+def field_name(name):
+    # numpy field names are strings, property names bytes
+    return name.decode('latin-1')
+
+
+def load_cache(filepath, use_arrays):
+    """read() result of an unchanged file from the geometry cache, None if it isn't cached"""
+    import geometry_cache
+
+    cached = geometry_cache.load(filepath, "ply", (use_arrays,))
+    if cached is None:
+        return None
+
+    values, arrays = cached
+    obj_spec = object_spec()
+    obj = {}
+    for name, count, properties in values["specs"]:
+        el = element_spec(name, count)
+        el.properties[:] = [property_spec(*p) for p in properties]
+        obj_spec.specs.append(el)
+        if field_name(name) in arrays:
+            obj[name] = arrays[field_name(name)]
+        else:
+            obj[name] = values["elements"][name]
+
+    return obj_spec, obj, values["texture"]
+
+
+def store_cache(filepath, use_arrays, obj_spec, obj, texture):
+    """
+    Fixed size elements mapped as numpy arrays are stored as such,
+    elements loaded as lists are stored with the header values.
+    """
+    import geometry_cache
+
+    arrays = {}
+    elements = {}
+    for name, data in obj.items():
+        if numpy is not None and isinstance(data, numpy.ndarray):
+            arrays[field_name(name)] = data
+        else:
+            elements[name] = data
+
+    values = {"specs": [(el.name, el.count, [(p.name, p.list_type, p.numeric_type) for p in el.properties])
+                        for el in obj_spec.specs],
+              "elements": elements,
+              "texture": texture,
+              }
+
+    geometry_cache.store(filepath, "ply", (use_arrays,), values, arrays)
+
+
+def read(filepath, use_arrays=False, use_cache=False):
+    if use_cache:
+        cached = load_cache(filepath, use_arrays)
+        if cached is not None:
+            return cached
+
     format = b''
     texture = b''
     version = b'1.0'
@@ -205,7 +353,13 @@ def read(filepath):
             print("Invalid header ('end_header' line not found!)")
             return invalid_ply
 
-        obj = obj_spec.load(format_specs[format], plyf)
+        if use_arrays:
+            obj = obj_spec.load_arrays(format_specs[format], filepath, plyf)
+        else:
+            obj = obj_spec.load(format_specs[format], plyf)
+
+    if use_cache:
+        store_cache(filepath, use_arrays, obj_spec, obj, texture)
 
     return obj_spec, obj, texture
 
@@ -213,11 +367,11 @@ def read(filepath):
 import bpy
 
 
-def load_ply_mesh(filepath, ply_name):
+def load_ply_mesh(filepath, ply_name, use_cache=False):
     from bpy_extras.io_utils import unpack_face_list
     # from bpy_extras.image_utils import load_image  # UNUSED
 
-    obj_spec, obj, texture = read(filepath)
+    obj_spec, obj, texture = read(filepath, use_arrays=numpy is not None, use_cache=use_cache)
     if obj is None:
         print('Invalid file')
         return
@@ -244,6 +398,27 @@ def load_ply_mesh(filepath, ply_name):
         elif el.name == b'face':
             findex = el.index(b'vertex_indices')
 
+    verts = obj[b'vertex']
+    faces = obj.get(b'face')
+
+    if faces is not None and not len(faces):
+        faces = None
+
+    if numpy is not None and isinstance(verts, numpy.ndarray):
+        if faces is None or (isinstance(faces, numpy.ndarray) and
+                             'vertex_indices' in faces.dtype.names and
+                             faces.dtype['vertex_indices'].shape[0] in {3, 4}):
+            mesh = bpy.data.meshes.new(name=ply_name)
+            mesh_from_arrays(mesh, verts, faces, colmultiply)
+            load_ply_texture(mesh, filepath, texture, uvindices)
+            return mesh
+
+    if numpy is not None:
+        # per face loading below, with faces of other sizes (fan filled)
+        for el in obj_spec.specs:
+            if isinstance(obj[el.name], numpy.ndarray):
+                obj[el.name] = el.array_to_lists(obj[el.name])
+
     mesh_faces = []
     mesh_uvs = []
     mesh_colors = []
@@ -323,6 +498,63 @@ def load_ply_mesh(filepath, ply_name):
     mesh.validate()
     mesh.update()
 
+    load_ply_texture(mesh, filepath, texture, uvindices)
+
+    return mesh
+
+
+def mesh_from_arrays(mesh, verts, faces, colmultiply):
+    """
+    Fill *mesh* from the numpy arrays of vertex and face elements,
+    the faces being all triangles or all quads.
+    """
+    co = numpy.empty((len(verts), 3), dtype=numpy.float32)
+    co[:, 0], co[:, 1], co[:, 2] = verts['x'], verts['y'], verts['z']
+
+    mesh.vertices.add(len(verts))
+    mesh.vertices.foreach_set("co", co.ravel())
+    del co
+
+    if faces is not None:
+        add_faces_from_arrays(mesh, verts, faces, colmultiply)
+
+    mesh.validate()
+    mesh.update()
+
+
+def add_faces_from_arrays(mesh, verts, faces, colmultiply):
+    names = set(verts.dtype.names)
+
+    indices = numpy.ascontiguousarray(faces['vertex_indices'], dtype=numpy.int32)
+    sides = indices.shape[1]
+
+    mesh.loops.add(indices.size)
+    mesh.polygons.add(len(indices))
+
+    mesh.loops.foreach_set("vertex_index", indices.ravel())
+    mesh.polygons.foreach_set("loop_start", numpy.arange(0, indices.size, sides, dtype=numpy.int32))
+    mesh.polygons.foreach_set("loop_total", numpy.full(len(indices), sides, dtype=numpy.int32))
+
+    indices = indices.ravel()
+
+    if {'s', 't'} <= names:
+        uvs = numpy.empty((len(indices), 2), dtype=numpy.float32)
+        uvs[:, 0], uvs[:, 1] = verts['s'][indices], verts['t'][indices]
+
+        mesh.uv_textures.new()
+        mesh.uv_layers[-1].data.foreach_set("uv", uvs.ravel())
+        del uvs
+
+    if {'red', 'green', 'blue'} <= names:
+        colors = numpy.empty((len(indices), 3), dtype=numpy.float32)
+        for i, name in enumerate(('red', 'green', 'blue')):
+            colors[:, i] = verts[name][indices] * colmultiply[i]
+
+        mesh.vertex_colors.new()
+        mesh.vertex_colors[-1].data.foreach_set("color", colors.ravel())
+
+
+def load_ply_texture(mesh, filepath, texture, uvindices):
     if texture and uvindices:
 
         import os
@@ -353,13 +585,13 @@ def load_ply_mesh(filepath, ply_name):
     return mesh
 
 
-def load_ply(filepath):
+def load_ply(filepath, use_cache=False):
     import time
 
     t = time.time()
     ply_name = bpy.path.display_name_from_filepath(filepath)
 
-    mesh = load_ply_mesh(filepath, ply_name)
+    mesh = load_ply_mesh(filepath, ply_name, use_cache)
     if not mesh:
         return {'CANCELLED'}
 
@@ -374,5 +606,5 @@ def load_ply(filepath):
     return {'FINISHED'}
 
 
-def load(operator, context, filepath=""):
-    return load_ply(filepath)
+def load(operator, context, filepath="", use_cache=False):
+    return load_ply(filepath, use_cache)
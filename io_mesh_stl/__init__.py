@@ -91,6 +91,13 @@ class ImportSTL(Operator, ImportHelper):
             subtype='DIR_PATH',
             )
 
+    use_cache = BoolProperty(
+            name="Cache Geometry",
+            description="Keep the parsed geometry in a disk cache, "
+                        "importing the unchanged file again skips parsing",
+            default=False,
+            )
+
     def execute(self, context):
         from . import stl_utils
         from . import blender_utils
@@ -109,7 +116,10 @@ class ImportSTL(Operator, ImportHelper):
 
         for path in paths:
             objName = bpy.path.display_name(os.path.basename(path))
-            tris, pts = stl_utils.read_stl(path)
+            if stl_utils.numpy is not None:
+                tris, pts = stl_utils.read_stl_arrays(path, self.use_cache)
+            else:
+                tris, pts = stl_utils.read_stl(path, self.use_cache)
             blender_utils.create_and_link_mesh(objName, tris, pts)
 
         return {'FINISHED'}
@@ -172,8 +182,13 @@ class ExportSTL(Operator, ExportHelper):
                                         to_up=self.axis_up,
                                         ).to_4x4() * Matrix.Scale(self.global_scale, 4)
 
+        if stl_utils.numpy is not None and not self.ascii:
+            faces_from_mesh = blender_utils.face_arrays_from_mesh
+        else:
+            faces_from_mesh = blender_utils.faces_from_mesh
+
         faces = itertools.chain.from_iterable(
-            blender_utils.faces_from_mesh(ob, global_matrix, self.use_mesh_modifiers)
+            faces_from_mesh(ob, global_matrix, self.use_mesh_modifiers)
             for ob in context.selected_objects)
 
         stl_utils.write_stl(self.filepath, faces, self.ascii)
@@ -28,7 +28,12 @@ def create_and_link_mesh(name, faces, points):
     """
 
     mesh = bpy.data.meshes.new(name)
-    mesh.from_pydata(points, [], faces)
+
+    if hasattr(faces, "dtype"):
+        # numpy arrays from read_stl_arrays, set in bulk
+        mesh_from_arrays(mesh, faces, points)
+    else:
+        mesh.from_pydata(points, [], faces)
 
     # update mesh to allow proper display
     mesh.validate()
@@ -42,6 +47,64 @@ def create_and_link_mesh(name, faces, points):
     obj.select = True
 
 
+def mesh_from_arrays(mesh, faces, points):
+    """
+    Fill *mesh* from numpy arrays of triangle indices (n, 3) and
+    points (m, 3).
+    """
+    import numpy
+
+    mesh.vertices.add(len(points))
+    mesh.loops.add(faces.size)
+    mesh.polygons.add(len(faces))
+
+    mesh.vertices.foreach_set("co", numpy.ascontiguousarray(points, dtype=numpy.float32).ravel())
+    mesh.loops.foreach_set("vertex_index", numpy.ascontiguousarray(faces, dtype=numpy.int32).ravel())
+    mesh.polygons.foreach_set("loop_start", numpy.arange(0, faces.size, 3, dtype=numpy.int32))
+    mesh.polygons.foreach_set("loop_total", numpy.full(len(faces), 3, dtype=numpy.int32))
+
+
+def face_arrays_from_mesh(ob, global_matrix, use_mesh_modifiers=False):
+    """
+    From an object, return a generator over one numpy array of shape
+    (n, 3, 3), the coordinates of its faces triangulated like
+    faces_from_mesh does.
+    """
+    import numpy
+
+    # get the editmode data
+    ob.update_from_editmode()
+
+    # get the modifiers
+    try:
+        mesh = ob.to_mesh(bpy.context.scene, use_mesh_modifiers, "PREVIEW")
+    except RuntimeError:
+        raise StopIteration
+
+    mesh.transform(global_matrix * ob.matrix_world)
+
+    co = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+    mesh.vertices.foreach_get("co", co)
+    co.shape = (-1, 3)
+
+    indices = numpy.empty(len(mesh.tessfaces) * 4, dtype=numpy.int32)
+    mesh.tessfaces.foreach_get("vertices_raw", indices)
+    indices.shape = (-1, 4)
+
+    bpy.data.meshes.remove(mesh)
+
+    # the fourth index of a triangle is 0, never for a quad
+    quads = indices[:, 3] != 0
+
+    # quads add their second triangle right after the first one
+    starts = numpy.arange(len(indices)) + numpy.cumsum(quads) - quads
+    triangles = numpy.empty((len(indices) + numpy.count_nonzero(quads), 3), dtype=numpy.int32)
+    triangles[starts] = indices[:, :3]
+    triangles[starts[quads] + 1] = indices[quads][:, [2, 3, 0]]
+
+    yield co[triangles]
+
+
 def faces_from_mesh(ob, global_matrix, use_mesh_modifiers=False, triangulate=True):
     """
     From an object, return a generator over a list of faces.
@@ -31,6 +31,11 @@ import mmap
 import contextlib
 import itertools
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # TODO: endien
 
 
@@ -85,6 +90,22 @@ class ListDict(dict):
 BINARY_HEADER = 80
 BINARY_STRIDE = 12 * 4 + 2
 
+if numpy is not None:
+    # one binary triangle, as laid out in the file
+    BINARY_DTYPE = numpy.dtype([('normal', '<f4', (3,)),
+                                ('vertices', '<f4', (3, 3)),
+                                ('attributes', '<u2'),
+                                ])
+
+    # odd multipliers mixing x, y and z in one key
+    _POINT_HASH = numpy.array([0x9E3779B97F4A7C15,
+                               0xC2B2AE3D27D4EB4F,
+                               0x165667B19E3779F9,
+                               ], dtype=numpy.uint64)
+
+# faces written at once when writing from python sequences
+BINARY_WRITE_BLOCK = 65536
+
 
 def _header_version():
     import bpy
@@ -128,6 +149,78 @@ def _binary_read(data):
         yield pt[:3], pt[3:6], pt[6:]
 
 
+def _binary_read_arrays(data):
+    # view the triangles in place, the coordinates are copied by _unique_points
+    size = struct.unpack_from('<I', data, BINARY_HEADER)[0]
+    triangles = numpy.frombuffer(data, BINARY_DTYPE, size, BINARY_HEADER + 4)
+    return triangles['vertices']
+
+
+def _unique_points(vertices):
+    """
+    Return (triangles, points) from an array of triangle vertices,
+    with points in first use order like read_stl does.
+    Vertices are float32 or float64, points are of the same type.
+    """
+    # adding 0 turns -0.0 into 0.0, they are the same point like in read_stl
+    vertices = vertices.reshape(-1, 3) + vertices.dtype.type(0.0)
+    bits = vertices.view('<u%d' % vertices.itemsize)
+
+    # sort on a hash of the coordinates bits, equal points end up next to
+    # each other. Sorting one 64 bits key is much faster than a lexsort of
+    # the three coordinates, which is only needed if two points collide.
+    keys = bits.astype(numpy.uint64)
+    keys *= _POINT_HASH
+    keys = keys[:, 0] ^ keys[:, 1] ^ keys[:, 2]
+
+    order = numpy.argsort(keys)
+    keys = keys[order]
+
+    starts = numpy.empty(len(order), dtype=bool)
+    starts[:1] = True
+    starts[1:] = keys[1:] != keys[:-1]
+    del keys
+
+    group = numpy.cumsum(starts) - 1
+    starts = numpy.flatnonzero(starts)
+
+    if len(order):
+        # where each point is first used
+        first_use = numpy.minimum.reduceat(order, starts)
+    else:
+        first_use = order
+
+    indices, points = _indexed_points(vertices, order, group, first_use)
+
+    # check there was no collision, in file order which is cache friendly
+    if not (points.view(bits.dtype)[indices] == bits).all():
+        order = numpy.lexsort((bits[:, 2], bits[:, 1], bits[:, 0]))
+        sorted_bits = bits[order]
+
+        starts = numpy.empty(len(order), dtype=bool)
+        starts[:1] = True
+        starts[1:] = (sorted_bits[1:] != sorted_bits[:-1]).any(1)
+
+        # lexsort is stable, the first of each run is the first use
+        group = numpy.cumsum(starts) - 1
+        first_use = order[starts]
+
+        indices, points = _indexed_points(vertices, order, group, first_use)
+
+    return indices.reshape(-1, 3), points
+
+
+def _indexed_points(vertices, order, group, first_use):
+    # number the groups of equal points in first use order
+    rank = numpy.empty(len(first_use), dtype=numpy.int32)
+    rank[numpy.argsort(first_use)] = numpy.arange(len(first_use), dtype=numpy.int32)
+
+    indices = numpy.empty(len(order), dtype=numpy.int32)
+    indices[order] = rank[group]
+
+    return indices, vertices[numpy.sort(first_use)]
+
+
 def _ascii_read(data):
     # an stl ascii file is like
     # HEADER: solid some name
@@ -156,6 +249,37 @@ def _ascii_read(data):
                    for l_item in (l, data.readline(), data.readline())]
 
 
+def _binary_write_arrays(data, faces):
+    # faces are written by blocks, from arrays of (n, 3, 3) coordinates
+    # or from python faces gathered in arrays
+    nb = 0
+    for block in _face_blocks(faces):
+        triangles = numpy.zeros(len(block), BINARY_DTYPE)
+        triangles['vertices'] = block
+        triangles.tofile(data)
+        nb += len(block)
+
+    return nb
+
+
+def _face_blocks(faces):
+    block = []
+    for face in faces:
+        if isinstance(face, numpy.ndarray):
+            if block:
+                yield numpy.array(block, dtype='<f4')
+                block = []
+            yield face.reshape(-1, 3, 3)
+        else:
+            block.append([vert[:] for vert in face])
+            if len(block) == BINARY_WRITE_BLOCK:
+                yield numpy.array(block, dtype='<f4')
+                block = []
+
+    if block:
+        yield numpy.array(block, dtype='<f4')
+
+
 def _binary_write(filename, faces):
     with open(filename, 'wb') as data:
         # header
@@ -163,17 +287,20 @@ def _binary_write(filename, faces):
         # call len(list(faces)) which may be expensive
         data.write(struct.calcsize('<80sI') * b'\0')
 
-        # 3 vertex == 9f
-        pack = struct.Struct('<9f').pack
-        # pad is to remove normal, we do use them
-        pad = b'\0' * struct.calcsize('<3f')
-
-        nb = 0
-        for verts in faces:
-            # write pad as normal + vertexes + pad as attributes
-            data.write(pad + pack(*itertools.chain.from_iterable(verts)))
-            data.write(b'\0\0')
-            nb += 1
+        if numpy is not None:
+            nb = _binary_write_arrays(data, faces)
+        else:
+            # 3 vertex == 9f
+            pack = struct.Struct('<9f').pack
+            # pad is to remove normal, we do use them
+            pad = b'\0' * struct.calcsize('<3f')
+
+            nb = 0
+            for verts in faces:
+                # write pad as normal + vertexes + pad as attributes
+                data.write(pad + pack(*itertools.chain.from_iterable(verts)))
+                data.write(b'\0\0')
+                nb += 1
 
         # header, with correct value now
         data.seek(0)
@@ -202,7 +329,9 @@ def write_stl(filename, faces, ascii=False):
        output filename
 
     faces
-       iterable of tuple of 3 vertex, vertex is tuple of 3 coordinates as float
+       iterable of tuple of 3 vertex, vertex is tuple of 3 coordinates as float.
+       With numpy, items can also be arrays of shape (n, 3, 3), n faces
+       written at once in binary files.
 
     ascii
        save the file in ascii format (very huge)
@@ -210,7 +339,7 @@ def write_stl(filename, faces, ascii=False):
     (_ascii_write if ascii else _binary_write)(filename, faces)
 
 
-def read_stl(filename):
+def read_stl(filename, use_cache=False):
     """
     Return the triangles and points of an stl binary file.
 
@@ -234,8 +363,25 @@ def read_stl(filename):
        >>>
        >>> # print the coordinate of the triangle n
        >>> print(pts[i] for i in tris[n])
+
+    With *use_cache*, the result is kept in the geometry cache and read
+    from there when the file didn't change.
     """
 
+    if numpy is not None:
+        tris, pts = read_stl_arrays(filename, use_cache)
+        return tris.tolist(), pts.tolist()
+
+    if use_cache:
+        import array
+        import geometry_cache
+
+        cached = geometry_cache.load(filename, "stl", ("lists",))
+        if cached is not None:
+            indices = iter(cached[1]["triangles"])
+            coords = iter(cached[1]["points"])
+            return [list(tri) for tri in zip(indices, indices, indices)], list(zip(coords, coords, coords))
+
     tris, pts = [], ListDict()
 
     with mmap_file(filename) as data:
@@ -249,9 +395,56 @@ def read_stl(filename):
             # first equal point inserted.
             tris.append([pts.add(p) for p in pt])
 
+    if use_cache:
+        geometry_cache.store(filename, "stl", ("lists",), {},
+                             {"triangles": array.array('i', itertools.chain.from_iterable(tris)),
+                              "points": array.array('d', itertools.chain.from_iterable(pts.list)),
+                              })
+
     return tris, pts.list
 
 
+def read_stl_arrays(filename, use_cache=False):
+    """
+    Like read_stl, but return numpy arrays, needs numpy.
+
+    - returns a tuple(triangles, points).
+
+      triangles
+          An int32 array of shape (n, 3), point indices of each triangle.
+
+      points
+          A float array of shape (m, 3), float32 for binary files,
+          float64 for ascii files (as read_stl).
+
+    Binary files are read in place from the mmap'ed file and points are
+    merged with a sort over their coordinates instead of one at a time,
+    this is an order of magnitude faster than read_stl without numpy.
+    """
+    if use_cache:
+        import geometry_cache
+
+        cached = geometry_cache.load(filename, "stl", ("arrays",))
+        if cached is not None:
+            return cached[1]["triangles"], cached[1]["points"]
+
+    with mmap_file(filename) as data:
+        if _is_ascii_file(data):
+            vertices = numpy.array(list(_ascii_read(data)), dtype=numpy.float64).reshape(-1, 3, 3)
+        else:
+            vertices = _binary_read_arrays(data)
+
+        tris, pts = _unique_points(vertices)
+        # release the view of the file before it's closed
+        del vertices
+
+    if use_cache:
+        geometry_cache.store(filename, "stl", ("arrays",), {},
+                             {"triangles": tris, "points": pts})
+
+    return tris, pts
+
+
 if __name__ == '__main__':
     import sys
     import bpy
@@ -22,7 +22,9 @@
 # Contributors: Bob Holcomb, Richard L?rk?ng, Damien McGinnes, Campbell Barton, Mario Lapin, Dominique Lorre, Andreas Atteneder
 
 import os
+import sys
 import time
+import array
 import struct
 
 import bpy
@@ -192,16 +194,31 @@ def read_string(file):
     #read in the characters till we get a null character
     s = b''
     while True:
-        c = struct.unpack('<c', file.read(1))[0]
-        if c == b'\x00':
+        data = file.read(64)
+        end = data.find(b'\x00')
+        if end != -1:
+            s += data[:end]
+            # go back to the end of the string
+            file.seek(end + 1 - len(data), 1)
             break
-        s += c
+        elif not data:
+            break
+        s += data
         #print 'string: ',s
 
     #remove the null character from the string
 # 	print("read string", s)
     return str(s, "utf-8", "replace"), len(s) + 1
 
+
+def read_array(file, typecode, count):
+    # count little endian values in one read
+    data = array.array(typecode)
+    data.fromfile(file, count)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data
+
 ######################################################
 # IMPORT
 ######################################################
@@ -217,8 +234,7 @@ def process_next_object_chunk(file, previous_chunk):
 
 def skip_to_end(file, skip_chunk):
     buffer_size = skip_chunk.length - skip_chunk.bytes_read
-    binary_format = "%ic" % buffer_size
-    file.read(struct.calcsize(binary_format))
+    file.seek(buffer_size, 1)
     skip_chunk.bytes_read += buffer_size
 
 
@@ -269,7 +285,7 @@ def process_next_chunk(file, previous_chunk, importedObjects, IMAGE_SEARCH):
     contextMatrix_rot = None  # Blender.mathutils.Matrix(); contextMatrix.identity()
     #contextMatrix_tx = None # Blender.mathutils.Matrix(); contextMatrix.identity()
     contextMesh_vertls = None  # flat array: (verts * 3)
-    contextMesh_facels = None
+    contextMesh_facels = None  # flat array: (faces * 3)
     contextMeshMaterials = []  # (matname, [face_idxs])
     contextMeshUV = None  # flat array (verts * 2)
 
@@ -303,12 +319,15 @@ def process_next_chunk(file, previous_chunk, importedObjects, IMAGE_SEARCH):
             bmesh.vertices.add(len(myContextMesh_vertls) // 3)
             bmesh.vertices.foreach_set("co", myContextMesh_vertls)
 
-            nbr_faces = len(myContextMesh_facels)
+            nbr_faces = len(myContextMesh_facels) // 3
             bmesh.polygons.add(nbr_faces)
             bmesh.loops.add(nbr_faces * 3)
-            eekadoodle_faces = []
-            for v1, v2, v3 in myContextMesh_facels:
-                eekadoodle_faces.extend((v3, v1, v2) if v3 == 0 else (v1, v2, v3))
+            eekadoodle_faces = array.array('i', myContextMesh_facels)
+            for fidx, v3 in enumerate(myContextMesh_facels[2::3]):
+                if v3 == 0:
+                    # eekadoodle, move the 0 index first
+                    i = fidx * 3
+                    eekadoodle_faces[i:i + 3] = array.array('i', (0, myContextMesh_facels[i], myContextMesh_facels[i + 1]))
             bmesh.polygons.foreach_set("loop_start", range(0, nbr_faces * 3, 3))
             bmesh.polygons.foreach_set("loop_total", (3,) * nbr_faces)
             bmesh.loops.foreach_set("vertex_index", eekadoodle_faces)
@@ -319,6 +338,7 @@ def process_next_chunk(file, previous_chunk, importedObjects, IMAGE_SEARCH):
             else:
                 uv_faces = None
 
+            material_indices = array.array('i', [0]) * nbr_faces
             for mat_idx, (matName, faces) in enumerate(myContextMeshMaterials):
                 if matName is None:
                     bmat = None
@@ -334,28 +354,21 @@ def process_next_chunk(file, previous_chunk, importedObjects, IMAGE_SEARCH):
 
                 bmesh.materials.append(bmat)  # can be None
 
+                for fidx in faces:
+                    material_indices[fidx] = mat_idx
+
                 if uv_faces  and img:
                     for fidx in faces:
-                        bmesh.polygons[fidx].material_index = mat_idx
                         uv_faces[fidx].image = img
-                else:
-                    for fidx in faces:
-                        bmesh.polygons[fidx].material_index = mat_idx
-
-            if uv_faces:
-                uvl = bmesh.uv_layers.active.data[:]
-                for fidx, pl in enumerate(bmesh.polygons):
-                    face = myContextMesh_facels[fidx]
-                    v1, v2, v3 = face
 
-                    # eekadoodle
-                    if v3 == 0:
-                        v1, v2, v3 = v3, v1, v2
+            bmesh.polygons.foreach_set("material_index", material_indices)
 
-                    uvl[pl.loop_start].uv = contextMeshUV[v1 * 2: (v1 * 2) + 2]
-                    uvl[pl.loop_start + 1].uv = contextMeshUV[v2 * 2: (v2 * 2) + 2]
-                    uvl[pl.loop_start + 2].uv = contextMeshUV[v3 * 2: (v3 * 2) + 2]
-                    # always a tri
+            if uv_faces:
+                # uv of the vertex of each loop, always a tri
+                uv_loops = array.array('f', [0.0]) * (nbr_faces * 6)
+                uv_loops[0::2] = array.array('f', map(contextMeshUV[0::2].__getitem__, eekadoodle_faces))
+                uv_loops[1::2] = array.array('f', map(contextMeshUV[1::2].__getitem__, eekadoodle_faces))
+                bmesh.uv_layers.active.data.foreach_set("uv", uv_loops)
 
         bmesh.validate()
         bmesh.update()
@@ -628,7 +641,7 @@ def process_next_chunk(file, previous_chunk, importedObjects, IMAGE_SEARCH):
             new_chunk.bytes_read += 2
 
             # print 'number of verts: ', num_verts
-            contextMesh_vertls = struct.unpack('<%df' % (num_verts * 3), file.read(STRUCT_SIZE_3FLOAT * num_verts))
+            contextMesh_vertls = read_array(file, 'f', num_verts * 3)
             new_chunk.bytes_read += STRUCT_SIZE_3FLOAT * num_verts
             # dummyvert is not used atm!
 
@@ -642,10 +655,13 @@ def process_next_chunk(file, previous_chunk, importedObjects, IMAGE_SEARCH):
             #print 'number of faces: ', num_faces
 
             # print '\ngetting a face'
-            temp_data = file.read(STRUCT_SIZE_4UNSIGNED_SHORT * num_faces)
+            temp_data = read_array(file, 'H', num_faces * 4)
             new_chunk.bytes_read += STRUCT_SIZE_4UNSIGNED_SHORT * num_faces  # 4 short ints x 2 bytes each
-            contextMesh_facels = struct.unpack('<%dH' % (num_faces * 4), temp_data)
-            contextMesh_facels = [contextMesh_facels[i - 3:i] for i in range(3, (num_faces * 4) + 3, 4)]
+            # flat array (faces * 3), without the face flags
+            contextMesh_facels = array.array('i', [0]) * (num_faces * 3)
+            contextMesh_facels[0::3] = array.array('i', temp_data[0::4])
+            contextMesh_facels[1::3] = array.array('i', temp_data[1::4])
+            contextMesh_facels[2::3] = array.array('i', temp_data[2::4])
 
         elif new_chunk.ID == OBJECT_MATERIAL:
             # print 'elif new_chunk.ID == OBJECT_MATERIAL:'
@@ -656,11 +672,9 @@ def process_next_chunk(file, previous_chunk, importedObjects, IMAGE_SEARCH):
             num_faces_using_mat = struct.unpack('<H', temp_data)[0]
             new_chunk.bytes_read += STRUCT_SIZE_UNSIGNED_SHORT
 
-            temp_data = file.read(STRUCT_SIZE_UNSIGNED_SHORT * num_faces_using_mat)
+            temp_data = read_array(file, 'H', num_faces_using_mat)
             new_chunk.bytes_read += STRUCT_SIZE_UNSIGNED_SHORT * num_faces_using_mat
 
-            temp_data = struct.unpack("<%dH" % (num_faces_using_mat), temp_data)
-
             contextMeshMaterials.append((material_name, temp_data))
 
             #look up the material in all the materials
@@ -670,9 +684,8 @@ def process_next_chunk(file, previous_chunk, importedObjects, IMAGE_SEARCH):
             num_uv = struct.unpack('<H', temp_data)[0]
             new_chunk.bytes_read += 2
 
-            temp_data = file.read(STRUCT_SIZE_2FLOAT * num_uv)
+            contextMeshUV = read_array(file, 'f', num_uv * 2)
             new_chunk.bytes_read += STRUCT_SIZE_2FLOAT * num_uv
-            contextMeshUV = struct.unpack('<%df' % (num_uv * 2), temp_data)
 
         elif new_chunk.ID == OBJECT_TRANS_MATRIX:
             # How do we know the matrix size? 54 == 4x4 48 == 4x3
@@ -799,10 +812,7 @@ def process_next_chunk(file, previous_chunk, importedObjects, IMAGE_SEARCH):
         else:  # (new_chunk.ID!=VERSION or new_chunk.ID!=OBJECTINFO or new_chunk.ID!=OBJECT or new_chunk.ID!=MATERIAL):
             # print 'skipping to end of this chunk'
             #print("unknown chunk: "+hex(new_chunk.ID))
-            buffer_size = new_chunk.length - new_chunk.bytes_read
-            binary_format = "%ic" % buffer_size
-            temp_data = file.read(struct.calcsize(binary_format))
-            new_chunk.bytes_read += buffer_size
+            skip_to_end(file, new_chunk)
 
         #update the previous chunk bytes read
         # print 'previous_chunk.bytes_read += new_chunk.bytes_read'
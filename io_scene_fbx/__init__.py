@@ -168,6 +168,17 @@ class ExportFBX(bpy.types.Operator, ExportHelper):
             soft_min=1, soft_max=16,
             default=6.0,
             )
+    use_binary = BoolProperty(
+            name="Binary",
+            description=("Write a binary FBX file (experimental), smaller and faster "
+                         "to write than ASCII, not supported by all importers"),
+            default=False,
+            )
+    use_compression = BoolProperty(
+            name="Compress Arrays",
+            description="Compress the large arrays (geometry, weights) of binary files with zlib",
+            default=True,
+            )
     path_mode = path_reference_mode
     use_rotate_workaround = BoolProperty(
             name="XNA Rotate Animation Hack",
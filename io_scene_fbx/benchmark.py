@@ -0,0 +1,115 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+# Export time and file size of the ASCII and binary FBX modes, not loaded by
+# the addon. Runs inside Blender on a generated scene (the current scene is
+# emptied): a grid mesh of grid x grid vertices and animated empties.
+#
+#     blender -b -P benchmark.py -- [grid] [empties] [frames]
+#
+# Scenes of the numbers given with the binary mode:
+#     400 50 250   (160k verts + 50 objects x 250 frames)
+#     700 0 0      (490k vert mesh, no animation)
+#     10 200 500   (200 objects x 500 frames, small mesh)
+
+import os
+import sys
+import math
+import time
+import shutil
+import tempfile
+
+import bpy
+
+MODES = (
+    ("ASCII", dict(use_binary=False)),
+    ("binary", dict(use_binary=True, use_compression=True)),
+    ("uncompressed", dict(use_binary=True, use_compression=False)),
+    )
+
+
+class Reporter:
+    def report(self, type, message):
+        print(message)
+
+
+def generate_scene(scene, grid, empties, frames):
+    for obj in list(scene.objects):
+        scene.objects.unlink(obj)
+
+    verts = [(x * 0.1, y * 0.1, math.sin(x * 0.3) * math.cos(y * 0.2))
+             for y in range(grid) for x in range(grid)]
+    faces = [(y * grid + x, y * grid + x + 1, (y + 1) * grid + x + 1, (y + 1) * grid + x)
+             for y in range(grid - 1) for x in range(grid - 1)]
+
+    mesh = bpy.data.meshes.new("Grid")
+    mesh.from_pydata(verts, [], faces)
+    mesh.update()
+    scene.objects.link(bpy.data.objects.new("Grid", mesh))
+
+    for i in range(empties):
+        obj = bpy.data.objects.new("Empty%03d" % i, None)
+        scene.objects.link(obj)
+
+        for frame in range(1, frames + 1):
+            obj.location = (math.sin(frame * 0.1 + i), math.cos(frame * 0.05), i * 0.1)
+            obj.rotation_euler = (frame * 0.02, i * 0.3, math.sin(frame * 0.07))
+            obj.keyframe_insert("location", frame=frame)
+            obj.keyframe_insert("rotation_euler", frame=frame)
+
+    scene.frame_start = 1
+    scene.frame_end = max(frames, 1)
+
+
+def export_times(grid=400, empties=50, frames=250):
+    from io_scene_fbx import export_fbx
+
+    scene = bpy.context.scene
+    generate_scene(scene, grid, empties, frames)
+
+    print("FBX export, %i verts, %i empties x %i frames" % (grid * grid, empties, frames))
+
+    directory = tempfile.mkdtemp()
+    try:
+        for name, options in MODES:
+            filepath = os.path.join(directory, "benchmark_%s.fbx" % name)
+
+            start = time.time()
+            export_fbx.save_single(Reporter(), scene, filepath,
+                                   context_objects=scene.objects,
+                                   object_types={'EMPTY', 'MESH'},
+                                   use_metadata=False,
+                                   use_anim_optimize=False,
+                                   **options)
+            elapsed = time.time() - start
+
+            print("\t%-13s %8.1f MB %6.2f s" % (name, os.path.getsize(filepath) / 1e6, elapsed))
+            os.remove(filepath)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    try:
+        start = sys.argv.index("--") + 1
+    except ValueError:
+        start = len(sys.argv)
+
+    export_times(*[int(arg) for arg in sys.argv[start:start + 3]])
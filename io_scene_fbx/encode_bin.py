@@ -0,0 +1,273 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+Binary FBX writing.
+
+The exporter writes the same text in binary mode, except for the large
+arrays and animation keys, which are given to a BinaryWriter instead of
+being formatted, it returns a short placeholder written in their place.
+On saving the text is parsed into nodes, the placeholders are replaced by
+typed array properties (zlib compressed when large enough) and the nodes
+are written in the binary format.
+
+Experimental, the output was checked against the ASCII export of the same
+scenes with the ufbx reader only (not the FBX SDK), armatures untested.
+"""
+
+import re
+import sys
+import zlib
+import array
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+FBX_VERSION = 6100
+
+HEAD_MAGIC = b'Kaydara FBX Binary  \x00\x1a\x00'
+FOOT_ID = b'\xfa\xbc\xab\x09\xd0\xc8\xd4\x66\xb1\x76\xfb\x83\x1c\xf7\x26\x7e'
+FOOT_MAGIC = b'\xf8\x5a\x8c\x6a\xde\xf5\xd9\x7e\xec\xe9\x0c\xe3\x75\x8f\x29\x0b'
+
+NODE_HEADER = struct.Struct('<3IB')
+NULL_RECORD = b'\0' * NODE_HEADER.size
+
+COMPRESS_MIN = 128  # bytes, smaller arrays aren't worth compressing
+COMPRESS_LEVEL = 1
+
+# fbx array type: array.array typecode, numpy dtype
+ARRAY_TYPES = {
+    'd': ('d', '<f8'),
+    'f': ('f', '<f4'),
+    'i': ('i', '<i4'),
+    'l': ('q', '<i8'),
+    'b': ('b', 'i1'),
+    }
+
+_tokens = re.compile(r'''
+    (?P<comment>;[^\n]*)
+  | (?P<string>"[^"]*")
+  | \x00(?P<data>\d+)\x00
+  | (?P<name>[A-Za-z_]\w*)[ \t]*:
+  | (?P<open>\{)
+  | (?P<close>\})
+  | (?P<float>[-+]?(?:(?:\d+\.\d*|\.\d+|\d+(?=[eE]))(?:[eE][-+]?\d+)?|nan|inf))
+  | (?P<int>[-+]?\d+)
+  | (?P<word>[^\s,:{}"]+)
+  | [\s,]+
+''', re.VERBOSE)
+
+
+def _pack_string(value):
+    # object names are stored as "Name\x00\x01Class" instead of "Class::Name"
+    if "::" in value:
+        cls, name = value.split("::", 1)
+        value = name + "\x00\x01" + cls
+
+    data = value.encode('utf8')
+    return b'S' + struct.pack('<I', len(data)) + data
+
+
+def _pack_int(value):
+    if -0x80000000 <= value <= 0x7fffffff:
+        return b'I' + struct.pack('<i', value)
+    return b'L' + struct.pack('<q', value)
+
+
+class BinaryWriter:
+    """
+    Collects the text written by the exporter (write) and the arrays and
+    keys given in binary mode (array and keys), see save.
+    """
+    __slots__ = ("text",
+                 "data",
+                 "use_compression",
+                 )
+
+    def __init__(self, use_compression=True):
+        self.text = []
+        self.data = []  # (property count, chunks) for each placeholder
+        self.use_compression = use_compression
+
+    def write(self, text):
+        self.text.append(text)
+
+    def _placeholder(self, count, chunks):
+        self.data.append((count, chunks))
+        return '\0%d\0' % (len(self.data) - 1)
+
+    def array(self, fbx_type, values):
+        """
+        Placeholder for an array property of values, fbx_type is one of
+        'd', 'f', 'i', 'l' (int64) or 'b' (bool).
+        """
+        typecode, dtype = ARRAY_TYPES[fbx_type]
+        if numpy is not None:
+            # converts arrays of other types without a python object per item
+            values = numpy.asarray(values, dtype)
+            data = values.tobytes()
+        else:
+            values = array.array(typecode, values)
+            if sys.byteorder != 'little':
+                values.byteswap()
+            data = values.tobytes()
+
+        encoding = 0
+        if self.use_compression and len(data) >= COMPRESS_MIN:
+            data = zlib.compress(data, COMPRESS_LEVEL)
+            encoding = 1
+
+        header = fbx_type.encode() + struct.pack('<3I', len(values), encoding, len(data))
+        return self._placeholder(1, [header, data])
+
+    def keys(self, times, values, interpolation='L'):
+        """
+        Placeholder for the keys of an animation channel,
+        time (in fbx time), value and interpolation of each key.
+        """
+        times = list(times)
+        count = len(times)
+        interpolation = interpolation.encode()
+
+        args = [None] * (count * 6)
+        args[0::6] = [b'L'] * count
+        args[1::6] = times
+        args[2::6] = [b'D'] * count
+        args[3::6] = list(values)
+        args[4::6] = [b'C'] * count
+        args[5::6] = [interpolation] * count
+
+        return self._placeholder(count * 3, [struct.pack('<' + 'cqcdcc' * count, *args)])
+
+    def nodes(self):
+        """
+        Parse the text into nodes:
+        [name, property count, property chunks, child nodes, size]
+        """
+        root = ["", 0, [], [], 0]
+        stack = [root]
+        node = None
+        data = self.data
+
+        for match in _tokens.finditer("".join(self.text)):
+            kind = match.lastgroup
+            if kind is None or kind == 'comment':
+                continue
+            elif kind == 'name':
+                node = [match.group(kind), 0, [], [], 0]
+                stack[-1][3].append(node)
+                continue
+            elif kind == 'open':
+                stack.append(node)
+                continue
+            elif kind == 'close':
+                stack.pop()
+                node = None
+                continue
+
+            value = match.group(kind)
+            if kind == 'data':
+                count, chunks = data[int(value)]
+                node[1] += count
+                node[2].extend(chunks)
+                continue
+            elif kind == 'string':
+                chunk = _pack_string(value[1:-1])
+            elif kind == 'int':
+                chunk = _pack_int(int(value))
+            elif kind == 'float':
+                chunk = b'D' + struct.pack('<d', float(value))
+            elif len(value) == 1:
+                # flags such as Y, N, L
+                chunk = b'C' + value.encode('utf8')
+            else:
+                chunk = _pack_string(value)
+
+            node[1] += 1
+            node[2].append(chunk)
+
+        if len(stack) != 1:
+            raise ValueError("Unbalanced braces in the FBX data")
+
+        return root[3]
+
+    def save(self, file, version=FBX_VERSION):
+        """Write the binary FBX to file (opened in binary mode)"""
+        nodes = self.nodes()
+        _calc_sizes(nodes)
+
+        write = file.write
+        write(HEAD_MAGIC)
+        write(struct.pack('<I', version))
+        offset = _write_nodes(write, len(HEAD_MAGIC) + 4, nodes)
+        write(NULL_RECORD)
+        offset += len(NULL_RECORD)
+
+        # footer, padded to 16 bytes (a full 16 when already aligned)
+        write(FOOT_ID)
+        write(b'\0' * 4)
+        offset += len(FOOT_ID) + 4
+        write(b'\0' * (16 - offset % 16))
+        write(struct.pack('<I', version))
+        write(b'\0' * 120)
+        write(FOOT_MAGIC)
+
+
+def _calc_sizes(nodes):
+    """Set the size in the file of each node, its children included"""
+    for node in nodes:
+        name, count, chunks, children = node[:4]
+        size = NODE_HEADER.size + len(name) + sum(len(chunk) for chunk in chunks)
+        if children:
+            _calc_sizes(children)
+            size += sum(child[4] for child in children) + len(NULL_RECORD)
+        elif not count and node is not nodes[-1]:
+            size += len(NULL_RECORD)
+        node[4] = size
+
+
+def _write_nodes(write, offset, nodes):
+    """Write nodes starting at offset, returns the offset after them"""
+    for node in nodes:
+        name, count, chunks, children, size = node
+        end_offset = offset + size
+        props_size = sum(len(chunk) for chunk in chunks)
+        name = name.encode('ascii')
+
+        write(NODE_HEADER.pack(end_offset, count, props_size, len(name)))
+        write(name)
+        for chunk in chunks:
+            write(chunk)
+
+        offset += NODE_HEADER.size + len(name) + props_size
+        if children:
+            offset = _write_nodes(write, offset, children)
+            write(NULL_RECORD)
+            offset += len(NULL_RECORD)
+        elif not count and node is not nodes[-1]:
+            write(NULL_RECORD)
+            offset += len(NULL_RECORD)
+
+        assert(offset == end_offset)
+
+    return offset
@@ -24,6 +24,8 @@
 import os
 import time
 import math  # math.pi
+import array
+import itertools
 
 import bpy
 from mathutils import Vector, Matrix
@@ -135,6 +137,69 @@ def mat4x4str(mat):
             tuple([f for v in mat.transposed() for f in v]))
 
 
+def foreach_array(seq, attr, size, typecode='f'):
+    # attribute of all items of a collection as one flat array
+    data = array.array(typecode, [0]) * (len(seq) * size)
+    seq.foreach_get(attr, data)
+    return data
+
+
+def reduce_keys(values, precision):
+    """
+    Indices of the keys of a channel (a value per frame) left once the
+    keys on a line between the keys next to them are removed.
+    """
+    if len(values) < 3:
+        return list(range(len(values)))
+
+    # no motion, only the first and last key are kept
+    if max(values) - min(values) < precision:
+        return [0, len(values) - 1]
+
+    # remove keys from the end, tests each key against the kept key
+    # after it and the one before it, after a removal the kept key is
+    # tested again (like deleting from a list of all keys)
+    left = len(values) - 2  # keys 0 to left aren't tested yet
+    right = [len(values) - 1]  # kept keys after them, nearest last
+    on_right = False  # testing right[-1] instead of left
+
+    while (left + 1 if on_right else left) > 0 and left + 1 + len(right) > 2:
+        if on_right:
+            j_prev, j, j_next = left, right[-1], right[-2]
+        else:
+            j_prev, j, j_next = left - 1, left, right[-1]
+
+        # co-linear horizontal...
+        if abs(values[j] - values[j_prev]) < precision and abs(values[j] - values[j_next]) < precision:
+            remove = True
+        else:
+            fac = (j_next - j) / float(j_next - j_prev)
+            remove = abs(values[j_prev] * fac + values[j_next] * (1.0 - fac) - values[j]) < precision
+
+        if remove:
+            if on_right:
+                right.pop()
+            else:
+                left -= 1
+            on_right = len(right) > 1
+        elif on_right:
+            on_right = False
+        else:
+            right.append(left)
+            left -= 1
+
+    return list(range(left + 1)) + right[::-1]
+
+
+def face_corners(data, size, face_quads):
+    # data stored for 4 corners of each tessface (size values each),
+    # without the unused 4th corner of triangles
+    mask = array.array('b', [1]) * len(data)
+    for i in range(size):
+        mask[3 * size + i::4 * size] = face_quads
+    return array.array(data.typecode, itertools.compress(data, mask))
+
+
 def action_bone_names(obj, action):
     from bpy.types import PoseBone
 
@@ -225,6 +290,8 @@ def save_single(operator, scene, filepath="",
         use_mesh_edges=True,
         use_rotate_workaround=False,
         use_default_take=True,
+        use_binary=False,
+        use_compression=True,
     ):
 
     import bpy_extras.io_utils
@@ -411,12 +478,18 @@ def save_single(operator, scene, filepath="",
 
             return matrix_rot
 
+        def flushAnimData(self):
+            self.__anim_poselist.clear()
+
     # ----------------------------------------------
 
     print('\nFBX export starting... %r' % filepath)
     start_time = time.clock()
     try:
-        file = open(filepath, "w", encoding="utf8", newline="\n")
+        if use_binary:
+            file = open(filepath, "wb")
+        else:
+            file = open(filepath, "w", encoding="utf8", newline="\n")
     except:
         import traceback
         traceback.print_exc()
@@ -424,7 +497,14 @@ def save_single(operator, scene, filepath="",
         return {'CANCELLED'}
 
     # convenience
-    fw = file.write
+    if use_binary:
+        # the text is converted on saving, large arrays are given to fbx_bin
+        from . import encode_bin
+        fbx_bin = encode_bin.BinaryWriter(use_compression)
+        fw = fbx_bin.write
+    else:
+        fbx_bin = None
+        fw = file.write
 
     # scene = context.scene  # now passed as an arg instead of context
     world = scene.world
@@ -1307,32 +1387,38 @@ def save_single(operator, scene, filepath="",
             else:
                 vgroup_data = []
 
-        fw('\n\t\tIndexes: ')
+        if fbx_bin:
+            fw('\n\t\tIndexes: ')
+            fw(fbx_bin.array('i', [vg[0] for vg in vgroup_data]))
+            fw('\n\t\tWeights: ')
+            fw(fbx_bin.array('d', [vg[1] for vg in vgroup_data]))
+        else:
+            fw('\n\t\tIndexes: ')
 
-        i = -1
-        for vg in vgroup_data:
-            if i == -1:
-                fw('%i' % vg[0])
-                i = 0
-            else:
-                if i == 23:
-                    fw('\n\t\t')
+            i = -1
+            for vg in vgroup_data:
+                if i == -1:
+                    fw('%i' % vg[0])
                     i = 0
-                fw(',%i' % vg[0])
-            i += 1
-
-        fw('\n\t\tWeights: ')
-        i = -1
-        for vg in vgroup_data:
-            if i == -1:
-                fw('%.8f' % vg[1])
-                i = 0
-            else:
-                if i == 38:
-                    fw('\n\t\t')
+                else:
+                    if i == 23:
+                        fw('\n\t\t')
+                        i = 0
+                    fw(',%i' % vg[0])
+                i += 1
+
+            fw('\n\t\tWeights: ')
+            i = -1
+            for vg in vgroup_data:
+                if i == -1:
+                    fw('%.8f' % vg[1])
                     i = 0
-                fw(',%.8f' % vg[1])
-            i += 1
+                else:
+                    if i == 38:
+                        fw('\n\t\t')
+                        i = 0
+                    fw(',%.8f' % vg[1])
+                i += 1
 
         # Set TransformLink to the global transform of the bone and Transform
         # equal to the mesh's transform in bone space.
@@ -1369,6 +1455,11 @@ def save_single(operator, scene, filepath="",
         me_edges = me.edges[:] if use_mesh_edges else ()
         me_faces = me.tessfaces[:]
 
+        if fbx_bin:
+            # a tessface is a triangle when its 4th index is 0
+            face_verts = foreach_array(me.tessfaces, "vertices_raw", 4, 'i')
+            face_quads = array.array('b', map(bool, face_verts[3::4]))
+
         poseMatrix = write_object_props(my_mesh.blenObject, None, my_mesh.parRelMatrix())[3]
 
         # Calculate the global transform for the mesh in the bind pose the same way we do
@@ -1389,70 +1480,93 @@ def save_single(operator, scene, filepath="",
            )
 
         # Write the Real Mesh data here
-        fw('\n\t\tVertices: ')
-        i = -1
+        if fbx_bin:
+            fw('\n\t\tVertices: ')
+            fw(fbx_bin.array('d', foreach_array(me.vertices, "co", 3)))
 
-        for v in me_vertices:
-            if i == -1:
-                fw('%.6f,%.6f,%.6f' % v.co[:])
-                i = 0
-            else:
-                if i == 7:
-                    fw('\n\t\t')
-                    i = 0
-                fw(',%.6f,%.6f,%.6f' % v.co[:])
-            i += 1
+            # last index XORd w. -1 indicates end of face
+            poly_verts = face_corners(face_verts, 1, face_quads)
+            face_end = 0
+            for quad in face_quads:
+                face_end += 3 + quad
+                poly_verts[face_end - 1] ^= -1
 
-        fw('\n\t\tPolygonVertexIndex: ')
-        i = -1
-        for f in me_faces:
-            fi = f.vertices[:]
+            # write loose edges as faces.
+            for ed in me_edges:
+                if ed.is_loose:
+                    ed_val = ed.vertices[:]
+                    poly_verts.extend((ed_val[0], ed_val[-1] ^ -1))
 
-            # last index XORd w. -1 indicates end of face
-            if i == -1:
-                if len(fi) == 3:
-                    fw('%i,%i,%i' % (fi[0], fi[1], fi[2] ^ -1))
-                else:
-                    fw('%i,%i,%i,%i' % (fi[0], fi[1], fi[2], fi[3] ^ -1))
-                i = 0
-            else:
-                if i == 13:
-                    fw('\n\t\t')
+            fw('\n\t\tPolygonVertexIndex: ')
+            fw(fbx_bin.array('i', poly_verts))
+
+            fw('\n\t\tEdges: ')
+            fw(fbx_bin.array('i', foreach_array(me.edges, "vertices", 2, 'i') if use_mesh_edges else ()))
+        else:
+            fw('\n\t\tVertices: ')
+            i = -1
+
+            for v in me_vertices:
+                if i == -1:
+                    fw('%.6f,%.6f,%.6f' % v.co[:])
                     i = 0
-                if len(fi) == 3:
-                    fw(',%i,%i,%i' % (fi[0], fi[1], fi[2] ^ -1))
                 else:
-                    fw(',%i,%i,%i,%i' % (fi[0], fi[1], fi[2], fi[3] ^ -1))
-            i += 1
+                    if i == 7:
+                        fw('\n\t\t')
+                        i = 0
+                    fw(',%.6f,%.6f,%.6f' % v.co[:])
+                i += 1
 
-        # write loose edges as faces.
-        for ed in me_edges:
-            if ed.is_loose:
-                ed_val = ed.vertices[:]
-                ed_val = ed_val[0], ed_val[-1] ^ -1
+            fw('\n\t\tPolygonVertexIndex: ')
+            i = -1
+            for f in me_faces:
+                fi = f.vertices[:]
 
+                # last index XORd w. -1 indicates end of face
                 if i == -1:
-                    fw('%i,%i' % ed_val)
+                    if len(fi) == 3:
+                        fw('%i,%i,%i' % (fi[0], fi[1], fi[2] ^ -1))
+                    else:
+                        fw('%i,%i,%i,%i' % (fi[0], fi[1], fi[2], fi[3] ^ -1))
                     i = 0
                 else:
                     if i == 13:
                         fw('\n\t\t')
                         i = 0
-                    fw(',%i,%i' % ed_val)
-            i += 1
-
-        fw('\n\t\tEdges: ')
-        i = -1
-        for ed in me_edges:
-            if i == -1:
-                fw('%i,%i' % (ed.vertices[0], ed.vertices[1]))
-                i = 0
-            else:
-                if i == 13:
-                    fw('\n\t\t')
+                    if len(fi) == 3:
+                        fw(',%i,%i,%i' % (fi[0], fi[1], fi[2] ^ -1))
+                    else:
+                        fw(',%i,%i,%i,%i' % (fi[0], fi[1], fi[2], fi[3] ^ -1))
+                i += 1
+
+            # write loose edges as faces.
+            for ed in me_edges:
+                if ed.is_loose:
+                    ed_val = ed.vertices[:]
+                    ed_val = ed_val[0], ed_val[-1] ^ -1
+
+                    if i == -1:
+                        fw('%i,%i' % ed_val)
+                        i = 0
+                    else:
+                        if i == 13:
+                            fw('\n\t\t')
+                            i = 0
+                        fw(',%i,%i' % ed_val)
+                i += 1
+
+            fw('\n\t\tEdges: ')
+            i = -1
+            for ed in me_edges:
+                if i == -1:
+                    fw('%i,%i' % (ed.vertices[0], ed.vertices[1]))
                     i = 0
-                fw(',%i,%i' % (ed.vertices[0], ed.vertices[1]))
-            i += 1
+                else:
+                    if i == 13:
+                        fw('\n\t\t')
+                        i = 0
+                    fw(',%i,%i' % (ed.vertices[0], ed.vertices[1]))
+                i += 1
 
         fw('\n\t\tGeometryVersion: 124')
 
@@ -1464,17 +1578,20 @@ def save_single(operator, scene, filepath="",
 			ReferenceInformationType: "Direct"
 			Normals: ''')
 
-        i = -1
-        for v in me_vertices:
-            if i == -1:
-                fw('%.15f,%.15f,%.15f' % v.normal[:])
-                i = 0
-            else:
-                if i == 2:
-                    fw('\n\t\t\t ')
+        if fbx_bin:
+            fw(fbx_bin.array('d', foreach_array(me.vertices, "normal", 3)))
+        else:
+            i = -1
+            for v in me_vertices:
+                if i == -1:
+                    fw('%.15f,%.15f,%.15f' % v.normal[:])
                     i = 0
-                fw(',%.15f,%.15f,%.15f' % v.normal[:])
-            i += 1
+                else:
+                    if i == 2:
+                        fw('\n\t\t\t ')
+                        i = 0
+                    fw(',%.15f,%.15f,%.15f' % v.normal[:])
+                i += 1
         fw('\n\t\t}')
 
         # Write Face Smoothing
@@ -1487,17 +1604,20 @@ def save_single(operator, scene, filepath="",
 			ReferenceInformationType: "Direct"
 			Smoothing: ''')
 
-            i = -1
-            for f in me_faces:
-                if i == -1:
-                    fw('%i' % f.use_smooth)
-                    i = 0
-                else:
-                    if i == 54:
-                        fw('\n\t\t\t ')
+            if fbx_bin:
+                fw(fbx_bin.array('i', foreach_array(me.tessfaces, "use_smooth", 1, 'i')))
+            else:
+                i = -1
+                for f in me_faces:
+                    if i == -1:
+                        fw('%i' % f.use_smooth)
                         i = 0
-                    fw(',%i' % f.use_smooth)
-                i += 1
+                    else:
+                        if i == 54:
+                            fw('\n\t\t\t ')
+                            i = 0
+                        fw(',%i' % f.use_smooth)
+                    i += 1
 
             fw('\n\t\t}')
 
@@ -1511,17 +1631,20 @@ def save_single(operator, scene, filepath="",
 			ReferenceInformationType: "Direct"
 			Smoothing: ''')
 
-            i = -1
-            for ed in me_edges:
-                if i == -1:
-                    fw('%i' % (ed.use_edge_sharp))
-                    i = 0
-                else:
-                    if i == 54:
-                        fw('\n\t\t\t ')
+            if fbx_bin:
+                fw(fbx_bin.array('i', [ed.use_edge_sharp for ed in me_edges]))
+            else:
+                i = -1
+                for ed in me_edges:
+                    if i == -1:
+                        fw('%i' % (ed.use_edge_sharp))
                         i = 0
-                    fw(',%i' % ed.use_edge_sharp)
-                i += 1
+                    else:
+                        if i == 54:
+                            fw('\n\t\t\t ')
+                            i = 0
+                        fw(',%i' % ed.use_edge_sharp)
+                    i += 1
 
             fw('\n\t\t}')
         elif mesh_smooth_type == 'OFF':
@@ -1544,39 +1667,52 @@ def save_single(operator, scene, filepath="",
 			ReferenceInformationType: "IndexToDirect"
 			Colors: ''')
 
-                i = -1
-                ii = 0  # Count how many Colors we write
-                print(len(me_faces), len(collayer.data))
-                for fi, cf in enumerate(collayer.data):
-                    if len(me_faces[fi].vertices) == 4:
-                        colors = cf.color1[:], cf.color2[:], cf.color3[:], cf.color4[:]
-                    else:
-                        colors = cf.color1[:], cf.color2[:], cf.color3[:]
+                if fbx_bin:
+                    # rgba of the 4 corners of each face
+                    colors = array.array('f', [1.0]) * (len(face_quads) * 16)
+                    for j in range(4):
+                        face_colors = foreach_array(collayer.data, "color%d" % (j + 1), 3)
+                        for k in range(3):
+                            colors[j * 4 + k::16] = face_colors[k::3]
+                    colors = face_corners(colors, 4, face_quads)
+                    fw(fbx_bin.array('d', colors))
+
+                    fw('\n\t\t\tColorIndex: ')
+                    fw(fbx_bin.array('i', range(len(colors) // 4)))
+                else:
+                    i = -1
+                    ii = 0  # Count how many Colors we write
+                    print(len(me_faces), len(collayer.data))
+                    for fi, cf in enumerate(collayer.data):
+                        if len(me_faces[fi].vertices) == 4:
+                            colors = cf.color1[:], cf.color2[:], cf.color3[:], cf.color4[:]
+                        else:
+                            colors = cf.color1[:], cf.color2[:], cf.color3[:]
+
+                        for col in colors:
+                            if i == -1:
+                                fw('%.4f,%.4f,%.4f,1' % col)
+                                i = 0
+                            else:
+                                if i == 7:
+                                    fw('\n\t\t\t\t')
+                                    i = 0
+                                fw(',%.4f,%.4f,%.4f,1' % col)
+                            i += 1
+                            ii += 1  # One more Color
 
-                    for col in colors:
+                    fw('\n\t\t\tColorIndex: ')
+                    i = -1
+                    for j in range(ii):
                         if i == -1:
-                            fw('%.4f,%.4f,%.4f,1' % col)
+                            fw('%i' % j)
                             i = 0
                         else:
-                            if i == 7:
+                            if i == 55:
                                 fw('\n\t\t\t\t')
                                 i = 0
-                            fw(',%.4f,%.4f,%.4f,1' % col)
+                            fw(',%i' % j)
                         i += 1
-                        ii += 1  # One more Color
-
-                fw('\n\t\t\tColorIndex: ')
-                i = -1
-                for j in range(ii):
-                    if i == -1:
-                        fw('%i' % j)
-                        i = 0
-                    else:
-                        if i == 55:
-                            fw('\n\t\t\t\t')
-                            i = 0
-                        fw(',%i' % j)
-                    i += 1
 
                 fw('\n\t\t}')
 
@@ -1594,35 +1730,42 @@ def save_single(operator, scene, filepath="",
 			ReferenceInformationType: "IndexToDirect"
 			UV: ''')
 
-                i = -1
-                ii = 0  # Count how many UVs we write
+                if fbx_bin:
+                    uvs = face_corners(foreach_array(uvlayer.data, "uv_raw", 8), 2, face_quads)
+                    fw(fbx_bin.array('d', uvs))
+
+                    fw('\n\t\t\tUVIndex: ')
+                    fw(fbx_bin.array('i', range(len(uvs) // 2)))
+                else:
+                    i = -1
+                    ii = 0  # Count how many UVs we write
+
+                    for uf in uvlayer.data:
+                        # workaround, since uf.uv iteration is wrong atm
+                        for uv in uf.uv:
+                            if i == -1:
+                                fw('%.6f,%.6f' % uv[:])
+                                i = 0
+                            else:
+                                if i == 7:
+                                    fw('\n\t\t\t ')
+                                    i = 0
+                                fw(',%.6f,%.6f' % uv[:])
+                            i += 1
+                            ii += 1  # One more UV
 
-                for uf in uvlayer.data:
-                    # workaround, since uf.uv iteration is wrong atm
-                    for uv in uf.uv:
+                    fw('\n\t\t\tUVIndex: ')
+                    i = -1
+                    for j in range(ii):
                         if i == -1:
-                            fw('%.6f,%.6f' % uv[:])
+                            fw('%i' % j)
                             i = 0
                         else:
-                            if i == 7:
-                                fw('\n\t\t\t ')
+                            if i == 55:
+                                fw('\n\t\t\t\t')
                                 i = 0
-                            fw(',%.6f,%.6f' % uv[:])
+                            fw(',%i' % j)
                         i += 1
-                        ii += 1  # One more UV
-
-                fw('\n\t\t\tUVIndex: ')
-                i = -1
-                for j in range(ii):
-                    if i == -1:
-                        fw('%i' % j)
-                        i = 0
-                    else:
-                        if i == 55:
-                            fw('\n\t\t\t\t')
-                            i = 0
-                        fw(',%i' % j)
-                    i += 1
 
                 fw('\n\t\t}')
 
@@ -1642,7 +1785,7 @@ def save_single(operator, scene, filepath="",
                     fw('\n\t\t\tTextureId: ')
 
                     if len(my_mesh.blenTextures) == 1:
-                        fw('0')
+                        fw(fbx_bin.array('i', (0,)) if fbx_bin else '0')
                     else:
                         texture_mapping_local = {None: -1}
 
@@ -1652,20 +1795,23 @@ def save_single(operator, scene, filepath="",
                                 texture_mapping_local[tex] = i
                                 i += 1
 
-                        i = -1
-                        for f in uvlayer.data:
-                            img_key = f.image
+                        if fbx_bin:
+                            fw(fbx_bin.array('i', [texture_mapping_local[f.image] for f in uvlayer.data]))
+                        else:
+                            i = -1
+                            for f in uvlayer.data:
+                                img_key = f.image
 
-                            if i == -1:
-                                i = 0
-                                fw('%s' % texture_mapping_local[img_key])
-                            else:
-                                if i == 55:
-                                    fw('\n			 ')
+                                if i == -1:
                                     i = 0
+                                    fw('%s' % texture_mapping_local[img_key])
+                                else:
+                                    if i == 55:
+                                        fw('\n			 ')
+                                        i = 0
 
-                                fw(',%s' % texture_mapping_local[img_key])
-                            i += 1
+                                    fw(',%s' % texture_mapping_local[img_key])
+                                i += 1
 
                 else:
                     fw('''
@@ -1694,7 +1840,7 @@ def save_single(operator, scene, filepath="",
             fw('\n\t\t\tMaterials: ')
 
             if len(my_mesh.blenMaterials) == 1:
-                fw('0')
+                fw(fbx_bin.array('i', (0,)) if fbx_bin else '0')
             else:
                 # Build a material mapping for this
                 material_mapping_local = {}  # local-mat & tex : global index.
@@ -1710,6 +1856,7 @@ def save_single(operator, scene, filepath="",
                     uv_faces = [None] * len(me_faces)
 
                 i = -1
+                face_materials = array.array('i')
                 for f, uf in zip(me_faces, uv_faces):
                     try:
                         mat = mats[f.material_index]
@@ -1721,7 +1868,9 @@ def save_single(operator, scene, filepath="",
                     else:
                         tex = None
 
-                    if i == -1:
+                    if fbx_bin:
+                        face_materials.append(material_mapping_local[mat, tex])
+                    elif i == -1:
                         i = 0
                         fw('%s' % material_mapping_local[mat, tex])  # None for mat or tex is ok
                     else:
@@ -1732,6 +1881,9 @@ def save_single(operator, scene, filepath="",
                         fw(',%s' % material_mapping_local[mat, tex])
                     i += 1
 
+                if fbx_bin:
+                    fw(fbx_bin.array('i', face_materials))
+
             fw('\n\t\t}')
 
         fw('''
@@ -1828,48 +1980,67 @@ def save_single(operator, scene, filepath="",
             for kb in key_blocks[1:]:
 
                 fw('\n\t\tShape: "%s" {' % kb.name)
-                fw('\n\t\t\tIndexes: ')
+                if fbx_bin:
+                    basis_co = foreach_array(key_blocks[0].data, "co", 3)
+                    kb_co = foreach_array(kb.data, "co", 3)
+                    shape_indexes = array.array('i')
+                    delta_verts = array.array('d')
+                    for j in range(0, len(kb_co), 3):
+                        delta = kb_co[j] - basis_co[j], kb_co[j + 1] - basis_co[j + 1], kb_co[j + 2] - basis_co[j + 2]
+                        if delta[0] * delta[0] + delta[1] * delta[1] + delta[2] * delta[2] > 0.000001 ** 2:
+                            shape_indexes.append(j // 3)
+                            delta_verts.extend(delta)
+
+                    fw('\n\t\t\tIndexes: ')
+                    fw(fbx_bin.array('i', shape_indexes))
+                    fw('\n\t\t\tVertices: ')
+                    fw(fbx_bin.array('d', delta_verts))
+                    # all zero, why? - campbell
+                    fw('\n\t\t\tNormals: ')
+                    fw(fbx_bin.array('d', array.array('d', [0.0]) * len(delta_verts)))
+                else:
+                    fw('\n\t\t\tIndexes: ')
+
+                    basis_verts = key_blocks[0].data
+                    range_verts = []
+                    delta_verts = []
+                    i = -1
+                    for j, kv in enumerate(kb.data):
+                        delta = kv.co - basis_verts[j].co
+                        if delta.length > 0.000001:
+                            if i == -1:
+                                fw('%d' % j)
+                            else:
+                                if i == 7:
+                                    fw('\n\t\t\t')
+                                    i = 0
+                                fw(',%d' % j)
+                            delta_verts.append(delta[:])
+                            i += 1
 
-                basis_verts = key_blocks[0].data
-                range_verts = []
-                delta_verts = []
-                i = -1
-                for j, kv in enumerate(kb.data):
-                    delta = kv.co - basis_verts[j].co
-                    if delta.length > 0.000001:
+                    fw('\n\t\t\tVertices: ')
+                    i = -1
+                    for dv in delta_verts:
                         if i == -1:
-                            fw('%d' % j)
+                            fw("%.6f,%.6f,%.6f" % dv)
                         else:
-                            if i == 7:
+                            if i == 4:
                                 fw('\n\t\t\t')
                                 i = 0
-                            fw(',%d' % j)
-                        delta_verts.append(delta[:])
+                            fw(",%.6f,%.6f,%.6f" % dv)
                         i += 1
 
-                fw('\n\t\t\tVertices: ')
-                i = -1
-                for dv in delta_verts:
-                    if i == -1:
-                        fw("%.6f,%.6f,%.6f" % dv)
-                    else:
-                        if i == 4:
-                            fw('\n\t\t\t')
-                            i = 0
-                        fw(",%.6f,%.6f,%.6f" % dv)
-                    i += 1
-
-                # all zero, why? - campbell
-                fw('\n\t\t\tNormals: ')
-                for j in range(len(delta_verts)):
-                    if i == -1:
-                        fw("0,0,0")
-                    else:
-                        if i == 4:
-                            fw('\n\t\t\t')
-                            i = 0
-                        fw(",0,0,0")
-                    i += 1
+                    # all zero, why? - campbell
+                    fw('\n\t\t\tNormals: ')
+                    for j in range(len(delta_verts)):
+                        if i == -1:
+                            fw("0,0,0")
+                        else:
+                            if i == 4:
+                                fw('\n\t\t\t')
+                                i = 0
+                            fw(",0,0,0")
+                        i += 1
                 fw('\n\t\t}')
 
         fw('\n\t}')
@@ -2576,6 +2747,26 @@ Connections:  {''')
         # 0.5 + val is the same as rounding.
         return int(0.5 + ((t / fps) * 46186158000))
 
+    def anim_channels(my_ob, act_start, act_end):
+        # translation, rotation (in degrees) and scale of the poses set for
+        # the frames, as 9 float arrays (x, y, z of each) with a value per frame
+        data = array.array('d')
+        prev_eul = None
+        for frame in range(act_start, act_end + 1):
+            mtx = my_ob.getAnimParRelMatrix(frame)
+
+            # we need to use the previous euler for compatible conversion.
+            if prev_eul:
+                prev_eul = my_ob.getAnimParRelMatrixRot(frame).to_euler('XYZ', prev_eul)
+            else:
+                prev_eul = my_ob.getAnimParRelMatrixRot(frame).to_euler()
+
+            data.extend(mtx.to_translation())
+            data.extend(tuple_rad_to_deg(prev_eul))
+            data.extend(mtx.to_scale())
+
+        return [data[i::9] for i in range(9)]
+
     fps = float(render.fps)
     start = scene.frame_start
     end = scene.frame_end
@@ -2644,6 +2835,37 @@ Connections:  {''')
         if use_default_take:
             tmp_actions.insert(0, None)  # None is the default action
 
+        # objects animated in every take, armature meshes are written unanimated
+        anim_obs = [my_ob for ob_generic in (ob_bones, ob_meshes, ob_null, ob_cameras, ob_lights, ob_arms)
+                    for my_ob in ob_generic if not (ob_generic is ob_meshes and my_ob.fbxArm)]
+        anim_fake_obs = set(my_ob for my_ob in ob_meshes if my_ob.fbxArm)
+
+        # takes only change the actions of armatures, find the ones each object depends on
+        arm_obmapping = dict((my_arm.blenObject, my_arm) for my_arm in ob_arms)
+
+        def anim_dependencies(my_ob):
+            if isinstance(my_ob, my_bone_class):
+                my_ob = my_ob.fbxArm
+
+            deps = set()
+            ob = my_ob.blenObject
+            while ob:
+                if ob.constraints or (ob.animation_data and ob.animation_data.drivers) or \
+                        (ob.type == 'ARMATURE' and [pose_bone for pose_bone in ob.pose.bones if pose_bone.constraints]):
+                    # can depend on any object
+                    return ob_arms
+                if ob in arm_obmapping:
+                    deps.add(arm_obmapping[ob])
+                ob = ob.parent
+
+            return [my_arm for my_arm in ob_arms if my_arm in deps]
+
+        anim_deps = dict((my_ob, anim_dependencies(my_ob)) for my_ob in anim_obs)
+
+        # channels of the objects sampled by the takes,
+        # {(object, act_start, act_end, actions of its armatures...): channels, ...}
+        anim_samples = {}
+
         fw('''
 ;Takes and animation section
 ;----------------------------------------------------
@@ -2695,152 +2917,111 @@ Takes:  {''')
 		;Models animation
 		;----------------------------------------------------''')
 
-            # set pose data for all bones
-            # do this here in case the action changes
-            '''
-            for my_bone in ob_bones:
-                my_bone.flushAnimData()
-            '''
-            i = act_start
-            while i <= act_end:
-                scene.frame_set(i)
-                for ob_generic in ob_anim_lists:
-                    for my_ob in ob_generic:
-                        #Blender.Window.RedrawAll()
-                        if ob_generic == ob_meshes and my_ob.fbxArm:
+            # sample the objects which weren't sampled by an earlier take with
+            # the same frame range and actions, each frame is evaluated once
+            arm_actions = {my_arm: my_arm.blenObject.animation_data and my_arm.blenObject.animation_data.action for my_arm in ob_arms}
+            take_samples = {my_ob: (my_ob, act_start, act_end) + tuple(arm_actions[my_arm] for my_arm in anim_deps[my_ob]) for my_ob in anim_obs}
+            sample_obs = [my_ob for my_ob in anim_obs if take_samples[my_ob] not in anim_samples]
+
+            if sample_obs:
+                # their poses and the poses of their parents are needed
+                pose_obs = []
+                pose_obs_set = set()
+                for my_ob in sample_obs:
+                    while my_ob and my_ob not in pose_obs_set:
+                        pose_obs_set.add(my_ob)
+                        pose_obs.append(my_ob)
+                        if isinstance(my_ob, my_bone_class):
+                            my_ob = my_ob.parent
+                        else:
+                            my_ob = my_ob.fbxParent
+
+                for frame in range(act_start, act_end + 1):
+                    scene.frame_set(frame)
+                    for my_ob in pose_obs:
+                        if my_ob in anim_fake_obs:
                             # We cant animate armature meshes!
-                            my_ob.setPoseFrame(i, fake=True)
+                            my_ob.setPoseFrame(frame, fake=True)
                         else:
-                            my_ob.setPoseFrame(i)
+                            my_ob.setPoseFrame(frame)
 
-                i += 1
+                for my_ob in sample_obs:
+                    anim_samples[take_samples[my_ob]] = anim_channels(my_ob, act_start, act_end)
 
-            #for bonename, bone, obname, me, armob in ob_bones:
-            for ob_generic in (ob_bones, ob_meshes, ob_null, ob_cameras, ob_lights, ob_arms):
+                for my_ob in pose_obs:
+                    my_ob.flushAnimData()
 
-                for my_ob in ob_generic:
+            if use_anim_optimize:
+                # frame is already one less then blenders frame
+                key_times = [fbx_time(j) for j in range(1 + act_end - act_start)]
+            else:
+                key_times = [fbx_time(frame - 1) for frame in range(act_start, act_end + 1)]
 
-                    if ob_generic == ob_meshes and my_ob.fbxArm:
-                        # do nothing,
-                        pass
-                    else:
+            for my_ob in anim_obs:
+                fw('\n\t\tModel: "Model::%s" {' % my_ob.fbxName)  # ??? - not sure why this is needed
+                fw('\n\t\t\tVersion: 1.1')
+                fw('\n\t\t\tChannel: "Transform" {')
 
-                        fw('\n\t\tModel: "Model::%s" {' % my_ob.fbxName)  # ??? - not sure why this is needed
-                        fw('\n\t\t\tVersion: 1.1')
-                        fw('\n\t\t\tChannel: "Transform" {')
-
-                        context_bone_anim_mats = [(my_ob.getAnimParRelMatrix(frame), my_ob.getAnimParRelMatrixRot(frame)) for frame in range(act_start, act_end + 1)]
-
-                        # ----------------
-                        # ----------------
-                        for TX_LAYER, TX_CHAN in enumerate('TRS'):  # transform, rotate, scale
-
-                            if TX_CHAN == 'T':
-                                context_bone_anim_vecs = [mtx[0].to_translation() for mtx in context_bone_anim_mats]
-                            elif	TX_CHAN == 'S':
-                                context_bone_anim_vecs = [mtx[0].to_scale() for mtx in context_bone_anim_mats]
-                            elif	TX_CHAN == 'R':
-                                # Was....
-                                # elif 	TX_CHAN=='R':	context_bone_anim_vecs = [mtx[1].to_euler()			for mtx in context_bone_anim_mats]
-                                #
-                                # ...but we need to use the previous euler for compatible conversion.
-                                context_bone_anim_vecs = []
-                                prev_eul = None
-                                for mtx in context_bone_anim_mats:
-                                    if prev_eul:
-                                        prev_eul = mtx[1].to_euler('XYZ', prev_eul)
-                                    else:
-                                        prev_eul = mtx[1].to_euler()
-                                    context_bone_anim_vecs.append(tuple_rad_to_deg(prev_eul))
-
-                            fw('\n\t\t\t\tChannel: "%s" {' % TX_CHAN)  # translation
-
-                            for i in range(3):
-                                # Loop on each axis of the bone
-                                fw('\n\t\t\t\t\tChannel: "%s" {' % ('XYZ'[i]))  # translation
-                                fw('\n\t\t\t\t\t\tDefault: %.15f' % context_bone_anim_vecs[0][i])
-                                fw('\n\t\t\t\t\t\tKeyVer: 4005')
-
-                                if not use_anim_optimize:
-                                    # Just write all frames, simple but in-eficient
-                                    fw('\n\t\t\t\t\t\tKeyCount: %i' % (1 + act_end - act_start))
-                                    fw('\n\t\t\t\t\t\tKey: ')
-                                    frame = act_start
-                                    while frame <= act_end:
-                                        if frame != act_start:
-                                            fw(',')
-
-                                        # Curve types are 'C,n' for constant, 'L' for linear
-                                        # C,n is for bezier? - linear is best for now so we can do simple keyframe removal
-                                        fw('\n\t\t\t\t\t\t\t%i,%.15f,L' % (fbx_time(frame - 1), context_bone_anim_vecs[frame - act_start][i]))
-                                        frame += 1
-                                else:
-                                    # remove unneeded keys, j is the frame, needed when some frames are removed.
-                                    context_bone_anim_keys = [(vec[i], j) for j, vec in enumerate(context_bone_anim_vecs)]
-
-                                    # last frame to fisrt frame, missing 1 frame on either side.
-                                    # removeing in a backwards loop is faster
-                                    #for j in xrange( (act_end-act_start)-1, 0, -1 ):
-                                    # j = (act_end-act_start)-1
-                                    j = len(context_bone_anim_keys) - 2
-                                    while j > 0 and len(context_bone_anim_keys) > 2:
-                                        # print j, len(context_bone_anim_keys)
-                                        # Is this key the same as the ones next to it?
-
-                                        # co-linear horizontal...
-                                        if		abs(context_bone_anim_keys[j][0] - context_bone_anim_keys[j - 1][0]) < ANIM_OPTIMIZE_PRECISSION_FLOAT and \
-                                                abs(context_bone_anim_keys[j][0] - context_bone_anim_keys[j + 1][0]) < ANIM_OPTIMIZE_PRECISSION_FLOAT:
-
-                                            del context_bone_anim_keys[j]
-
-                                        else:
-                                            frame_range = float(context_bone_anim_keys[j + 1][1] - context_bone_anim_keys[j - 1][1])
-                                            frame_range_fac1 = (context_bone_anim_keys[j + 1][1] - context_bone_anim_keys[j][1]) / frame_range
-                                            frame_range_fac2 = 1.0 - frame_range_fac1
-
-                                            if abs(((context_bone_anim_keys[j - 1][0] * frame_range_fac1 + context_bone_anim_keys[j + 1][0] * frame_range_fac2)) - context_bone_anim_keys[j][0]) < ANIM_OPTIMIZE_PRECISSION_FLOAT:
-                                                del context_bone_anim_keys[j]
-                                            else:
-                                                j -= 1
-
-                                        # keep the index below the list length
-                                        if j > len(context_bone_anim_keys) - 2:
-                                            j = len(context_bone_anim_keys) - 2
-
-                                    if len(context_bone_anim_keys) == 2 and context_bone_anim_keys[0][0] == context_bone_anim_keys[1][0]:
-
-                                        # This axis has no moton, its okay to skip KeyCount and Keys in this case
-                                        # pass
-
-                                        # better write one, otherwise we loose poses with no animation
-                                        fw('\n\t\t\t\t\t\tKeyCount: 1')
-                                        fw('\n\t\t\t\t\t\tKey: ')
-                                        fw('\n\t\t\t\t\t\t\t%i,%.15f,L' % (fbx_time(start), context_bone_anim_keys[0][0]))
-                                    else:
-                                        # We only need to write these if there is at least one
-                                        fw('\n\t\t\t\t\t\tKeyCount: %i' % len(context_bone_anim_keys))
-                                        fw('\n\t\t\t\t\t\tKey: ')
-                                        for val, frame in context_bone_anim_keys:
-                                            if frame != context_bone_anim_keys[0][1]:  # not the first
-                                                fw(',')
-                                            # frame is already one less then blenders frame
-                                            fw('\n\t\t\t\t\t\t\t%i,%.15f,L' % (fbx_time(frame), val))
-
-                                if i == 0:
-                                    fw('\n\t\t\t\t\t\tColor: 1,0,0')
-                                elif i == 1:
-                                    fw('\n\t\t\t\t\t\tColor: 0,1,0')
-                                elif i == 2:
-                                    fw('\n\t\t\t\t\t\tColor: 0,0,1')
-
-                                fw('\n\t\t\t\t\t}')
-                            fw('\n\t\t\t\t\tLayerType: %i' % (TX_LAYER + 1))
-                            fw('\n\t\t\t\t}')
-
-                        # ---------------
-
-                        fw('\n\t\t\t}')
-                        fw('\n\t\t}')
+                channels = anim_samples[take_samples[my_ob]]
+
+                # ----------------
+                # ----------------
+                for TX_LAYER, TX_CHAN in enumerate('TRS'):  # transform, rotate, scale
+
+                    fw('\n\t\t\t\tChannel: "%s" {' % TX_CHAN)  # translation
+
+                    for i in range(3):
+                        values = channels[TX_LAYER * 3 + i]
+
+                        # Loop on each axis of the bone
+                        fw('\n\t\t\t\t\tChannel: "%s" {' % ('XYZ'[i]))  # translation
+                        fw('\n\t\t\t\t\t\tDefault: %.15f' % values[0])
+                        fw('\n\t\t\t\t\t\tKeyVer: 4005')
+
+                        if not use_anim_optimize:
+                            # Just write all frames, simple but in-eficient
+                            key_frames = range(len(values))
+                        else:
+                            # remove unneeded keys, the frames left are key indices
+                            key_frames = reduce_keys(values, ANIM_OPTIMIZE_PRECISSION_FLOAT)
+
+                        if use_anim_optimize and len(key_frames) == 2 and values[key_frames[0]] == values[key_frames[1]]:
+
+                            # This axis has no moton, its okay to skip KeyCount and Keys in this case
+                            # pass
+
+                            # better write one, otherwise we loose poses with no animation
+                            fw('\n\t\t\t\t\t\tKeyCount: 1')
+                            fw('\n\t\t\t\t\t\tKey: ')
+                            if fbx_bin:
+                                fw(fbx_bin.keys((fbx_time(start),), (values[0],)))
+                            else:
+                                fw('\n\t\t\t\t\t\t\t%i,%.15f,L' % (fbx_time(start), values[0]))
+                        else:
+                            fw('\n\t\t\t\t\t\tKeyCount: %i' % len(key_frames))
+                            fw('\n\t\t\t\t\t\tKey: ')
+                            if fbx_bin:
+                                fw(fbx_bin.keys([key_times[j] for j in key_frames], [values[j] for j in key_frames]))
+                            else:
+                                # Curve types are 'C,n' for constant, 'L' for linear
+                                # C,n is for bezier? - linear is best for now so we can do simple keyframe removal
+                                fw(','.join(['\n\t\t\t\t\t\t\t%i,%.15f,L' % (key_times[j], values[j]) for j in key_frames]))
+
+                        if i == 0:
+                            fw('\n\t\t\t\t\t\tColor: 1,0,0')
+                        elif i == 1:
+                            fw('\n\t\t\t\t\t\tColor: 0,1,0')
+                        elif i == 2:
+                            fw('\n\t\t\t\t\t\tColor: 0,0,1')
+
+                        fw('\n\t\t\t\t\t}')
+                    fw('\n\t\t\t\t\tLayerType: %i' % (TX_LAYER + 1))
+                    fw('\n\t\t\t\t}')
+
+                # ---------------
+
+                fw('\n\t\t\t}')
+                fw('\n\t\t}')
 
             # end the take
             fw('\n\t}')
@@ -2933,6 +3114,8 @@ Takes:  {''')
     del ob_meshes[:]
     del ob_null[:]
 
+    if fbx_bin:
+        fbx_bin.save(file)
     file.close()
 
     # copy all collected files.
@@ -105,6 +105,19 @@ class ImportOBJ(bpy.types.Operator, ImportHelper):
             default=True,
             )
 
+    use_parallel = BoolProperty(
+            name="Parallel Parsing",
+            description="Parse large files in chunks on all processors "
+                        "(files with curves are parsed serially)",
+            default=False,
+            )
+    use_cache = BoolProperty(
+            name="Cache Geometry",
+            description="Keep the parsed geometry in a disk cache, "
+                        "importing the unchanged file again skips parsing",
+            default=False,
+            )
+
     split_mode = EnumProperty(
             name="Split",
             items=(('ON', "Split", "Split geometry, omits unused verts"),
@@ -197,6 +210,8 @@ class ImportOBJ(bpy.types.Operator, ImportHelper):
         layout.prop(self, "axis_up")
 
         layout.prop(self, "use_image_search")
+        layout.prop(self, "use_parallel")
+        layout.prop(self, "use_cache")
 
 
 class ExportOBJ(bpy.types.Operator, ExportHelper):
@@ -295,6 +310,12 @@ class ExportOBJ(bpy.types.Operator, ExportHelper):
             description="",
             default=False,
             )
+    use_parallel = BoolProperty(
+            name="Parallel Export",
+            description="Format the geometry on all processors "
+                        "(normals are shared per mesh only)",
+            default=False,
+            )
 
     axis_forward = EnumProperty(
             name="Forward",
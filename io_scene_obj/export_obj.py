@@ -20,10 +20,13 @@
 
 import os
 import time
+import array
+import collections
 
 import bpy
 import mathutils
 import bpy_extras.io_utils
+from obj_workers import worker_pool, format_verts, prepare_faces, format_faces
 
 
 def name_compat(name):
@@ -242,6 +245,47 @@ def write_nurb(fw, ob, ob_mat):
     return tot_verts
 
 
+# Number of verts and faces formatted by one worker job when exporting in parallel
+OBJ_VERT_CHUNK = 200000
+OBJ_FACE_CHUNK = 100000
+# Worker results kept in memory before waiting for the oldest one
+OBJ_MAX_PENDING = 32
+# Size of the binary buffer under the text file. Text mode is kept: the io
+# layer encodes each write in C, encoding the many small lines of the serial
+# writer in python is slower and the large worker chunks gain nothing from it
+OBJ_WRITE_BUFFER = 4 * 1024 * 1024
+
+
+class ParallelWriter:
+    """
+    Writes text in file order, whether it is written directly
+    or still being formatted by a worker process.
+    """
+    def __init__(self, write, pool):
+        self.write_func = write
+        self.pool = pool
+        self.pending = collections.deque()
+
+    def write(self, text):
+        self.pending.append(text)
+        self.flush()
+
+    def submit(self, func, args):
+        self.pending.append(self.pool.apply_async(func, (args,)))
+        self.flush()
+
+    def flush(self, wait=False):
+        pending = self.pending
+        while pending:
+            item = pending[0]
+            if not isinstance(item, str):
+                if not (wait or item.ready() or len(pending) > OBJ_MAX_PENDING):
+                    break
+                item = item.get()
+            self.write_func(item)
+            pending.popleft()
+
+
 def write_file(filepath, objects, scene,
                EXPORT_TRI=False,
                EXPORT_EDGES=False,
@@ -258,12 +302,16 @@ def write_file(filepath, objects, scene,
                EXPORT_CURVE_AS_NURBS=True,
                EXPORT_GLOBAL_MATRIX=None,
                EXPORT_PATH_MODE='AUTO',
+               EXPORT_POOL=None,
                ):
     """
     Basic write function. The context and options must be already set
     This can be accessed externaly
     eg.
     write( 'c:\\test\\foobar.obj', Blender.Object.GetSelected() ) # Using default options.
+
+    With a multiprocessing EXPORT_POOL the geometry lines are formatted by
+    the workers, normals are then shared per mesh rather than per file.
     """
 
     if EXPORT_GLOBAL_MATRIX is None:
@@ -299,9 +347,15 @@ def write_file(filepath, objects, scene,
 
     time1 = time.time()
 
-    file = open(filepath, "w", encoding="utf8", newline="\n")
+    file = open(filepath, "w", encoding="utf8", newline="\n", buffering=OBJ_WRITE_BUFFER)
     fw = file.write
 
+    if EXPORT_POOL:
+        writer = ParallelWriter(file.write, EXPORT_POOL)
+        fw = writer.write
+    else:
+        writer = None
+
     # Write Header
     fw('# Blender v%s OBJ File: %r\n' % (bpy.app.version_string, os.path.basename(bpy.data.filepath)))
     fw('# www.blender.org\n')
@@ -466,54 +520,96 @@ def write_file(filepath, objects, scene,
                 else:  # if EXPORT_GROUP_BY_OB:
                     fw('g %s\n' % obnamestring)
 
-            # Vert
-            for v in me_verts:
-                fw('v %.6f %.6f %.6f\n' % v.co[:])
+            if writer:
+                # bulk copies of the mesh for the workers
+                co = array.array('f', [0.0]) * (len(me_verts) * 3)
+                me.vertices.foreach_get("co", co)
+                loop_starts = array.array('i', [0]) * len(me.polygons)
+                me.polygons.foreach_get("loop_start", loop_starts)
+                loop_totals = array.array('i', [0]) * len(me.polygons)
+                me.polygons.foreach_get("loop_total", loop_totals)
+                loop_verts = array.array('i', [0]) * len(me.loops)
+                me.loops.foreach_get("vertex_index", loop_verts)
+                face_order = array.array('i', [f_index for f, f_index in face_index_pairs])
+
+                uvs = smooth = vert_normals = face_normals = None
+                if faceuv:
+                    uvs = array.array('f', [0.0]) * (len(me.loops) * 2)
+                    me.uv_layers.active.data.foreach_get("uv", uvs)
+                if EXPORT_NORMALS:
+                    smooth = [False] * len(me.polygons)
+                    me.polygons.foreach_get("use_smooth", smooth)
+                    vert_normals = array.array('f', [0.0]) * (len(me_verts) * 3)
+                    me.vertices.foreach_get("normal", vert_normals)
+                    face_normals = array.array('f', [0.0]) * (len(me.polygons) * 3)
+                    me.polygons.foreach_get("normal", face_normals)
+
+                for i in range(0, len(co), OBJ_VERT_CHUNK * 3):
+                    writer.submit(format_verts, co[i:i + OBJ_VERT_CHUNK * 3])
+
+                # UV and normal indices decide the offsets of the next mesh, wait for them
+                (text, uv_unique_count, no_unique_count,
+                 face_sizes, face_verts, face_uv_indices, face_no_indices) = EXPORT_POOL.apply(prepare_faces, ((
+                            face_order, loop_starts, loop_totals, loop_verts,
+                            uvs, smooth, vert_normals, face_normals),))
+                fw(text)
+
+                del co, loop_starts, loop_totals, loop_verts, face_order, uvs, smooth, vert_normals, face_normals
+
+                # context switches are written before the face they were found for,
+                # keyed by its position in the face_index_pairs
+                face_context = {}
+                fw = lambda text: face_context.setdefault(face_pos, []).append(text)
 
-            # UV
-            if faceuv:
-                # in case removing some of these dont get defined.
-                uv = uvkey = uv_dict = f_index = uv_index = uv_ls = uv_k = None
-
-                uv_face_mapping = [None] * len(face_index_pairs)
-
-                uv_dict = {}  # could use a set() here
-                for f, f_index in face_index_pairs:
-                    uv_ls = uv_face_mapping[f_index] = []
-                    for uv_index, l_index in enumerate(f.loop_indices):
-                        uv = uv_layer[l_index].uv
-
-                        uvkey = veckey2d(uv)
-                        try:
-                            uv_k = uv_dict[uvkey]
-                        except:
-                            uv_k = uv_dict[uvkey] = len(uv_dict)
-                            fw('vt %.6f %.6f\n' % uv[:])
-                        uv_ls.append(uv_k)
-
-                uv_unique_count = len(uv_dict)
-
-                del uv, uvkey, uv_dict, f_index, uv_index, uv_ls, uv_k
-                # Only need uv_unique_count and uv_face_mapping
-
-            # NORMAL, Smooth/Non smoothed.
-            if EXPORT_NORMALS:
-                for f, f_index in face_index_pairs:
-                    if f.use_smooth:
-                        for v_idx in f.vertices:
-                            v = me_verts[v_idx]
-                            noKey = veckey3d(v.normal)
+            else:
+                # Vert
+                for v in me_verts:
+                    fw('v %.6f %.6f %.6f\n' % v.co[:])
+
+                # UV
+                if faceuv:
+                    # in case removing some of these dont get defined.
+                    uv = uvkey = uv_dict = f_index = uv_index = uv_ls = uv_k = None
+
+                    uv_face_mapping = [None] * len(face_index_pairs)
+
+                    uv_dict = {}  # could use a set() here
+                    for f, f_index in face_index_pairs:
+                        uv_ls = uv_face_mapping[f_index] = []
+                        for uv_index, l_index in enumerate(f.loop_indices):
+                            uv = uv_layer[l_index].uv
+
+                            uvkey = veckey2d(uv)
+                            try:
+                                uv_k = uv_dict[uvkey]
+                            except:
+                                uv_k = uv_dict[uvkey] = len(uv_dict)
+                                fw('vt %.6f %.6f\n' % uv[:])
+                            uv_ls.append(uv_k)
+
+                    uv_unique_count = len(uv_dict)
+
+                    del uv, uvkey, uv_dict, f_index, uv_index, uv_ls, uv_k
+                    # Only need uv_unique_count and uv_face_mapping
+
+                # NORMAL, Smooth/Non smoothed.
+                if EXPORT_NORMALS:
+                    for f, f_index in face_index_pairs:
+                        if f.use_smooth:
+                            for v_idx in f.vertices:
+                                v = me_verts[v_idx]
+                                noKey = veckey3d(v.normal)
+                                if noKey not in globalNormals:
+                                    globalNormals[noKey] = totno
+                                    totno += 1
+                                    fw('vn %.6f %.6f %.6f\n' % noKey)
+                        else:
+                            # Hard, 1 normal from the face.
+                            noKey = veckey3d(f.normal)
                             if noKey not in globalNormals:
                                 globalNormals[noKey] = totno
                                 totno += 1
                                 fw('vn %.6f %.6f %.6f\n' % noKey)
-                    else:
-                        # Hard, 1 normal from the face.
-                        noKey = veckey3d(f.normal)
-                        if noKey not in globalNormals:
-                            globalNormals[noKey] = totno
-                            totno += 1
-                            fw('vn %.6f %.6f %.6f\n' % noKey)
 
             if not faceuv:
                 f_image = None
@@ -529,7 +625,7 @@ def write_file(filepath, objects, scene,
                     for v_idx, v_ls in enumerate(vgroupsMap):
                         v_ls[:] = [(vertGroupNames[g.group], g.weight) for g in me_verts[v_idx].groups]
 
-            for f, f_index in face_index_pairs:
+            for face_pos, (f, f_index) in enumerate(face_index_pairs):
                 f_smooth = f.use_smooth
                 if f_smooth and smooth_groups:
                     f_smooth = smooth_groups[f_index]
@@ -609,6 +705,9 @@ def write_file(filepath, objects, scene,
                         fw('s off\n')
                     contextSmooth = f_smooth
 
+                if writer:
+                    continue
+
                 f_v = [(vi, me_verts[v_idx]) for vi, v_idx in enumerate(f.vertices)]
 
                 fw('f')
@@ -657,6 +756,27 @@ def write_file(filepath, objects, scene,
 
                 fw('\n')
 
+            if writer:
+                fw = writer.write
+
+                chunk_context = collections.defaultdict(dict)
+                for face_pos, lines in face_context.items():
+                    chunk_context[face_pos // OBJ_FACE_CHUNK][face_pos % OBJ_FACE_CHUNK] = ''.join(lines)
+
+                loop_index = 0
+                for start in range(0, len(face_sizes), OBJ_FACE_CHUNK):
+                    end = start + OBJ_FACE_CHUNK
+                    loop_end = loop_index + sum(face_sizes[start:end])
+                    writer.submit(format_faces, (
+                            face_sizes[start:end],
+                            face_verts[loop_index:loop_end],
+                            face_uv_indices[loop_index:loop_end] if faceuv else None,
+                            face_no_indices[loop_index:loop_end] if EXPORT_NORMALS else None,
+                            chunk_context[start // OBJ_FACE_CHUNK], totverts, totuvco, totno))
+                    loop_index = loop_end
+
+                del face_sizes, face_verts, face_uv_indices, face_no_indices, face_context, chunk_context
+
             # Write edges.
             if EXPORT_EDGES:
                 for ed in edges:
@@ -667,6 +787,8 @@ def write_file(filepath, objects, scene,
             totverts += len(me_verts)
             if faceuv:
                 totuvco += uv_unique_count
+            if writer:
+                totno += no_unique_count
 
             # clean up
             bpy.data.meshes.remove(me)
@@ -674,6 +796,9 @@ def write_file(filepath, objects, scene,
         if ob_main.dupli_type != 'NONE':
             ob_main.dupli_list_clear()
 
+    if writer:
+        writer.flush(wait=True)
+
     file.close()
 
     # Now we have all our materials, save them
@@ -704,6 +829,7 @@ def _write(context, filepath,
               EXPORT_ANIMATION,
               EXPORT_GLOBAL_MATRIX,
               EXPORT_PATH_MODE,
+              EXPORT_PARALLEL=False,
               ):  # Not used
 
     base_name, ext = os.path.splitext(filepath)
@@ -723,38 +849,46 @@ def _write(context, filepath,
     else:
         scene_frames = [orig_frame]  # Dont export an animation.
 
-    # Loop through all frames in the scene and export.
-    for frame in scene_frames:
-        if EXPORT_ANIMATION:  # Add frame to the filepath.
-            context_name[2] = '_%.6d' % frame
+    # One pool for all frames, worker processes take a while to start
+    pool = worker_pool() if EXPORT_PARALLEL else None
 
-        scene.frame_set(frame, 0.0)
-        if EXPORT_SEL_ONLY:
-            objects = context.selected_objects
-        else:
-            objects = scene.objects
-
-        full_path = ''.join(context_name)
-
-        # erm... bit of a problem here, this can overwrite files when exporting frames. not too bad.
-        # EXPORT THE FILE.
-        write_file(full_path, objects, scene,
-                   EXPORT_TRI,
-                   EXPORT_EDGES,
-                   EXPORT_SMOOTH_GROUPS,
-                   EXPORT_NORMALS,
-                   EXPORT_UV,
-                   EXPORT_MTL,
-                   EXPORT_APPLY_MODIFIERS,
-                   EXPORT_BLEN_OBS,
-                   EXPORT_GROUP_BY_OB,
-                   EXPORT_GROUP_BY_MAT,
-                   EXPORT_KEEP_VERT_ORDER,
-                   EXPORT_POLYGROUPS,
-                   EXPORT_CURVE_AS_NURBS,
-                   EXPORT_GLOBAL_MATRIX,
-                   EXPORT_PATH_MODE,
-                   )
+    try:
+        # Loop through all frames in the scene and export.
+        for frame in scene_frames:
+            if EXPORT_ANIMATION:  # Add frame to the filepath.
+                context_name[2] = '_%.6d' % frame
+
+            scene.frame_set(frame, 0.0)
+            if EXPORT_SEL_ONLY:
+                objects = context.selected_objects
+            else:
+                objects = scene.objects
+
+            full_path = ''.join(context_name)
+
+            # erm... bit of a problem here, this can overwrite files when exporting frames. not too bad.
+            # EXPORT THE FILE.
+            write_file(full_path, objects, scene,
+                       EXPORT_TRI,
+                       EXPORT_EDGES,
+                       EXPORT_SMOOTH_GROUPS,
+                       EXPORT_NORMALS,
+                       EXPORT_UV,
+                       EXPORT_MTL,
+                       EXPORT_APPLY_MODIFIERS,
+                       EXPORT_BLEN_OBS,
+                       EXPORT_GROUP_BY_OB,
+                       EXPORT_GROUP_BY_MAT,
+                       EXPORT_KEEP_VERT_ORDER,
+                       EXPORT_POLYGROUPS,
+                       EXPORT_CURVE_AS_NURBS,
+                       EXPORT_GLOBAL_MATRIX,
+                       EXPORT_PATH_MODE,
+                       pool,
+                       )
+    finally:
+        if pool:
+            pool.terminate()
 
     scene.frame_set(orig_frame, 0.0)
 
@@ -787,7 +921,8 @@ def save(operator, context, filepath="",
          use_selection=True,
          use_animation=False,
          global_matrix=None,
-         path_mode='AUTO'
+         path_mode='AUTO',
+         use_parallel=False,
          ):
 
     _write(context, filepath,
@@ -808,6 +943,7 @@ def save(operator, context, filepath="",
            EXPORT_ANIMATION=use_animation,
            EXPORT_GLOBAL_MATRIX=global_matrix,
            EXPORT_PATH_MODE=path_mode,
+           EXPORT_PARALLEL=use_parallel,
            )
 
     return {'FINISHED'}
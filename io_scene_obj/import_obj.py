@@ -37,6 +37,7 @@ import bpy
 import mathutils
 from bpy_extras.io_utils import unpack_list, unpack_face_list
 from bpy_extras.image_utils import load_image
+from obj_workers import line_value, parse_obj_chunk, worker_pool
 
 
 def mesh_untessellate(me, fgon_edges):
@@ -58,22 +59,6 @@ def mesh_untessellate(me, fgon_edges):
     bm.free()
 
 
-def line_value(line_split):
-    """
-    Returns 1 string represneting the value for this line
-    None will be returned if theres only 1 word
-    """
-    length = len(line_split)
-    if length == 1:
-        return None
-
-    elif length == 2:
-        return line_split[1]
-
-    elif length > 2:
-        return b' '.join(line_split[1:])
-
-
 def obj_image_load(imagepath, DIR, recursive, relpath):
     """
     Mainly uses comprehensiveImageLoad
@@ -831,6 +816,225 @@ def get_float_func(filepath):
     return float
 
 
+# Chunks of at least this many bytes are parsed by separate processes
+OBJ_CHUNK_SIZE = 16 * 1024 * 1024
+
+def obj_chunk_ranges(filepath, chunk_size):
+    """
+    (start, end) byte ranges of the file, each ending after a newline
+    so no line is split between two chunks.
+    """
+    ranges = []
+    file = open(filepath, 'rb')
+    file_size = os.fstat(file.fileno()).st_size
+    start = 0
+    while start < file_size:
+        file.seek(start + chunk_size)
+        file.readline()
+        end = min(file.tell(), file_size)
+        ranges.append((start, end))
+        start = end
+
+    file.close()
+    return ranges
+
+
+def parse_obj_parallel(filepath, float_func, use_edges, use_smooth_groups, use_split_objects, use_split_groups):
+    """
+    Parse the obj file in chunks on all cores and merge them into the same
+    verts, faces and context data the serial parser in load() builds.
+    Returns None when the file is too small or needs the serial parser.
+    """
+    ranges = obj_chunk_ranges(filepath, OBJ_CHUNK_SIZE)
+    if len(ranges) < 2:
+        return None
+
+    pool = worker_pool()
+    if pool is None:
+        return None
+
+    use_comma = float_func is not float
+    chunks = [(filepath, start, end, use_comma, use_edges, use_smooth_groups, use_split_objects, use_split_groups)
+              for start, end in ranges]
+
+    verts_loc = []
+    verts_tex = []
+    faces = []
+    material_libs = set()
+    unique_materials = {}
+    unique_smooth_groups = {}
+    has_ngons = False
+    context = [None, None, None]
+
+    try:
+        # results come back in file order, merge each one as it arrives
+        for chunk in pool.imap(parse_obj_chunk, chunks):
+            if chunk is None:
+                return None
+
+            merge_obj_chunk(chunk, verts_loc, verts_tex, faces, unique_materials, unique_smooth_groups, context)
+            material_libs.update(chunk[8])
+            has_ngons = has_ngons or chunk[9]
+    finally:
+        pool.terminate()
+
+    return verts_loc, verts_tex, faces, list(material_libs), unique_materials, unique_smooth_groups, has_ngons
+
+
+def merge_obj_chunk(chunk, verts_loc, verts_tex, faces, unique_materials, unique_smooth_groups, context):
+    """
+    Add the verts and faces of a chunk parsed by parse_obj_chunk, context is
+    the [material, smooth group, object] the chunk starts with, it is updated
+    to the one it ends with.
+    """
+    import gc
+
+    (chunk_verts_loc, chunk_verts_tex, face_lengths,
+     loc_indices, loc_relative, tex_indices, tex_relative,
+     events, material_libs, has_ngons) = chunk
+
+    context_material, context_smooth_group, context_object = context
+
+    # the merge only creates lists and tuples without cycles,
+    # collecting while millions of them are added costs more than the merge
+    use_gc = gc.isenabled()
+    gc.disable()
+
+    try:
+        tot_loc = len(verts_loc)
+        tot_tex = len(verts_tex)
+
+        coords = iter(chunk_verts_loc)
+        verts_loc.extend(zip(coords, coords, coords))
+        coords = iter(chunk_verts_tex)
+        verts_tex.extend(zip(coords, coords))
+
+        loc_indices = loc_indices.tolist()
+        if tot_loc:
+            for i in loc_relative:
+                loc_indices[i] += tot_loc
+        tex_indices = tex_indices.tolist()
+        if tot_tex:
+            for i in tex_relative:
+                tex_indices[i] += tot_tex
+
+        face_index = loc_index = tex_index = 0
+        for event_face_index, keyword, value in list(events) + [(len(face_lengths), None, None)]:
+            for face_length in face_lengths[face_index:event_face_index]:
+                if face_length < 0:
+                    face_vert_tex_indices = []
+                    face_length = -face_length
+                else:
+                    face_vert_tex_indices = tex_indices[tex_index:tex_index + face_length]
+                    tex_index += face_length
+
+                faces.append((loc_indices[loc_index:loc_index + face_length],
+                              face_vert_tex_indices,
+                              context_material,
+                              context_smooth_group,
+                              context_object,
+                              ))
+                loc_index += face_length
+
+            face_index = event_face_index
+
+            if keyword == b's':
+                context_smooth_group = value
+                if value:
+                    unique_smooth_groups[value] = None
+            elif keyword == b'o':
+                context_object = value
+            elif keyword == b'usemtl':
+                context_material = value
+                unique_materials[value] = None
+    finally:
+        if use_gc:
+            gc.enable()
+
+    context[:] = context_material, context_smooth_group, context_object
+
+
+def obj_chunk_from_faces(verts_loc, verts_tex, faces, material_libs, has_ngons):
+    """The parsed file as one chunk, as parse_obj_chunk would return it"""
+    import array
+    import itertools
+
+    face_lengths = array.array('l')
+    loc_indices = array.array('l')
+    tex_indices = array.array('l')
+    events = []
+    context_material = context_smooth_group = context_object = None
+
+    for face_pos, (face_vert_loc_indices, face_vert_tex_indices, material, smooth_group, obj) in enumerate(faces):
+        if material != context_material:
+            events.append((face_pos, b'usemtl', material))
+            context_material = material
+        if smooth_group != context_smooth_group:
+            events.append((face_pos, b's', smooth_group))
+            context_smooth_group = smooth_group
+        if obj != context_object:
+            events.append((face_pos, b'o', obj))
+            context_object = obj
+
+        loc_indices.extend(face_vert_loc_indices)
+        if len(face_vert_tex_indices) == len(face_vert_loc_indices):
+            face_lengths.append(len(face_vert_loc_indices))
+            tex_indices.extend(face_vert_tex_indices)
+        else:  # edge
+            face_lengths.append(-len(face_vert_loc_indices))
+
+    return (array.array('d', itertools.chain.from_iterable(verts_loc)),
+            array.array('d', itertools.chain.from_iterable(verts_tex)),
+            face_lengths, loc_indices, array.array('l'), tex_indices, array.array('l'),
+            events, material_libs, has_ngons)
+
+
+def load_obj_cache(filepath, options):
+    """Parsed data of an unchanged file from the geometry cache, None if it isn't cached"""
+    import array
+    import geometry_cache
+
+    cached = geometry_cache.load(filepath, "obj", options)
+    if cached is None:
+        return None
+
+    values, arrays = cached
+    chunk = (arrays["verts_loc"], arrays["verts_tex"], arrays["face_lengths"],
+             arrays["loc_indices"], array.array('l'), arrays["tex_indices"], array.array('l'),
+             values["events"], values["material_libs"], values["has_ngons"])
+
+    verts_loc = []
+    verts_tex = []
+    faces = []
+    # keep the order of the materials and smooth groups of the file
+    unique_materials = dict.fromkeys(values["unique_materials"])
+    unique_smooth_groups = dict.fromkeys(values["unique_smooth_groups"])
+
+    merge_obj_chunk(chunk, verts_loc, verts_tex, faces, unique_materials, unique_smooth_groups, [None, None, None])
+
+    return verts_loc, verts_tex, faces, values["material_libs"], unique_materials, unique_smooth_groups, values["has_ngons"]
+
+
+def store_obj_cache(filepath, options, verts_loc, verts_tex, faces, material_libs, unique_materials, unique_smooth_groups, has_ngons):
+    import geometry_cache
+
+    chunk = obj_chunk_from_faces(verts_loc, verts_tex, faces, material_libs, has_ngons)
+    arrays = {"verts_loc": chunk[0],
+              "verts_tex": chunk[1],
+              "face_lengths": chunk[2],
+              "loc_indices": chunk[3],
+              "tex_indices": chunk[5],
+              }
+    values = {"events": chunk[7],
+              "material_libs": list(material_libs),
+              "unique_materials": list(unique_materials),
+              "unique_smooth_groups": list(unique_smooth_groups),
+              "has_ngons": has_ngons,
+              }
+
+    geometry_cache.store(filepath, "obj", options, values, arrays)
+
+
 def load(operator, context, filepath,
          global_clamp_size=0.0,
          use_ngons=True,
@@ -842,6 +1046,8 @@ def load(operator, context, filepath,
          use_groups_as_vgroups=False,
          relpath=None,
          global_matrix=None,
+         use_parallel=False,
+         use_cache=False,
          ):
     """
     Called by the user interface or another script.
@@ -900,8 +1106,24 @@ def load(operator, context, filepath,
     time_sub = time.time()
 #     time_sub= sys.time()
 
-    file = open(filepath, 'rb')
-    for line in file:  # .readlines():
+    # vertex groups and nurbs are not cached
+    use_cache = use_cache and not use_groups_as_vgroups
+    cache_options = use_edges, use_smooth_groups, use_split_objects, use_split_groups
+
+    parsed = cached = None
+    if use_cache:
+        parsed = cached = load_obj_cache(filepath, cache_options)
+    if parsed is None and use_parallel and not use_groups_as_vgroups:
+        parsed = parse_obj_parallel(filepath, float_func, use_edges, use_smooth_groups, use_split_objects, use_split_groups)
+
+    if parsed is not None:
+        (verts_loc, verts_tex, faces, material_libs,
+         unique_materials, unique_smooth_groups, has_ngons) = parsed
+        lines = ()  # nothing left for the serial parser
+    else:
+        lines = file = open(filepath, 'rb')
+
+    for line in lines:  # .readlines():
         line_split = line.split()
 
         if not line_split:
@@ -1098,7 +1320,12 @@ def load(operator, context, filepath,
             context_image= line_value(line_split)
         '''
 
-    file.close()
+    if parsed is None:
+        file.close()
+
+    if use_cache and cached is None and not nurbs:
+        store_obj_cache(filepath, cache_options, verts_loc, verts_tex, faces, material_libs, unique_materials, unique_smooth_groups, has_ngons)
+
     time_new = time.time()
     print("%.4f sec" % (time_new - time_sub))
     time_sub = time_new
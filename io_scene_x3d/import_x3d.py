@@ -22,7 +22,8 @@ DEBUG = False
 
 # This should work without a blender at all
 import os
-import shlex
+import re
+import array
 
 
 def imageConvertCompat(path):
@@ -55,262 +56,71 @@ def imageConvertCompat(path):
 
 # =============================== VRML Spesific
 
-def vrmlFormat(data):
-    """
-    Keep this as a valid vrml file, but format in a way we can predict.
-    """
-    # Strip all commends - # not in strings - warning multiline strings are ignored.
-    def strip_comment(l):
-        #l = ' '.join(l.split())
-        l = l.strip()
-
-        if l.startswith('#'):
-            return ''
-
-        i = l.find('#')
-
-        if i == -1:
-            return l
-
-        # Most cases accounted for! if we have a comment at the end of the line do this...
-        #j = l.find('url "')
-        j = l.find('"')
-
-        if j == -1:  # simple no strings
-            return l[:i].strip()
-
-        q = False
-        for i, c in enumerate(l):
-            if c == '"':
-                q = not q  # invert
-
-            elif c == '#':
-                if q is False:
-                    return l[:i - 1]
-
-        return l
-
-    data = '\n'.join([strip_comment(l) for l in data.split('\n')])  # remove all whitespace
-
-    EXTRACT_STRINGS = True  # only needed when strings or filesnames containe ,[]{} chars :/
-
-    if EXTRACT_STRINGS:
-
-        # We need this so we can detect URL's
-        data = '\n'.join([' '.join(l.split()) for l in data.split('\n')])  # remove all whitespace
-
-        string_ls = []
-
-        #search = 'url "'
-        search = '"'
-
-        ok = True
-        last_i = 0
-        while ok:
-            ok = False
-            i = data.find(search, last_i)
-            if i != -1:
-
-                start = i + len(search)  # first char after end of search
-                end = data.find('"', start)
-                if end != -1:
-                    item = data[start:end]
-                    string_ls.append(item)
-                    data = data[:start] + data[end:]
-                    ok = True  # keep looking
-
-                    last_i = (end - len(item)) + 1
-                    # print(last_i, item, '|' + data[last_i] + '|')
-
-    # done with messy extracting strings part
-
-    # Bad, dont take strings into account
-    '''
-    data = data.replace('#', '\n#')
-    data = '\n'.join([ll for l in data.split('\n') for ll in (l.strip(),) if not ll.startswith('#')]) # remove all whitespace
-    '''
-    data = data.replace('{', '\n{\n')
-    data = data.replace('}', '\n}\n')
-    data = data.replace('[', '\n[\n')
-    data = data.replace(']', '\n]\n')
-    data = data.replace(',', ' , ')  # make sure comma's separate
-
-    if EXTRACT_STRINGS:
-        # add strings back in
+# A run of numbers (and the commas and spaces between them) is a single token,
+# so large arrays are split and converted in one go. The run is only checked to
+# end on a separator, vrmlArray() validates the numbers.
+vrml_tokens = re.compile(r'''
+    (?P<skip>(?:\s+|\#[^\n]*)+)
+  | (?P<string>"(?:[^"\\]|\\.)*"?)
+  | (?P<numbers>[-+.0-9][-+.0-9eExX,\s]*(?![^\s,\[\]{}"\#]))
+  | (?P<bracket>[{}\[\],])
+  | (?P<word>[^\s,\[\]{}"\#]+)
+''', re.VERBOSE)
 
-        search = '"'  # fill in these empty strings
+# identifiers can't start with these, words that do are numbers (hex, or not valid)
+VRML_NUMBER_START = frozenset('+-.0123456789')
 
-        ok = True
-        last_i = 0
-        while ok:
-            ok = False
-            i = data.find(search + '"', last_i)
-            # print(i)
-            if i != -1:
-                start = i + len(search)  # first char after end of search
-                item = string_ls.pop(0)
-                # print(item)
-                data = data[:start] + item + data[start:]
+vrml_field_split = re.compile(r'[^\s,]+|,')
 
-                last_i = start + len(item) + 1
+# field declarations of PROTO's and Script nodes, eg: "field SFColor seatColor .6 .6 .1"
+VRML_INTERFACE = {'field', 'exposedField', 'eventIn', 'eventOut',
+                  'initializeOnly', 'inputOutput', 'inputOnly', 'outputOnly'}
 
-                ok = True
 
-    # More annoying obscure cases where USE or DEF are placed on a newline
-    # data = data.replace('\nDEF ', ' DEF ')
-    # data = data.replace('\nUSE ', ' USE ')
-
-    data = '\n'.join([' '.join(l.split()) for l in data.split('\n')])  # remove all whitespace
-
-    # Better to parse the file accounting for multiline arrays
-    '''
-    data = data.replace(',\n', ' , ') # remove line endings with commas
-    data = data.replace(']', '\n]\n') # very very annoying - but some comma's are at the end of the list, must run this again.
-    '''
+def vrmlTokenize(data):
+    """
+    Split VRML data into (kind, value, lineno) tokens in a single pass, kind is
+    'string' (quotes included), 'numbers', 'word' or one of the "{}[]," chars.
+    """
+    if type(data) == bytes:
+        data = data.decode('utf-8', 'replace')
+
+    tokens = []
+    lineno = 1
+    for match in vrml_tokens.finditer(data):
+        kind = match.lastgroup
+        value = match.group()
+        if kind == 'bracket':
+            kind = value
+        elif kind == 'word' and value[0] in VRML_NUMBER_START:
+            kind = 'numbers'
+        if kind != 'skip':
+            tokens.append((kind, value, lineno))
+        lineno += value.count('\n')
+
+    return tokens
+
+
+def vrmlArray(values):
+    """
+    Compact array of number strings, ints when they all are,
+    None when they aren't numbers.
+    """
+    try:
+        return array.array('i', map(int, values))
+    except (ValueError, OverflowError):
+        pass
 
-    return [l for l in data.split('\n') if l]
+    try:
+        return array.array('d', map(float, values))
+    except ValueError:
+        return None
 
 NODE_NORMAL = 1  # {}
 NODE_ARRAY = 2  # []
 NODE_REFERENCE = 3  # USE foobar
 # NODE_PROTO = 4 #
 
-lines = []
-
-
-def getNodePreText(i, words):
-    # print(lines[i])
-    use_node = False
-    while len(words) < 5:
-
-        if i >= len(lines):
-            break
-            '''
-        elif lines[i].startswith('PROTO'):
-            return NODE_PROTO, i+1
-            '''
-        elif lines[i] == '{':
-            # words.append(lines[i]) # no need
-            # print("OK")
-            return NODE_NORMAL, i + 1
-        elif lines[i].count('"') % 2 != 0:  # odd number of quotes? - part of a string.
-            # print('ISSTRING')
-            break
-        else:
-            new_words = lines[i].split()
-            if 'USE' in new_words:
-                use_node = True
-
-            words.extend(new_words)
-            i += 1
-
-        # Check for USE node - no {
-        # USE #id - should always be on the same line.
-        if use_node:
-            # print('LINE', i, words[:words.index('USE')+2])
-            words[:] = words[:words.index('USE') + 2]
-            if lines[i] == '{' and lines[i + 1] == '}':
-                # USE sometimes has {} after it anyway
-                i += 2
-            return NODE_REFERENCE, i
-
-    # print("error value!!!", words)
-    return 0, -1
-
-
-def is_nodeline(i, words):
-
-    if not lines[i][0].isalpha():
-        return 0, 0
-
-    #if lines[i].startswith('field'):
-    #   return 0, 0
-
-    # Is this a prototype??
-    if lines[i].startswith('PROTO'):
-        words[:] = lines[i].split()
-        return NODE_NORMAL, i + 1  # TODO - assumes the next line is a '[\n', skip that
-    if lines[i].startswith('EXTERNPROTO'):
-        words[:] = lines[i].split()
-        return NODE_ARRAY, i + 1  # TODO - assumes the next line is a '[\n', skip that
-
-    '''
-    proto_type, new_i = is_protoline(i, words, proto_field_defs)
-    if new_i != -1:
-        return proto_type, new_i
-    '''
-
-    # Simple "var [" type
-    if lines[i + 1] == '[':
-        if lines[i].count('"') % 2 == 0:
-            words[:] = lines[i].split()
-            return NODE_ARRAY, i + 2
-
-    node_type, new_i = getNodePreText(i, words)
-
-    if not node_type:
-        if DEBUG:
-            print("not node_type", lines[i])
-        return 0, 0
-
-    # Ok, we have a { after some values
-    # Check the values are not fields
-    for i, val in enumerate(words):
-        if i != 0 and words[i - 1] in {'DEF', 'USE'}:
-            # ignore anything after DEF, it is a ID and can contain any chars.
-            pass
-        elif val[0].isalpha() and val not in {'TRUE', 'FALSE'}:
-            pass
-        else:
-            # There is a number in one of the values, therefor we are not a node.
-            return 0, 0
-
-    #if node_type==NODE_REFERENCE:
-    #   print(words, "REF_!!!!!!!")
-    return node_type, new_i
-
-
-def is_numline(i):
-    """
-    Does this line start with a number?
-    """
-
-    # Works but too slow.
-    '''
-    l = lines[i]
-    for w in l.split():
-        if w==',':
-            pass
-        else:
-            try:
-                float(w)
-                return True
-
-            except:
-                return False
-
-    return False
-    '''
-
-    l = lines[i]
-
-    line_start = 0
-
-    if l.startswith(', '):
-        line_start += 2
-
-    line_end = len(l) - 1
-    line_end_new = l.find(' ', line_start)  # comma's always have a space before them
-
-    if line_end_new != -1:
-        line_end = line_end_new
-
-    try:
-        float(l[line_start:line_end])  # works for a float or int
-        return True
-    except:
-        return False
-
 
 class vrmlNode(object):
     __slots__ = ('id',
@@ -726,14 +536,10 @@ class vrmlNode(object):
         """
 
         def array_as_number(array_string):
-            array_data = []
-            try:
-                array_data = [int(val) for val in array_string]
-            except:
-                try:
-                    array_data = [float(val) for val in array_string]
-                except:
-                    print('\tWarning, could not parse array data from field')
+            array_data = vrmlArray(array_string)
+            if array_data is None:
+                print('\tWarning, could not parse array data from field')
+                array_data = []
 
             return array_data
 
@@ -765,12 +571,13 @@ class vrmlNode(object):
         if group == -1 or len(array_data) == 0:
             return array_data
 
-        # We want a flat list
+        # We want a flat list, number arrays always are
         flat = True
-        for item in array_data:
-            if type(item) == list:
-                flat = False
-                break
+        if type(array_data) == list:
+            for item in array_data:
+                if type(item) == list:
+                    flat = False
+                    break
 
         # make a flat array
         if flat:
@@ -791,17 +598,11 @@ class vrmlNode(object):
         if group == 0:
             return flat_array
 
-        new_array = []
-        sub_array = []
-
-        for item in flat_array:
-            sub_array.append(item)
-            if len(sub_array) == group:
-                new_array.append(sub_array)
-                sub_array = []
+        new_array = [flat_array[i:i + group] for i in range(0, len(flat_array) - group + 1, group)]
 
+        sub_array = flat_array[len(new_array) * group:]
         if sub_array:
-            print('\twarning, array was not aligned to requested grouping', group, 'remaining value', sub_array)
+            print('\twarning, array was not aligned to requested grouping', group, 'remaining value', list(sub_array))
 
         return new_array
 
@@ -890,8 +691,12 @@ class vrmlNode(object):
 
         return text
 
-    def parse(self, i, IS_PROTO_DATA=False):
-        new_i = self.__parse(i, IS_PROTO_DATA)
+    def parse(self, tokens, i, IS_PROTO_DATA=False):
+        """
+        Parse the node from tokens, i is the token after its opening bracket,
+        returns the token after its closing one.
+        """
+        new_i = self.__parse(tokens, i, IS_PROTO_DATA)
 
         # print(self.id, self.getFilename())
 
@@ -966,22 +771,10 @@ class vrmlNode(object):
                             # Tricky - inline another VRML
                             print('\tLoading Inline:"%s"...' % url)
 
-                            # Watch it! - backup lines
-                            lines_old = lines[:]
-
-                            lines[:] = vrmlFormat(data)
-
-                            lines.insert(0, '{')
-                            lines.insert(0, 'root_node____')
-                            lines.append('}')
-                            '''
-                            ff = open('/tmp/test.txt', 'w')
-                            ff.writelines([l+'\n' for l in lines])
-                            '''
-
                             child = vrmlNode(self, NODE_NORMAL, -1)
                             child.setRoot(url)  # initialized dicts
-                            child.parse(0)
+                            child.id = ('root_node____',)
+                            child.parse(vrmlTokenize(data), 0)
 
                             # if self.getExternprotoName():
                             if self.getExternprotoName():
@@ -1004,40 +797,14 @@ class vrmlNode(object):
                                     else:
                                         print("\tEXTERNPROTO ID not found!:", extern_key)
 
-                            # Watch it! - restore lines
-                            lines[:] = lines_old
-
         return new_i
 
-    def __parse(self, i, IS_PROTO_DATA=False):
+    def __parse(self, tokens, i, IS_PROTO_DATA=False):
         '''
         print('parsing at', i, end="")
         print(i, self.id, self.lineno)
         '''
-        l = lines[i]
-
-        if l == '[':
-            # An anonymous list
-            self.id = None
-            i += 1
-        else:
-            words = []
-
-            node_type, new_i = is_nodeline(i, words)
-            if not node_type:  # fail for parsing new node.
-                print("Failed to parse new node")
-                raise ValueError
-
-            if self.node_type == NODE_REFERENCE:
-                # Only assign the reference and quit
-                key = words[words.index('USE') + 1]
-                self.id = (words[0],)
-
-                self.reference = self.getDefDict()[key]
-                return new_i
-
-            self.id = tuple(words)
-
+        if self.id:  # not an anonymous list
             # fill in DEF/USE
             key = self.getDefName()
             if key != None:
@@ -1052,14 +819,19 @@ class vrmlNode(object):
                 proto_dict[key] = self
 
                 # Parse the proto nodes fields
-                self.proto_node = vrmlNode(self, NODE_ARRAY, new_i)
-                new_i = self.proto_node.parse(new_i)
+                self.proto_node = vrmlNode(self, NODE_ARRAY, self.lineno)
+                i = self.proto_node.parse(tokens, i)
 
                 self.children.remove(self.proto_node)
 
                 # print(self.proto_node)
 
-                new_i += 1  # skip past the {
+                if i < len(tokens) and tokens[i][0] == 'string':
+                    # EXTERNPROTO with a single url
+                    self.fields.append([tokens[i][1]])
+                    return i + 1
+
+                i += 1  # skip past the { (or the [ of EXTERNPROTO urls)
 
             else:  # If we're a proto instance, add the proto node as our child.
                 spec = self.getSpec()
@@ -1073,147 +845,135 @@ class vrmlNode(object):
 
             del proto_dict, key
 
-            i = new_i
+        numbers = []  # array data, converted once the node is parsed
 
-        # print(self.id)
-        ok = True
-        while ok:
-            if i >= len(lines):
-                return len(lines) - 1
-
-            l = lines[i]
-            # print('\tDEBUG:', i, self.node_type, l)
-            if l == '':
-                i += 1
-                continue
+        while i < len(tokens):
+            kind, value, lineno = tokens[i]
+            # print('\tDEBUG:', i, self.node_type, value)
 
-            if l == '}':
+            if kind == '}':
                 if self.node_type != NODE_NORMAL:  # also ends proto nodes, we may want a type for these too.
-                    print('wrong node ending, expected an } ' + str(i) + ' ' + str(self.node_type))
+                    print('wrong node ending, expected an } ' + str(lineno) + ' ' + str(self.node_type))
                     if DEBUG:
                         raise ValueError
-                ### print("returning", i)
-                return i + 1
-            if l == ']':
+                i += 1
+                break
+            elif kind == ']':
                 if self.node_type != NODE_ARRAY:
-                    print('wrong node ending, expected a ] ' + str(i) + ' ' + str(self.node_type))
+                    print('wrong node ending, expected a ] ' + str(lineno) + ' ' + str(self.node_type))
                     if DEBUG:
                         raise ValueError
-                ### print("returning", i)
-                return i + 1
-
-            node_type, new_i = is_nodeline(i, [])
-            if node_type:  # check text\n{
-                child = vrmlNode(self, node_type, i)
-                i = child.parse(i)
-
-            elif l == '[':  # some files have these anonymous lists
-                child = vrmlNode(self, NODE_ARRAY, i)
-                i = child.parse(i)
+                i += 1
+                break
+            elif kind == 'numbers':
+                numbers.extend(value.replace(',', ' ').split())
+                i += 1
+            elif kind == 'string':
+                # an item of a string array
+                self.fields.append([value])
+                i += 1
+            elif kind == '[':  # some files have these anonymous lists
+                child = vrmlNode(self, NODE_ARRAY, lineno)
+                i = child.parse(tokens, i + 1)
+            elif kind == '{':
+                child = vrmlNode(self, NODE_NORMAL, lineno)
+                i = child.parse(tokens, i + 1)
+            elif kind == 'word':
+                i = self.__parseStatement(tokens, i)
+            else:  # commas between nodes or strings
+                i += 1
 
-            elif is_numline(i):
-                l_split = l.split(',')
+        if numbers:
+            array_data = vrmlArray(numbers)
+            if array_data is None:  # dont parse
+                array_data = numbers
+            self.array_data = array_data
 
-                values = None
-                # See if each item is a float?
+        return i
 
-                for num_type in (int, float):
-                    try:
-                        values = [num_type(v) for v in l_split]
-                        break
-                    except:
-                        pass
+    def __parseStatement(self, tokens, i):
+        """
+        Parse the field, child node, PROTO or ROUTE starting with the word at i,
+        returns the token after it.
+        """
+        kind, word, lineno = tokens[i]
+
+        if word in {'PROTO', 'EXTERNPROTO'}:
+            # PROTO name [ field defs ] { nodes }
+            # EXTERNPROTO name [ field defs ] urls
+            child = vrmlNode(self, NODE_NORMAL if word == 'PROTO' else NODE_ARRAY, lineno)
+            child.id = (word, tokens[i + 1][1])
+            return child.parse(tokens, i + 3)
+
+        if word == 'ROUTE':
+            # ROUTE vpPI.value_changed TO champFly001.set_position
+            self.fields.append([token[1] for token in tokens[i:i + 4]])
+            return i + 4
+
+        if word in VRML_INTERFACE:
+            # keyword, type and name, followed by a value for fields
+            words = [token[1] for token in tokens[i:i + 3]]
+            i += 3
+        else:
+            words = []
 
-                    try:
-                        values = [[num_type(v) for v in segment.split()] for segment in l_split]
-                        break
-                    except:
-                        pass
+        # words before a node: field name, DEF name and node type
+        while i < len(tokens):
+            kind, value = tokens[i][:2]
+            if kind == '{' or kind == '[':
+                child = vrmlNode(self, NODE_NORMAL if kind == '{' else NODE_ARRAY, lineno)
+                child.id = tuple(words)
+                return child.parse(tokens, i + 1)
+            elif kind != 'word':
+                break
+            elif value == 'DEF':
+                words += [value, tokens[i + 1][1]]
+                i += 2
+            elif value == 'USE':
+                # For references, only the parent and ID are needed
+                child = vrmlNode(self, NODE_REFERENCE, lineno)
+                child.id = (words[0] if words else value,)
 
-                if values is None:  # dont parse
-                    values = l_split
+                key = tokens[i + 1][1]
+                try:
+                    child.reference = self.getDefDict()[key]
+                except KeyError:
+                    print('\tWarning: reference', key, 'not found')
+                    self.children.remove(child)
 
-                # This should not extend over multiple lines however it is possible
-                # print(self.array_data)
-                if values:
-                    self.array_data.extend(values)
+                i += 2
+                if tokens[i:i + 2] and [token[0] for token in tokens[i:i + 2]] == ['{', '}']:
+                    # USE sometimes has {} after it anyway
+                    i += 2
+                return i
+            elif value == 'IS' and words:
+                # eg: 'diffuseColor IS legColor'
+                self.fields.append(words + [value, tokens[i + 1][1]])
+                return i + 2
+            elif not words or (i + 1 < len(tokens) and tokens[i + 1][0] == '{'):
+                words.append(value)
                 i += 1
             else:
-                words = l.split()
-                if len(words) > 2 and words[1] == 'USE':
-                    vrmlNode(self, NODE_REFERENCE, i)
-                else:
-
-                    # print("FIELD", i, l)
-                    #
-                    #words = l.split()
-                    ### print('\t\ttag', i)
-                    # this is a tag/
-                    # print(words, i, l)
-                    value = l
-                    # print(i)
-                    # javastrips can exist as values.
-                    quote_count = l.count('"')
-                    if quote_count % 2:  # odd number?
-                        # print('MULTILINE')
-                        while 1:
-                            i += 1
-                            l = lines[i]
-                            quote_count = l.count('"')
-                            if quote_count % 2:  # odd number?
-                                value += '\n' + l[:l.rfind('"')]
-                                break  # assume
-                            else:
-                                value += '\n' + l
-
-                    # use shlex so we get '"a b" "b v"' --> '"a b"', '"b v"'
-                    value_all = shlex.split(value, posix=False)
-
-                    def iskey(k):
-                        if k[0] != '"' and k[0].isalpha() and k.upper() not in {'TRUE', 'FALSE'}:
-                            return True
-                        return False
-
-                    def split_fields(value):
-                        """
-                        key 0.0 otherkey 1,2,3 opt1 opt1 0.0
-                            -> [key 0.0], [otherkey 1,2,3], [opt1 opt1 0.0]
-                        """
-                        field_list = []
-                        field_context = []
-
-                        for j in range(len(value)):
-                            if iskey(value[j]):
-                                if field_context:
-                                    # this IS a key but the previous value was not a key, ot it was a defined field.
-                                    if (not iskey(field_context[-1])) or ((len(field_context) == 3 and field_context[1] == 'IS')):
-                                        field_list.append(field_context)
-
-                                        field_context = [value[j]]
-                                    else:
-                                        # The last item was not a value, multiple keys are needed in some cases.
-                                        field_context.append(value[j])
-                                else:
-                                    # Is empty, just add this on
-                                    field_context.append(value[j])
-                            else:
-                                # Add a value to the list
-                                field_context.append(value[j])
-
-                        if field_context:
-                            field_list.append(field_context)
+                break
 
-                        return field_list
+        # a field, its values run up to the next word
+        while i < len(tokens):
+            kind, value = tokens[i][:2]
+            if kind == 'numbers':
+                words.extend(vrml_field_split.findall(value))
+            elif kind in {'string', ','} or (kind == 'word' and value.upper() in {'TRUE', 'FALSE', 'NULL'}):
+                words.append(value)
+            else:
+                break
+            i += 1
 
-                    for value in split_fields(value_all):
-                        # Split
+        if words[0] == 'field':
+            # field SFFloat creaseAngle 4
+            self.proto_field_defs.append(words)
+        else:
+            self.fields.append(words)
 
-                        if value[0] == 'field':
-                            # field SFFloat creaseAngle 4
-                            self.proto_field_defs.append(value)
-                        else:
-                            self.fields.append(value)
-                i += 1
+        return i
 
 
 def gzipOpen(path):
@@ -1246,35 +1006,16 @@ def vrml_parse(path):
     if data is None:
         return None, 'Failed to open file: ' + path
 
-    # Stripped above
-    lines[:] = vrmlFormat(data)
-
-    lines.insert(0, '{')
-    lines.insert(0, 'dymmy_node')
-    lines.append('}')
-    # Use for testing our parsed output, so we can check on line numbers.
-
-    '''
-    ff = open('/tmp/test.txt', 'w')
-    ff.writelines([l+'\n' for l in lines])
-    ff.close()
-    '''
-
-    # Now evaluate it
-    node_type, new_i = is_nodeline(0, [])
-    if not node_type:
+    tokens = vrmlTokenize(data)
+    if not tokens:
         return None, 'Error: VRML file has no starting Node'
 
-    # Trick to make sure we get all root nodes.
-    lines.insert(0, '{')
-    lines.insert(0, 'root_node____')  # important the name starts with an ascii char
-    lines.append('}')
-
     root = vrmlNode(None, NODE_NORMAL, -1)
     root.setRoot(path)  # we need to set the root so we have a namespace and know the path in case of inlineing
+    root.id = ('root_node____',)  # holds all root nodes
 
     # Parse recursively
-    root.parse(0)
+    root.parse(tokens, 0)
 
     # This prints a load of text
     if DEBUG:
@@ -2027,7 +1768,19 @@ def importMesh_Box(geom, ancestry):
     return bpymesh
 
 
-def importShape(node, ancestry, global_matrix):
+def shapeCacheNew():
+    # built datablocks, keyed by the real node and the proto instances it's used in
+    return {'material': {}, 'mesh': {}, 'reused_material': 0, 'reused_mesh': 0}
+
+
+def importShape(node, ancestry, global_matrix, shape_cache=None):
+    """
+    shape_cache is a dict shared between shapes, so the materials and meshes
+    of nodes used by more than one shape (USE) are only built once.
+    """
+    if shape_cache is None:
+        shape_cache = shapeCacheNew()
+
     vrmlname = node.getDefName()
     if not vrmlname:
         vrmlname = 'Shape'
@@ -2049,7 +1802,17 @@ def importShape(node, ancestry, global_matrix):
         image_depth = 0  # so we can set alpha face flag later
         is_vcol = (geom.getChildBySpec('Color') is not None)
 
-        if appr:
+        # fields using IS depend on the proto instances, so do the datablocks built from them,
+        # an instance is the node before its proto in the ancestry (only the proto has proto_node)
+        proto_key = tuple(ancestry[i - 1].getRealNode() for i in range(1, len(ancestry)) if ancestry[i].getRealNode().proto_node)
+        appr_real = appr.getRealNode() if appr else None
+        material_key = (appr_real, is_vcol, proto_key)
+
+        if appr and material_key in shape_cache['material']:
+            bpymat, bpyima, image_depth, texmtx = shape_cache['material'][material_key]
+            shape_cache['reused_material'] += 1
+
+        elif appr:
 
             #mat = appr.getChildByName('material') # 'Material'
             #ima = appr.getChildByName('texture') # , 'ImageTexture'
@@ -2148,10 +1911,17 @@ def importShape(node, ancestry, global_matrix):
                         if not ima_repT:
                             bpyima.use_clamp_y = True
 
+            shape_cache['material'][material_key] = bpymat, bpyima, image_depth, texmtx
+
         bpydata = None
         geom_spec = geom.getSpec()
         ccw = True
-        if geom_spec == 'IndexedFaceSet':
+        mesh_key = (geom.getRealNode(), appr_real, proto_key)
+        is_cached = mesh_key in shape_cache['mesh']
+        if is_cached:
+            bpydata = shape_cache['mesh'][mesh_key]
+            shape_cache['reused_mesh'] += 1
+        elif geom_spec == 'IndexedFaceSet':
             bpydata, ccw = importMesh_IndexedFaceSet(geom, bpyima, ancestry)
         elif geom_spec == 'IndexedLineSet':
             bpydata = importMesh_IndexedLineSet(geom, ancestry)
@@ -2169,15 +1939,20 @@ def importShape(node, ancestry, global_matrix):
             print('\tWarning: unsupported type "%s"' % geom_spec)
             return
 
+        if not is_cached:
+            shape_cache['mesh'][mesh_key] = bpydata
+
         if bpydata:
             vrmlname = vrmlname + geom_spec
 
-            bpydata.name = vrmlname
+            if not is_cached:
+                bpydata.name = vrmlname
 
             bpyob = node.blendObject = bpy.data.objects.new(vrmlname, bpydata)
             bpy.context.scene.objects.link(bpyob).select = True
 
-            if type(bpydata) == bpy.types.Mesh:
+            # cached data was already set up by the first shape using it
+            if type(bpydata) == bpy.types.Mesh and not is_cached:
                 is_solid = geom.getFieldAsBool('solid', True, ancestry)
                 creaseAngle = geom.getFieldAsFloat('creaseAngle', None, ancestry)
 
@@ -2559,6 +2334,8 @@ def load_web3d(path,
     # fill with tuples - (node, [parents-parent, parent])
     all_nodes = root_node.getSerialized([], [])
 
+    shape_cache = shapeCacheNew()
+
     for node, ancestry in all_nodes:
         #if 'castle.wrl' not in node.getFilename():
         #   continue
@@ -2575,7 +2352,7 @@ def load_web3d(path,
             # by an external script. - gets first pick
             pass
         if spec == 'Shape':
-            importShape(node, ancestry, global_matrix)
+            importShape(node, ancestry, global_matrix, shape_cache)
         elif spec in {'PointLight', 'DirectionalLight', 'SpotLight'}:
             importLamp(node, spec, ancestry, global_matrix)
         elif spec == 'Viewpoint':
@@ -2591,6 +2368,10 @@ def load_web3d(path,
             translatePositionInterpolator(node, action)
             '''
 
+    if shape_cache['reused_mesh'] or shape_cache['reused_material']:
+        print('\tShared %d geometry and %d appearance builds between instances' %
+              (shape_cache['reused_mesh'], shape_cache['reused_material']))
+
     # After we import all nodes, route events - anim paths
     for node, ancestry in all_nodes:
         importRoute(node, ancestry)
@@ -23,7 +23,7 @@ bl_info = {
     "author": "Bill L.Nieuwendorp",
     "blender": (2, 57, 0),
     "location": "File > Import-Export",
-    "description": "Import-Export MDD as mesh shape keys",
+    "description": "Import-Export MDD as mesh shape keys, import PC2",
     "warning": "",
     "wiki_url": "http://wiki.blender.org/index.php/Extensions:2.6/Py/"
                 "Scripts/Import-Export/NewTek_OBJ",
@@ -40,7 +40,7 @@ if "bpy" in locals():
 
 
 import bpy
-from bpy.props import StringProperty, IntProperty, FloatProperty
+from bpy.props import StringProperty, IntProperty, FloatProperty, BoolProperty
 from bpy_extras.io_utils import ExportHelper, ImportHelper
 
 
@@ -86,6 +86,48 @@ class ImportMDD(bpy.types.Operator, ImportHelper):
         return import_mdd.load(self, context, **keywords)
 
 
+class ImportPC2(bpy.types.Operator, ImportHelper):
+    """Import PC2 point cache file to shape keys"""
+    bl_idname = "import_shape.pc2"
+    bl_label = "Import PC2"
+    bl_options = {'UNDO'}
+
+    filename_ext = ".pc2"
+
+    filter_glob = StringProperty(
+            default="*.pc2",
+            options={'HIDDEN'},
+            )
+    frame_start = IntProperty(
+            name="Start Frame",
+            description="Start frame for inserting animation",
+            min=-300000, max=300000,
+            default=0,
+            )
+    frame_step = IntProperty(
+            name="Step",
+            min=1, max=1000,
+            default=1,
+            )
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return (obj and obj.type == 'MESH')
+
+    def invoke(self, context, event):
+        scene = context.scene
+        self.frame_start = scene.frame_start
+
+        return super().invoke(context, event)
+
+    def execute(self, context):
+        keywords = self.as_keywords(ignore=("filter_glob",))
+
+        from . import import_mdd
+        return import_mdd.load_pc2(self, context, **keywords)
+
+
 class ExportMDD(bpy.types.Operator, ExportHelper):
     """Animated mesh to MDD vertex keyframe file"""
     bl_idname = "export_shape.mdd"
@@ -121,6 +163,12 @@ class ExportMDD(bpy.types.Operator, ExportHelper):
             min=minframe, max=maxframe,
             default=250,
             )
+    use_parallel = BoolProperty(
+            name="Parallel Export",
+            description="Sample long frame ranges in background Blender "
+                        "processes, one for each processor core",
+            default=False,
+            )
 
     @classmethod
     def poll(cls, context):
@@ -146,6 +194,9 @@ def menu_func_import(self, context):
     self.layout.operator(ImportMDD.bl_idname,
                          text="Lightwave Point Cache (.mdd)",
                          )
+    self.layout.operator(ImportPC2.bl_idname,
+                         text="Pointcache (.pc2)",
+                         )
 
 
 def menu_func_export(self, context):
@@ -31,7 +31,6 @@ Be sure not to use modifiers that change the number or order of verts in the mes
 
 import bpy
 import mathutils
-from struct import pack
 
 
 def zero_file(filepath):
@@ -43,21 +42,14 @@ def zero_file(filepath):
     file.close()
 
 
-def check_vertcount(mesh, vertcount):
-    """
-    check and make sure the vertcount is consistent throughout the frame range
-    """
-    if len(mesh.vertices) != vertcount:
-        raise Exception('Error, number of verts has changed during animation, cannot export')
-
-
-def save(operator, context, filepath="", frame_start=1, frame_end=300, fps=25.0):
+def save(operator, context, filepath="", frame_start=1, frame_end=300, fps=25.0, use_parallel=False):
     """
     Blender.Window.WaitCursor(1)
 
     mesh_orig = Mesh.New()
     mesh_orig.getFromObject(obj.name)
     """
+    import point_cache
 
     scene = context.scene
     obj = context.object
@@ -66,8 +58,6 @@ def save(operator, context, filepath="", frame_start=1, frame_end=300, fps=25.0)
         bpy.ops.object.mode_set(mode='OBJECT')
 
     orig_frame = scene.frame_current
-    scene.frame_set(frame_start)
-    me = obj.to_mesh(scene, True, 'PREVIEW')
 
     #Flip y and z
     '''
@@ -79,32 +69,24 @@ def save(operator, context, filepath="", frame_start=1, frame_end=300, fps=25.0)
     '''
     mat_flip = mathutils.Matrix()
 
-    numverts = len(me.vertices)
-
     numframes = frame_end - frame_start + 1
-    f = open(filepath, 'wb')  # no Errors yet:Safe to create file
-
-    # Write the header
-    f.write(pack(">2i", numframes, numverts))
 
     # Write the frame times (should we use the time IPO??)
-    f.write(pack(">%df" % (numframes), *[frame / fps for frame in range(numframes)]))  # seconds
+    times = [frame / fps for frame in range(numframes)]  # seconds
 
-    #rest frame needed to keep frames in sync
-    check_vertcount(me, numverts)
-    me.transform(mat_flip * obj.matrix_world)
-    f.write(pack(">%df" % (numverts * 3), *[axis for v in me.vertices for axis in v.co]))
+    def write_header(numverts):
+        point_cache.write_mdd_header(f, numverts, times)
 
-    for frame in range(frame_start, frame_end + 1):  # in order to start at desired frame
-        scene.frame_set(frame)
-        me = obj.to_mesh(scene, True, 'PREVIEW')
-        check_vertcount(me, numverts)
-        me.transform(mat_flip * obj.matrix_world)
+    f = open(filepath, 'wb')  # no Errors yet:Safe to create file
 
-        # Write the vertex data
-        f.write(pack(">%df" % (numverts * 3), *[axis for v in me.vertices for axis in v.co]))
+    # rest frame needed to keep frames in sync, the first frame is only evaluated once
+    frames = [frame_start] + list(range(frame_start, frame_end + 1))  # in order to start at desired frame
 
-    f.close()
+    try:
+        point_cache.write_object(f, scene, obj, frames, 'big', write_header,
+                                 world_space=True, matrix=mat_flip, use_workers=use_parallel)
+    finally:
+        f.close()
 
     print('MDD Exported: %r frames:%d\n' % (filepath, numframes - 1))
     scene.frame_set(orig_frame)
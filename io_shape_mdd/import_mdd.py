@@ -32,78 +32,97 @@
 # Bill Niewuendorp
 
 import bpy
-from struct import unpack
 
-def set_linear_interpolation(obj, shapekey):
-    anim_data = obj.data.shape_keys.animation_data
-    data_path = "key_blocks[\"" + shapekey.name + "\"].value"
 
-    for fcu in anim_data.action.fcurves:
-        if fcu.data_path == data_path:
-            for keyframe in fcu.keyframe_points:
-                keyframe.interpolation = 'LINEAR'
+def shape_keys_add(obj, frames, frame_start, frame_step):
+    """
+    Add a shape key for each frame (flat arrays of coordinates),
+    keyed to be fully on at its frame and off at the frames around it.
+    """
+    # If target object doesn't have Basis shape key, create it.
+    if not obj.data.shape_keys:
+        basis = obj.shape_key_add()
+        basis.name = "Basis"
+        obj.data.update()
 
+    shape_keys = obj.data.shape_keys
+    if not shape_keys.animation_data:
+        shape_keys.animation_data_create()
 
-def obj_update_frame(file, scene, obj, start, fr, step):
+    anim_data = shape_keys.animation_data
+    if not anim_data.action:
+        anim_data.action = bpy.data.actions.new(name=shape_keys.name + "Action")
 
-    # Insert new shape key
-    new_shapekey = obj.shape_key_add()
-    new_shapekey.name = ("frame_%.4d" % fr)
-    new_shapekey_index = len(obj.data.shape_keys.key_blocks) - 1
+    fcurves = anim_data.action.fcurves
+    data_paths = {fcu.data_path for fcu in fcurves}
 
-    obj.active_shape_key_index = new_shapekey_index
-    obj.show_only_shape_key = True
+    for fr, co in enumerate(frames):
+        # Insert new shape key
+        new_shapekey = obj.shape_key_add()
+        new_shapekey.name = ("frame_%.4d" % fr)
+        new_shapekey.data.foreach_set("co", co)
 
-    verts = new_shapekey.data
+        # insert keyframes
+        data_path = "key_blocks[\"" + new_shapekey.name + "\"].value"
+        if data_path in data_paths:
+            # left over from a removed shape key
+            fcurves.remove(next(fcu for fcu in fcurves if fcu.data_path == data_path))
 
-    for v in verts:  # 12 is the size of 3 floats
-        v.co[:] = unpack('>3f', file.read(12))
+        frame = frame_start + fr * frame_step
 
-    # me.update()
-    obj.show_only_shape_key = False
+        fcu = fcurves.new(data_path=data_path)
+        fcu.keyframe_points.add(3)
+        fcu.keyframe_points.foreach_set("co", (frame - frame_step, 0.0,
+                                               frame, 1.0,
+                                               frame + frame_step, 0.0))
+        for keyframe in fcu.keyframe_points:
+            keyframe.interpolation = 'LINEAR'
 
-    # insert keyframes
-    new_shapekey = obj.data.shape_keys.key_blocks[new_shapekey_index]
-    frame = start + fr*step
+    obj.active_shape_key_index = len(shape_keys.key_blocks) - 1
+    obj.data.update()
 
-    new_shapekey.value = 0.0
-    new_shapekey.keyframe_insert("value", frame=frame - step)
 
-    new_shapekey.value = 1.0
-    new_shapekey.keyframe_insert("value", frame=frame)
+def load_frames(operator, context, filepath, read_header, byteorder, frame_start, frame_step):
+    import struct
+    import point_cache
 
-    new_shapekey.value = 0.0
-    new_shapekey.keyframe_insert("value", frame=frame + step)
+    obj = context.object
 
-    set_linear_interpolation(obj, new_shapekey)
+    with open(filepath, 'rb') as file:
+        try:
+            frames, points = read_header(file)[:2]
 
-    obj.data.update()
+            print('\tpoints:%d frames:%d' % (points, frames))
+            print('\tstart frame:%d step:%d' % (frame_start, frame_step))
 
+            if points != len(obj.data.vertices):
+                operator.report({'ERROR'}, "Point count %d doesn't match the %d vertices of the mesh" %
+                                (points, len(obj.data.vertices)))
+                return {'CANCELLED'}
 
-def load(operator, context, filepath, frame_start=0, frame_step=1):
+            if bpy.ops.object.mode_set.poll():
+                bpy.ops.object.mode_set(mode='OBJECT')
 
-    scene = context.scene
-    obj = context.object
+            shape_keys_add(obj, point_cache.read_frames(file, frames, points, byteorder), frame_start, frame_step)
 
-    print('\n\nimporting mdd %r' % filepath)
+        except (ValueError, struct.error) as err:
+            operator.report({'ERROR'}, str(err))
+            return {'CANCELLED'}
 
-    if bpy.ops.object.mode_set.poll():
-        bpy.ops.object.mode_set(mode='OBJECT')
+    return {'FINISHED'}
 
-    file = open(filepath, 'rb')
-    frames, points = unpack(">2i", file.read(8))
-    time = unpack((">%df" % frames), file.read(frames * 4))
 
-    print('\tpoints:%d frames:%d' % (points, frames))
-    print('\tstart frame:%d step:%d' % (frame_start, frame_step))
+def load(operator, context, filepath, frame_start=0, frame_step=1):
+    import point_cache
 
-    # If target object doesn't have Basis shape key, create it.
-    if not obj.data.shape_keys:
-        basis = obj.shape_key_add()
-        basis.name = "Basis"
-        obj.data.update()
+    print('\n\nimporting mdd %r' % filepath)
 
-    for i in range(frames):
-        obj_update_frame(file, scene, obj, frame_start, i, frame_step)
+    return load_frames(operator, context, filepath, point_cache.read_mdd_header, 'big', frame_start, frame_step)
 
-    return {'FINISHED'}
+
+def load_pc2(operator, context, filepath, frame_start=0, frame_step=1):
+    import point_cache
+
+    print('\n\nimporting pc2 %r' % filepath)
+
+    return load_frames(operator, context, filepath, point_cache.read_pc2_header, 'little', frame_start, frame_step)
@@ -0,0 +1,228 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+Disk cache for the geometry parsed by importers, so importing an
+unchanged file again skips parsing.
+
+Entries are keyed by the path, size and modification time of the file
+and the importer options. An entry is one file: a marshal'ed header with
+the small values, followed by the raw data of the arrays (array.array or
+numpy arrays), aligned so numpy arrays are mapped from the file instead
+of being read. Entries are touched when used and the least recently used
+ones are removed once the cache is larger than CACHE_SIZE.
+"""
+
+import os
+import array
+import marshal
+import mmap
+import struct
+import hashlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CACHE_VERSION = 2
+CACHE_SIZE = 2 * 1024 * 1024 * 1024
+CACHE_EXT = ".geocache"
+
+MAGIC = b'BGEOCACHE'
+HEADER = struct.Struct('<9sQ')
+ALIGN = 64
+
+
+def cache_path():
+    """Directory of the cache entries, in the user data files"""
+    try:
+        import bpy
+        return bpy.utils.user_resource('DATAFILES', "geometry_cache", create=True)
+    except ImportError:
+        import tempfile
+        path = os.path.join(tempfile.gettempdir(), "blender_geometry_cache")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+
+def entry_key(filepath, importer, options):
+    """Key of the entry for the current state of the file, None if it doesn't exist"""
+    if isinstance(filepath, bytes):
+        filepath = os.fsdecode(filepath)
+
+    filepath = os.path.abspath(filepath)
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+
+    return repr((CACHE_VERSION, importer, filepath, st.st_size, st.st_mtime, tuple(options)))
+
+
+def entry_path(key, importer, directory):
+    return os.path.join(directory, "%s_%s%s" % (importer, hashlib.sha1(key.encode('utf8')).hexdigest(), CACHE_EXT))
+
+
+def _aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _array_spec(data):
+    if numpy is not None and isinstance(data, numpy.ndarray):
+        dtype = data.dtype.descr if data.dtype.names else data.dtype.str
+        return 'numpy', dtype, data.shape, data.nbytes
+
+    return 'array', data.typecode, len(data), len(data) * data.itemsize
+
+
+def store(filepath, importer, options, values, arrays, directory=None):
+    """
+    Store the parsed *values* (basic python types only) and *arrays*
+    (dict of array.array or numpy arrays) of the file.
+    Fails silently, the cache is only an optimization.
+    """
+    key = entry_key(filepath, importer, options)
+    if key is None:
+        return
+
+    names = sorted(arrays)
+    specs = [_array_spec(arrays[name]) for name in names]
+    size = sum(spec[3] + ALIGN for spec in specs)
+    if size > CACHE_SIZE:
+        return
+
+    try:
+        directory = directory or cache_path()
+        path = entry_path(key, importer, directory)
+        temp_path = "%s.%i.temp" % (path, os.getpid())
+
+        # array offsets depend on the header size, reserve room for the largest offsets
+        header = marshal.dumps((key, values, [(name,) + spec + (0xFFFFFFFFFFFF,) for name, spec in zip(names, specs)]))
+        offset = _aligned(HEADER.size + len(header))
+        array_specs = []
+        for name, spec in zip(names, specs):
+            array_specs.append((name,) + spec + (offset,))
+            offset = _aligned(offset + spec[3])
+
+        header = marshal.dumps((key, values, array_specs))
+
+        with open(temp_path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, len(header)))
+            file.write(header)
+            for name, spec in zip(names, array_specs):
+                file.seek(spec[-1])
+                data = arrays[name]
+                if isinstance(data, array.array):
+                    data.tofile(file)
+                else:
+                    file.write(numpy.ascontiguousarray(data).data)
+            file.truncate(offset)
+
+        os.replace(temp_path, path)
+    except (OSError, ValueError) as err:
+        print("Geometry cache not written:", err)
+        return
+
+    evict(directory)
+
+
+def load(filepath, importer, options, directory=None):
+    """
+    Values and arrays stored for the file as (values, arrays), None if
+    there is no entry for the file in its current state.
+    """
+    key = entry_key(filepath, importer, options)
+    if key is None:
+        return None
+
+    directory = directory or cache_path()
+    path = entry_path(key, importer, directory)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'rb') as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, header_size = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("not a cache entry")
+
+        stored_key, values, array_specs = marshal.loads(data[HEADER.size:HEADER.size + header_size])
+        if stored_key != key:
+            # hash collision or older format
+            return None
+
+        arrays = {}
+        for name, kind, dtype, shape, nbytes, offset in array_specs:
+            if kind == 'numpy':
+                if numpy is None:
+                    return None
+                dtype = numpy.dtype(dtype if isinstance(dtype, str) else [tuple(field) for field in dtype])
+                arrays[name] = numpy.frombuffer(data, dtype, nbytes // max(dtype.itemsize, 1), offset).reshape(shape)
+            else:
+                arrays[name] = array.array(dtype, data[offset:offset + nbytes])
+
+    except (OSError, ValueError, EOFError, TypeError, struct.error) as err:
+        print("Geometry cache entry invalid:", err)
+        remove(path)
+        return None
+
+    # most recently used
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+    return values, arrays
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        # still mapped on windows
+        pass
+
+
+def evict(directory=None, size=None):
+    """Remove the least recently used entries until the cache fits in *size* bytes"""
+    directory = directory or cache_path()
+    if size is None:
+        size = CACHE_SIZE
+
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith(CACHE_EXT):
+            path = os.path.join(directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum(entry[1] for entry in entries)
+    entries.sort()
+    for mtime, entry_size, path in entries:
+        if total <= size:
+            break
+        remove(path)
+        total -= entry_size
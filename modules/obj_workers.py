@@ -0,0 +1,329 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+Functions the OBJ importer and exporter run in worker processes.
+
+This module doesn't import bpy: where workers are started as new
+processes (spawn, on Windows and recent macOS) they run the python
+executable shipped with blender, which imports this module by name.
+"""
+
+import os
+import sys
+import array
+
+# Lines the chunked parser leaves to the serial one
+OBJ_SERIAL_KEYWORDS = {b'cstype', b'curv', b'parm', b'deg', b'end'}
+
+
+def worker_pool():
+    """
+    Process pool running the functions of this module,
+    None when there is only one processor or workers can't be started.
+    """
+    try:
+        import multiprocessing
+        if multiprocessing.cpu_count() < 2:
+            return None
+
+        if _start_method(multiprocessing) != 'fork':
+            # new processes would start blender itself otherwise
+            python = _python_executable()
+            if python is None:
+                return None
+            multiprocessing.set_executable(python)
+
+        return multiprocessing.Pool()
+    except (ImportError, OSError, NotImplementedError):
+        import traceback
+        traceback.print_exc()
+    return None
+
+
+def _start_method(multiprocessing):
+    try:
+        return multiprocessing.get_start_method()
+    except AttributeError:
+        # before python 3.4, processes are forked except on windows
+        return 'spawn' if sys.platform == 'win32' else 'fork'
+
+
+def _python_executable():
+    import bpy
+    python = getattr(bpy.app, "binary_path_python", "")
+    if python and os.path.exists(python):
+        return python
+    print("\tWarning: python executable not found, not using worker processes")
+    return None
+
+
+def line_value(line_split):
+    """
+    Returns 1 string represneting the value for this line
+    None will be returned if theres only 1 word
+    """
+    length = len(line_split)
+    if length == 1:
+        return None
+
+    elif length == 2:
+        return line_split[1]
+
+    elif length > 2:
+        return b' '.join(line_split[1:])
+
+
+def parse_obj_chunk(args):
+    """
+    Parse one chunk of an obj file into flat arrays (OBJ importer).
+
+    Indices are 0 based, negative (relative) indices are resolved against the
+    verts of this chunk and their positions are returned so the caller can add
+    the number of verts read before the chunk. Context changes are returned as
+    (face_count, keyword, value) events.
+    Returns None when the chunk needs the serial parser (nurbs, multiline faces).
+    """
+    filepath, start, end, use_comma, use_edges, use_smooth_groups, use_split_objects, use_split_groups = args
+
+    if use_comma:
+        float_func = lambda f: float(f.replace(b',', b'.'))
+    else:
+        float_func = float
+
+    verts_loc = array.array('d')
+    verts_tex = array.array('d')
+    face_lengths = array.array('l')  # negative for edges
+    loc_indices = array.array('l')
+    loc_relative = array.array('l')
+    tex_indices = array.array('l')
+    tex_relative = array.array('l')
+    events = []
+    material_libs = []
+    has_ngons = False
+    tot_loc = tot_tex = 0
+
+    file = open(filepath, 'rb')
+    file.seek(start)
+    data = file.read(end - start)
+    file.close()
+
+    for line in data.split(b'\n'):
+        line_split = line.split()
+
+        if not line_split:
+            continue
+
+        line_start = line_split[0]
+
+        if line_start == b'v':
+            verts_loc.append(float_func(line_split[1]))
+            verts_loc.append(float_func(line_split[2]))
+            verts_loc.append(float_func(line_split[3]))
+            tot_loc += 1
+
+        elif line_start == b'vt':
+            verts_tex.append(float_func(line_split[1]))
+            verts_tex.append(float_func(line_split[2]))
+            tot_tex += 1
+
+        elif line_start == b'f':
+            if line_split[-1][-1] == 92:  # '\' char
+                return None
+
+            for v in line_split[1:]:
+                obj_vert = v.split(b'/')
+                vert_loc_index = int(obj_vert[0]) - 1
+                if vert_loc_index < 0:
+                    loc_relative.append(len(loc_indices))
+                    vert_loc_index += tot_loc + 1
+                loc_indices.append(vert_loc_index)
+
+                if len(obj_vert) > 1 and obj_vert[1]:
+                    vert_tex_index = int(obj_vert[1]) - 1
+                    if vert_tex_index < 0:
+                        tex_relative.append(len(tex_indices))
+                        vert_tex_index += tot_tex + 1
+                    tex_indices.append(vert_tex_index)
+                else:
+                    # dummy
+                    tex_indices.append(0)
+
+            face_lengths.append(len(line_split) - 1)
+            if len(line_split) > 5:
+                has_ngons = True
+
+        elif use_edges and line_start == b'l':
+            if line_split[-1][-1] == 92:  # '\' char
+                return None
+
+            for v in line_split[1:]:
+                vert_loc_index = int(v) - 1
+                if vert_loc_index < 0:
+                    loc_relative.append(len(loc_indices))
+                    vert_loc_index += tot_loc + 1
+                loc_indices.append(vert_loc_index)
+
+            face_lengths.append(1 - len(line_split))
+
+        elif line_start == b's':
+            if use_smooth_groups:
+                context_smooth_group = line_value(line_split)
+                if context_smooth_group == b'off':
+                    context_smooth_group = None
+                events.append((len(face_lengths), b's', context_smooth_group))
+
+        elif line_start == b'o':
+            if use_split_objects:
+                events.append((len(face_lengths), b'o', line_value(line_split)))
+
+        elif line_start == b'g':
+            if use_split_groups:
+                events.append((len(face_lengths), b'o', line_value(line_split)))
+
+        elif line_start == b'usemtl':
+            events.append((len(face_lengths), b'usemtl', line_value(line_split)))
+
+        elif line_start == b'mtllib':
+            material_libs.extend(line_split[1:])
+
+        elif line_start in OBJ_SERIAL_KEYWORDS:
+            return None
+
+    return (verts_loc, verts_tex, face_lengths,
+            loc_indices, loc_relative, tex_indices, tex_relative,
+            events, material_libs, has_ngons)
+
+
+def format_verts(co):
+    coords = iter(co)
+    return ''.join(['v %.6f %.6f %.6f\n' % v for v in zip(coords, coords, coords)])
+
+
+def prepare_faces(args):
+    """
+    Loop data of the faces in writing order, uv and normal indices are local
+    to the mesh (OBJ exporter). Returns the vt and vn lines and the arrays
+    format_faces takes.
+    """
+    face_order, loop_starts, loop_totals, loop_verts, uvs, smooth, vert_normals, face_normals = args
+
+    face_sizes = array.array('i')
+    verts = array.array('i')
+    uv_indices = uv_lines = None
+    no_indices = no_lines = None
+
+    for f_index in face_order:
+        start = loop_starts[f_index]
+        total = loop_totals[f_index]
+        face_sizes.append(total)
+        verts.extend(loop_verts[start:start + total])
+
+    if uvs is not None:
+        uv_indices = array.array('i')
+        uv_lines = []
+        uv_dict = {}
+        for f_index in face_order:
+            start = loop_starts[f_index]
+            for l_index in range(start * 2, (start + loop_totals[f_index]) * 2, 2):
+                uv = uvs[l_index], uvs[l_index + 1]
+                uvkey = round(uv[0], 6), round(uv[1], 6)
+                uv_k = uv_dict.get(uvkey)
+                if uv_k is None:
+                    uv_k = uv_dict[uvkey] = len(uv_dict)
+                    uv_lines.append('vt %.6f %.6f\n' % uv)
+                uv_indices.append(uv_k)
+
+    if vert_normals is not None:
+        no_indices = array.array('i')
+        no_lines = []
+        no_dict = {}
+        for f_index in face_order:
+            start = loop_starts[f_index]
+            total = loop_totals[f_index]
+            if smooth[f_index]:
+                keys = [(round(vert_normals[v_idx * 3], 6),
+                         round(vert_normals[v_idx * 3 + 1], 6),
+                         round(vert_normals[v_idx * 3 + 2], 6),
+                         ) for v_idx in loop_verts[start:start + total]]
+            else:
+                # Hard, 1 normal from the face.
+                keys = [(round(face_normals[f_index * 3], 6),
+                         round(face_normals[f_index * 3 + 1], 6),
+                         round(face_normals[f_index * 3 + 2], 6),
+                         )] * total
+
+            for noKey in keys:
+                no_k = no_dict.get(noKey)
+                if no_k is None:
+                    no_k = no_dict[noKey] = len(no_dict)
+                    no_lines.append('vn %.6f %.6f %.6f\n' % noKey)
+                no_indices.append(no_k)
+
+    text = ''.join((uv_lines or []) + (no_lines or []))
+    return (text,
+            len(uv_lines or ()), len(no_lines or ()),
+            face_sizes, verts, uv_indices, no_indices)
+
+
+def format_faces(args):
+    """
+    f lines of prepared faces, context maps the index of a face
+    to the lines written before it (material and smooth group switches).
+    """
+    face_sizes, verts, uv_indices, no_indices, context, totverts, totuvco, totno = args
+
+    columns = [[i + totverts for i in verts]]
+    if uv_indices is not None:
+        columns.append([i + totuvco for i in uv_indices])
+    if no_indices is not None:
+        columns.append([i + totno for i in no_indices])
+
+    if len(columns) == 3:
+        vert_format = " %d/%d/%d"
+    elif uv_indices is not None:
+        vert_format = " %d/%d"
+    elif no_indices is not None:
+        vert_format = " %d//%d"
+    else:
+        vert_format = " %d"
+
+    # interleave the indices of each face vertex
+    stride = len(columns)
+    values = [None] * (len(verts) * stride)
+    for i, column in enumerate(columns):
+        values[i::stride] = column
+
+    face_formats = {}
+    lines = []
+    index = 0
+    for face_pos, face_size in enumerate(face_sizes):
+        if face_pos in context:
+            lines.append(context[face_pos])
+
+        face_format = face_formats.get(face_size)
+        if face_format is None:
+            face_format = face_formats[face_size] = 'f' + vert_format * face_size + '\n'
+
+        end = index + face_size * stride
+        lines.append(face_format % tuple(values[index:end]))
+        index = end
+
+    return ''.join(lines)
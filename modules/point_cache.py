@@ -0,0 +1,266 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+Reading and writing of vertex point caches, Lightwave MDD and PC2 files.
+
+Both store a header followed by a block of (x, y, z) floats for each
+frame, MDD big endian and PC2 little endian. Frames are read and written
+a whole block at a time, as arrays of floats in native byte order that
+go straight to foreach_set("co", ...) or come from foreach_get.
+
+Long frame ranges can be sampled by background Blender processes running
+this file, each one writing the blocks of a part of the frames, which
+are then appended in order.
+"""
+
+import os
+import sys
+import math
+import array
+import struct
+
+MDD_HEADER = struct.Struct('>2i')
+PC2_HEADER = struct.Struct('<12siiffi')
+PC2_SIGNATURE = b'POINTCACHE2\0'
+
+WORKER_FRAMES = 50  # fewer frames don't pay for starting a blender process
+
+
+def read_mdd_header(file):
+    """(frame count, point count, frame times in seconds) of an MDD file"""
+    frame_count, point_count = MDD_HEADER.unpack(file.read(MDD_HEADER.size))
+
+    data = file.read(frame_count * 4)
+    if len(data) != frame_count * 4:
+        raise ValueError("MDD file truncated in the header")
+
+    times = array.array('f', data)
+    if sys.byteorder != 'big':
+        times.byteswap()
+
+    return frame_count, point_count, times
+
+
+def read_pc2_header(file):
+    """(sample count, point count, start frame, sample rate) of a PC2 file"""
+    signature, version, point_count, start, sampling, sample_count = PC2_HEADER.unpack(file.read(PC2_HEADER.size))
+    if signature != PC2_SIGNATURE:
+        raise ValueError("Not a PC2 file")
+
+    return sample_count, point_count, start, sampling
+
+
+def read_frames(file, frame_count, point_count, byteorder):
+    """
+    Coordinates of each frame as a flat array of floats (x, y, z for each
+    point), *byteorder* is the one of the file, 'big' or 'little'.
+    """
+    size = point_count * 3
+    swap = byteorder != sys.byteorder
+
+    for frame in range(frame_count):
+        data = file.read(size * 4)
+        if len(data) != size * 4:
+            raise ValueError("Point cache truncated at frame %d" % frame)
+
+        co = array.array('f', data)
+        if swap:
+            co.byteswap()
+
+        yield co
+
+
+def write_mdd_header(file, point_count, times):
+    file.write(MDD_HEADER.pack(len(times), point_count))
+    file.write(struct.pack(">%df" % len(times), *times))
+
+
+def write_pc2_header(file, point_count, start, sampling, sample_count):
+    file.write(PC2_HEADER.pack(PC2_SIGNATURE, 1, point_count, start, sampling, sample_count))
+
+
+def write_frames(file, frames, byteorder, header=None):
+    """
+    Write the coordinates of each frame (flat arrays of floats) as one
+    block, in *byteorder*. header(point_count) is called before the first
+    block, returns the point count.
+    """
+    swap = byteorder != sys.byteorder
+    point_count = None
+
+    for frame, co in enumerate(frames):
+        if point_count is None:
+            point_count = len(co) // 3
+            if header:
+                header(point_count)
+        elif len(co) != point_count * 3:
+            raise ValueError("Number of vertices changed at frame %d of the animation, cannot export" % frame)
+
+        if swap:
+            # the same array may be given for several frames
+            co = array.array('f', co)
+            co.byteswap()
+
+        co.tofile(file)
+
+    return point_count
+
+
+def sample_frames(scene, obj, frames, apply_modifiers=True, world_space=False, matrix=None):
+    """
+    Coordinates of the vertices of obj at each of the frames (may be
+    fractional), as flat arrays of floats. Transformed by the world matrix
+    of the object at that frame when world_space, then by matrix.
+    The same frame given again in a row isn't evaluated again.
+    """
+    import bpy
+
+    prev_frame = co = None
+
+    for frame in frames:
+        if frame == prev_frame:
+            yield co
+            continue
+
+        frame_int = int(math.floor(frame))
+        scene.frame_set(frame_int, subframe=frame - frame_int)
+
+        mesh = obj.to_mesh(scene, apply_modifiers, 'PREVIEW')
+        try:
+            if world_space:
+                mesh.transform(obj.matrix_world if matrix is None else matrix * obj.matrix_world)
+            elif matrix is not None:
+                mesh.transform(matrix)
+
+            co = array.array('f', [0.0]) * (len(mesh.vertices) * 3)
+            mesh.vertices.foreach_get("co", co)
+        finally:
+            bpy.data.meshes.remove(mesh)
+
+        prev_frame = frame
+        yield co
+
+
+def write_object(file, scene, obj, frames, byteorder, header=None,
+                 apply_modifiers=True, world_space=False, matrix=None,
+                 use_workers=False):
+    """
+    Sample and write the coordinates of obj for each of the frames, see
+    sample_frames and write_frames. With use_workers the frames are split
+    across background Blender processes, one per core.
+    """
+    import multiprocessing
+
+    frames = list(frames)
+    worker_count = 1
+    if use_workers:
+        worker_count = min(multiprocessing.cpu_count(), len(frames) // WORKER_FRAMES)
+
+    if worker_count < 2:
+        return write_frames(file, sample_frames(scene, obj, frames, apply_modifiers, world_space, matrix), byteorder, header)
+
+    import bpy
+    import shutil
+    import tempfile
+    import subprocess
+
+    # contiguous ranges, the first one is sampled here while the workers run
+    chunk_size = -(-len(frames) // worker_count)
+    chunks = [frames[i:i + chunk_size] for i in range(0, len(frames), chunk_size)]
+
+    directory = tempfile.mkdtemp(prefix="point_cache_", dir=bpy.app.tempdir or None)
+    workers = []
+
+    try:
+        filepath = os.path.join(directory, "scene.blend")
+        bpy.ops.wm.save_as_mainfile(filepath=filepath, copy=True, check_existing=False)
+
+        matrix_arg = ",".join(repr(value) for row in matrix for value in row) if matrix is not None else "-"
+
+        for i, chunk in enumerate(chunks[1:]):
+            cache_path = os.path.join(directory, "frames_%d.cache" % i)
+
+            # frames are given in a file, the command line length is limited (windows)
+            frames_path = cache_path + ".frames"
+            with open(frames_path, 'w') as frames_file:
+                frames_file.write("\n".join(repr(frame) for frame in chunk))
+
+            log = open(cache_path + ".log", 'w')
+            arguments = [bpy.app.binary_path, "-b", "-noaudio", filepath, "-P", __file__, "--",
+                         cache_path, scene.name, obj.name, byteorder,
+                         str(int(apply_modifiers)), str(int(world_space)), matrix_arg, frames_path]
+            process = subprocess.Popen(arguments, stdout=log, stderr=subprocess.STDOUT)
+            workers.append((process, log, cache_path, chunk))
+
+        point_count = write_frames(file, sample_frames(scene, obj, chunks[0], apply_modifiers, world_space, matrix), byteorder, header)
+
+        for process, log, cache_path, chunk in workers:
+            process.wait()
+            log.close()
+
+            size = os.path.getsize(cache_path) if os.path.exists(cache_path) else -1
+            if size == len(chunk) * point_count * 12:
+                with open(cache_path, 'rb') as cache_file:
+                    shutil.copyfileobj(cache_file, file)
+            else:
+                # a worker doesn't report errors, sample its frames here to get them
+                print("Point cache worker failed, sampling its frames again:")
+                with open(log.name) as log_file:
+                    print(log_file.read()[-2000:])
+
+                if write_frames(file, sample_frames(scene, obj, chunk, apply_modifiers, world_space, matrix), byteorder) != point_count:
+                    raise ValueError("Number of vertices changed during the animation, cannot export")
+
+    finally:
+        for process, log, cache_path, chunk in workers:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            log.close()
+
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return point_count
+
+
+if __name__ == "__main__":
+    # worker process, started by write_object:
+    # blender -b file.blend -P point_cache.py -- cache_path scene object byteorder apply_modifiers world_space matrix frames_path
+    import bpy
+    import mathutils
+
+    args = sys.argv[sys.argv.index("--") + 1:]
+    cache_path, scene_name, obj_name, byteorder, apply_modifiers, world_space, matrix, frames_path = args[:8]
+
+    with open(frames_path) as frames_file:
+        frames = [float(frame) for frame in frames_file.read().split()]
+
+    if matrix == "-":
+        matrix = None
+    else:
+        values = [float(value) for value in matrix.split(",")]
+        matrix = mathutils.Matrix([values[i:i + 4] for i in range(0, 16, 4)])
+
+    scene = bpy.data.scenes[scene_name]
+    obj = scene.objects[obj_name]
+
+    with open(cache_path, 'wb') as file:
+        write_frames(file, sample_frames(scene, obj, frames, apply_modifiers == "1", world_space == "1", matrix), byteorder)
@@ -21,7 +21,7 @@
 bl_info = {
     "name": "Network Renderer",
     "author": "Martin Poirier",
-    "version": (1, 8),
+    "version": (1, 9),
     "blender": (2, 60, 0),
     "location": "Render > Engine > Network Render",
     "description": "Distributed rendering for Blender",
@@ -45,6 +45,10 @@ if "init_data" in locals():
     imp.reload(repath)
     imp.reload(versioning)
     imp.reload(baking)
+    imp.reload(journal)
+    imp.reload(filecache)
+    imp.reload(metrics)
+    imp.reload(tiles)
 else:
     from netrender import model
     from netrender import operators
@@ -58,6 +62,10 @@ else:
     from netrender import repath
     from netrender import versioning
     from netrender import baking
+    from netrender import journal
+    from netrender import filecache
+    from netrender import metrics
+    from netrender import tiles
 
 jobs = []
 slaves = []
@@ -16,7 +16,7 @@
 #
 # ##### END GPL LICENSE BLOCK #####
 
-import time
+import re, time, heapq, threading
 
 from netrender.utils import *
 import netrender.model
@@ -29,6 +29,9 @@ class RatingRule:
     def id(self):
         return str(id(self))
 
+    def prepare(self, jobs):
+        pass
+
     def rate(self, job):
         return 0
 
@@ -39,6 +42,9 @@ class ExclusionRule:
     def id(self):
         return str(id(self))
 
+    def prepare(self, jobs):
+        pass
+
     def test(self, job):
         return False
 
@@ -49,6 +55,9 @@ class PriorityRule:
     def id(self):
         return str(id(self))
 
+    def prepare(self, jobs):
+        pass
+
     def test(self, job):
         return False
 
@@ -97,6 +106,12 @@ class Balancer:
 
         return False
 
+    def prepare(self, jobs):
+        # let rules cache what they need from the whole job list once per pass
+        for rule in self.rules + self.priorities + self.exceptions:
+            if rule.enabled:
+                rule.prepare(jobs)
+
     def sortKey(self, job):
         return (1 if self.applyExceptions(job) else 0, # exceptions after
                         0 if self.applyPriorities(job) else 1, # priorities first
@@ -104,12 +119,150 @@ class Balancer:
 
     def balance(self, jobs):
         if jobs:
+            self.prepare(jobs)
             # use inline copy to make sure the list is still accessible while sorting
             jobs[:] = sorted(jobs, key=self.sortKey)
             return jobs[0]
         else:
             return None
 
+class JobQueue:
+    """Jobs in balancer order, sorted lazily out of a heap as they are walked"""
+    def __init__(self, entries):
+        # entries are (sort key, index, job), index breaks ties without comparing jobs
+        heapq.heapify(entries)
+        self.heap = entries
+        self.ordered = []
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        index = 0
+        while True:
+            if index >= len(self.ordered):
+                with self.lock:
+                    if index >= len(self.ordered):
+                        if not self.heap:
+                            return
+                        self.ordered.append(heapq.heappop(self.heap)[2])
+
+            yield self.ordered[index]
+            index += 1
+
+class Scheduler:
+    """
+    Dispatch order for the master.
+
+    Rule evaluation and ordering is done at most once per interval (or when
+    invalidated) instead of on every slave request. Jobs excluded at that time
+    are left out and a queue filtered on tags is built once per slave tag set,
+    so picking a job for a slave only walks the first few heap entries.
+    """
+    def __init__(self, balancer, interval = 1):
+        self.balancer = balancer
+        self.interval = interval
+        self.last_update = 0
+        self.entries = []
+        self.queue = JobQueue([])
+        self.tag_queues = {}
+
+    def invalidate(self):
+        self.last_update = 0
+
+    def update(self, jobs):
+        """Rebuild if the interval is over, return True if it was"""
+        if time.time() - self.last_update >= self.interval:
+            self.rebuild(jobs)
+            return True
+
+        return False
+
+    def rebuild(self, jobs):
+        self.last_update = time.time()
+        self.balancer.prepare(jobs)
+
+        self.entries = []
+        for index, job in enumerate(jobs):
+            if not self.balancer.applyExceptions(job):
+                key = (0 if self.balancer.applyPriorities(job) else 1, self.balancer.applyRules(job))
+                self.entries.append((key, index, job))
+
+        self.queue = JobQueue(self.entries[:])
+        self.tag_queues = {}
+
+    def candidates(self, slave):
+        if not slave.tags:
+            return self.queue
+
+        tags = frozenset(slave.tags)
+        queue = self.tag_queues.get(tags)
+
+        if queue is None:
+            queue = JobQueue([entry for entry in self.entries if entry[2].tags.issubset(tags)])
+            self.tag_queues[tags] = queue
+
+        return queue
+
+MAX_CHUNKS = 100 # adaptive chunks never grow past that, a lost slave shouldn't lose hours of frames
+
+class FrameTimeStats:
+    """Render time of finished frames, the average follows recent frames once a few are known"""
+    def __init__(self, weight = 0.2):
+        self.weight = weight
+        self.count = 0
+        self.average = 0.0
+        self.maximum = 0.0
+
+    def report(self, frame_time):
+        """Frame time seen before any result, only used until the first one comes in"""
+        if not self.count:
+            self.average = frame_time
+            self.maximum = max(self.maximum, frame_time)
+
+    def add(self, frame_time):
+        self.count += 1
+        # plain mean for the first frames, then moving average
+        self.average += (frame_time - self.average) * max(self.weight, 1.0 / self.count)
+        self.maximum = max(self.maximum, frame_time)
+
+saved_pattern = re.compile("Saved: .* Time: ([0-9:.]+)")
+
+def logFrameTimes(text):
+    """Render time of the frames saved in a chunk of Blender output"""
+    frame_times = []
+
+    for match in saved_pattern.finditer(text):
+        frame_time = 0.0
+        try:
+            # [hh:]mm:ss.cc
+            for part in match.group(1).strip(".").split(":"):
+                frame_time = frame_time * 60 + float(part)
+        except ValueError:
+            continue
+
+        frame_times.append(frame_time)
+
+    return frame_times
+
+def chunkSize(frame_time, target_time, remaining, slaves, default_chunks):
+    """
+    Frames to dispatch so a chunk takes about target_time seconds.
+
+    Until a frame time is known, default_chunks is used. At the end of a job,
+    the remaining frames are spread over the slaves free to take them (idle
+    or already on this job) instead of leaving the last chunks to a few.
+    """
+    if frame_time > 0:
+        size = int(target_time / frame_time)
+    else:
+        size = default_chunks
+
+    size = max(1, min(size, MAX_CHUNKS))
+
+    if slaves > 0 and remaining < size * slaves:
+        size = max(1, -(-remaining // slaves))
+
+    return size
+
 # ==========================
 
 class RatingUsage(RatingRule):
@@ -135,9 +288,17 @@ class RatingUsageByCategory(RatingRule):
     def __str__(self):
         return "Usage per category"
 
+    def prepare(self, jobs):
+        self.category_usage = {}
+        self.category_priority = {}
+
+        for j in jobs:
+            self.category_usage[j.category] = self.category_usage.get(j.category, 0) + j.usage
+            self.category_priority[j.category] = max(self.category_priority.get(j.category, j.priority), j.priority)
+
     def rate(self, job):
-        total_category_usage = sum([j.usage for j in self.getJobs() if j.category == job.category])
-        maximum_priority = max([j.priority for j in self.getJobs() if j.category == job.category])
+        total_category_usage = self.category_usage[job.category]
+        maximum_priority = self.category_priority[job.category]
 
         # less usage is better
         return total_category_usage / maximum_priority
@@ -232,6 +393,8 @@ class ExcludeSlavesLimit(ExclusionRule):
         self.count_jobs = count_jobs
         self.count_slaves = count_slaves
         self.limit = limit
+        self.total_jobs = 0
+        self.total_slaves = 0
 
     def setLimit(self, value):
         self.limit = float(value)
@@ -242,8 +405,12 @@ class ExcludeSlavesLimit(ExclusionRule):
     def __str__(self):
         return "Exclude jobs that would use too many slaves"
 
+    def prepare(self, jobs):
+        self.total_jobs = self.count_jobs()
+        self.total_slaves = self.count_slaves()
+
     def test(self, job):
-        return not ( self.count_jobs() == 1 or self.count_slaves() <= 1 or float(job.countSlaves() + 1) / self.count_slaves() <= self.limit )
+        return not ( self.total_jobs == 1 or self.total_slaves <= 1 or float(job.countSlaves() + 1) / self.total_slaves <= self.limit )
 
     def serialize(self):
         return { "type": "exception",
@@ -0,0 +1,368 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Benchmarks for the network renderer, not loaded by the addon.
+#
+# Load generator against a running master (plain python is enough):
+#     python benchmark.py load <address> <port> [slaves] [seconds]
+#
+# The other benchmarks use the addon modules and run inside Blender:
+#     blender -b -P benchmark.py -- dispatch [dispatches]
+#     blender -b -P benchmark.py -- journal [frames]
+#     blender -b -P benchmark.py -- chunking [slaves] [frame times or master journal]
+
+import sys, time, threading, tempfile, shutil, random, heapq
+import http, http.client
+import json
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+def report(title, latencies, total_time):
+    print(title)
+    print("\trequests:  %i" % len(latencies))
+    print("\treq/s:     %.1f" % (len(latencies) / total_time if total_time else 0.0))
+    print("\tmean (ms): %.3f" % (1000 * sum(latencies) / len(latencies) if latencies else 0.0))
+    print("\tp50 (ms):  %.3f" % (1000 * percentile(latencies, 0.5)))
+    print("\tp99 (ms):  %.3f" % (1000 * percentile(latencies, 0.99)))
+
+class FakeSlave(threading.Thread):
+    def __init__(self, address, port, index, stop_time):
+        super().__init__()
+        self.daemon = True
+        self.address = address
+        self.port = port
+        self.index = index
+        self.stop_time = stop_time
+        self.latencies = []
+        self.errors = 0
+
+    def request(self, conn, method, url, body = None, headers = {}):
+        start = time.time()
+        conn.request(method, url, body, headers)
+        response = conn.getresponse()
+        response.read()
+        self.latencies.append(time.time() - start)
+        return response
+
+    def run(self):
+        conn = http.client.HTTPConnection(self.address, self.port, timeout = 30)
+
+        info = {
+                "id": "",
+                "name": "benchmark_%04i" % self.index,
+                "address": ("", 0),
+                "stats": "benchmark",
+                "total_done": 0,
+                "total_error": 0,
+                "last_seen": 0.0,
+                "tags": ()
+               }
+
+        try:
+            response = self.request(conn, "POST", "/slave", bytes(json.dumps(info), encoding='utf8'))
+            slave_id = response.getheader("slave-id")
+        except (OSError, http.client.HTTPException):
+            self.errors += 1
+            return
+
+        # registration isn't part of the dispatch numbers
+        self.latencies = []
+
+        while time.time() < self.stop_time:
+            try:
+                self.request(conn, "GET", "/job", headers={"slave-id":slave_id})
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                conn.close()
+
+        conn.close()
+
+def loadMaster(address, port, slaves = 200, duration = 10):
+    """Poll /job from many fake slaves at once and report dispatch throughput and latency"""
+    stop_time = time.time() + duration
+    threads = [FakeSlave(address, port, i, stop_time) for i in range(slaves)]
+
+    start = time.time()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    total_time = time.time() - start
+
+    latencies = []
+    errors = 0
+    for thread in threads:
+        latencies.extend(thread.latencies)
+        errors += thread.errors
+
+    report("Master load, %i slaves over %is" % (slaves, duration), latencies, total_time)
+    print("\terrors:    %i" % errors)
+
+def dispatchTime(job_count, frame_count, dispatches, slave_count = 50):
+    import netrender.model
+    import netrender.master
+
+    path = tempfile.mkdtemp()
+
+    try:
+        httpd = netrender.master.RenderMasterServer(("127.0.0.1", 0), netrender.master.RenderHandler, path)
+
+        slaves = []
+        for i in range(slave_count):
+            info = netrender.model.RenderSlave()
+            info.name = "benchmark_%04i" % i
+            slaves.append(httpd.getSlave(httpd.addSlave(info)))
+
+        for i in range(job_count):
+            job = netrender.master.MRenderJob(httpd.nextJobID(), netrender.model.RenderJob())
+            job.chunks = 5
+            job.priority = 1 + i % 10
+            for frame_number in range(1, frame_count + 1):
+                job.addFrame(frame_number, "")
+            httpd.addJob(job)
+            job.start()
+
+        latencies = []
+        start = time.time()
+
+        for i in range(dispatches):
+            slave = slaves[i % slave_count]
+
+            t = time.time()
+            httpd.balance()
+            job, frames = httpd.newDispatch(slave)
+            latencies.append(time.time() - t)
+
+            if not job:
+                break
+
+            # finish the frames right away so the queue keeps moving
+            for f in frames:
+                f.status = netrender.model.FRAME_DISPATCHED
+                f.slave = slave
+                f.status = netrender.model.FRAME_DONE
+
+        total_time = time.time() - start
+
+        httpd.server_close()
+    finally:
+        shutil.rmtree(path)
+
+    report("Dispatch, %i jobs x %i frames" % (job_count, frame_count), latencies, total_time)
+
+def dispatchScaling(dispatches = 2000):
+    """Dispatch latency as the number of jobs and the length of jobs grow"""
+    for job_count in (10, 100, 1000):
+        dispatchTime(job_count, 1000, dispatches)
+
+    for frame_count in (100, 1000, 10000):
+        dispatchTime(100, frame_count, dispatches)
+
+def journalRestart(frame_count = 100000, frames_per_job = 1000):
+    """Master restart time after a synthetic history, from the journal alone and from a snapshot"""
+    import netrender.model
+    import netrender.master
+
+    path = tempfile.mkdtemp()
+    address = ("127.0.0.1", 0)
+
+    try:
+        httpd = netrender.master.createMaster(address, False, False, path)
+
+        slaves = []
+        for i in range(50):
+            info = netrender.model.RenderSlave()
+            info.name = "benchmark_%04i" % i
+            slaves.append(httpd.getSlave(httpd.addSlave(info)))
+
+        start = time.time()
+
+        for i in range(max(1, frame_count // frames_per_job)):
+            job = netrender.master.MRenderJob(httpd.nextJobID(), netrender.model.RenderJob())
+            job.chunks = 5
+            job.priority = 1
+            for frame_number in range(1, frames_per_job + 1):
+                job.addFrame(frame_number, "")
+            httpd.addJob(job)
+            job.start()
+            httpd.journal.jobState(job)
+
+        # dispatch and finish everything, the way the request handlers journal it
+        for i in range(frame_count):
+            slave = slaves[i % len(slaves)]
+            httpd.balance()
+            job, frames = httpd.newDispatch(slave)
+            if not job:
+                break
+
+            for f in frames:
+                f.status = netrender.model.FRAME_DISPATCHED
+                f.slave = slave
+            httpd.journal.frames(job, frames)
+
+            for f in frames:
+                f.status = netrender.model.FRAME_DONE
+                f.time = 1.0
+                httpd.journal.frames(job, [f])
+
+            job.testFinished()
+            httpd.journal.jobState(job)
+
+        print("History: %i journal records written in %.2fs" % (httpd.journal.entries, time.time() - start))
+
+        # simulate a crash: no snapshot, journal left behind
+        httpd.journal.close()
+        httpd.server_close()
+
+        start = time.time()
+        httpd = netrender.master.createMaster(address, False, False, path)
+        print("Restart from journal:  %.2fs" % (time.time() - start))
+        print("\tjobs %i, frames done %i" % (len(httpd.jobs), sum((job.countFrames(netrender.model.FRAME_DONE) for job in httpd.jobs))))
+
+        # recovery compacts, a second restart only reads the snapshot
+        httpd.journal.close()
+        httpd.server_close()
+
+        start = time.time()
+        httpd = netrender.master.createMaster(address, False, False, path)
+        print("Restart from snapshot: %.2fs" % (time.time() - start))
+
+        httpd.journal.close()
+        httpd.server_close()
+    finally:
+        shutil.rmtree(path)
+
+def loadFrameTimes(filepath):
+    """Frame times from a master journal (finished frames) or a text file with one time per line"""
+    import netrender.model
+
+    frame_times = {}
+
+    with open(filepath, 'r', encoding='utf8') as f:
+        for index, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+
+            if line.startswith("{"):
+                record = json.loads(line)
+                if record["type"] == "frames":
+                    for number, status, frame_time, *rest in record["frames"]:
+                        if status == netrender.model.FRAME_DONE:
+                            frame_times[(record["job"], number)] = frame_time
+            else:
+                frame_times[index] = float(line)
+
+    return [frame_times[key] for key in sorted(frame_times)]
+
+def syntheticFrameTimes(count = 500, seed = 0):
+    """Frames getting heavier along the shot, with some noise"""
+    rand = random.Random(seed)
+    return [(5 + 55 * i / count) * rand.lognormvariate(0, 0.3) for i in range(count)]
+
+def simulateJob(frame_times, slave_count, chunks, chunk_time = 0, overhead = 5.0):
+    """
+    Makespan and number of dispatches of a single job on identical slaves.
+
+    Each chunk costs overhead seconds (polling, file checks, starting Blender)
+    plus the render time of its frames. Slaves report the average time of a
+    chunk's frames when it's done, as the real ones do.
+    """
+    import netrender.balancing
+
+    stats = netrender.balancing.FrameTimeStats()
+    next_frame = 0
+    dispatches = 0
+    makespan = 0.0
+
+    # (time the slave is free, slave index, frames it just finished)
+    events = [(0.0, i, []) for i in range(slave_count)]
+    heapq.heapify(events)
+
+    while events:
+        now, slave, finished = heapq.heappop(events)
+        makespan = max(makespan, now)
+
+        if finished:
+            average = sum(finished) / len(finished)
+            for i in range(len(finished)):
+                stats.add(average)
+
+        remaining = len(frame_times) - next_frame
+        if not remaining:
+            continue
+
+        if chunk_time:
+            size = netrender.balancing.chunkSize(stats.average, chunk_time, remaining, slave_count, chunks)
+        else:
+            size = chunks
+
+        chunk = frame_times[next_frame:next_frame + size]
+        next_frame += len(chunk)
+        dispatches += 1
+
+        heapq.heappush(events, (now + overhead + sum(chunk), slave, chunk))
+
+    return makespan, dispatches
+
+def chunkingComparison(slave_count = 20, filepath = None, overhead = 5.0):
+    """Compare fixed chunk sizes with adaptive chunking on recorded (or synthetic) frame times"""
+    if filepath:
+        frame_times = loadFrameTimes(filepath)
+    else:
+        frame_times = syntheticFrameTimes()
+
+    if not frame_times:
+        print("No frame times")
+        return
+
+    print("Chunking, %i frames (%.1fs average), %i slaves, %.1fs overhead per chunk" % (len(frame_times), sum(frame_times) / len(frame_times), slave_count, overhead))
+    print("\tideal:             %8.1fs" % (sum(frame_times) / slave_count))
+
+    for chunks in (1, 5, 10, 20):
+        makespan, dispatches = simulateJob(frame_times, slave_count, chunks, 0, overhead)
+        print("\tfixed %3i frames:  %8.1fs %6i dispatches" % (chunks, makespan, dispatches))
+
+    for chunk_time in (60, 120, 300, 600):
+        makespan, dispatches = simulateJob(frame_times, slave_count, 5, chunk_time, overhead)
+        print("\tadaptive %4is:    %8.1fs %6i dispatches" % (chunk_time, makespan, dispatches))
+
+if __name__ == "__main__":
+    try:
+        start = sys.argv.index("--") + 1
+    except ValueError:
+        start = 1
+    action, *args = sys.argv[start:]
+
+    if action == "load":
+        loadMaster(args[0], int(args[1]), *[int(a) for a in args[2:4]])
+    elif action == "dispatch":
+        dispatchScaling(*[int(a) for a in args[:1]])
+    elif action == "journal":
+        journalRestart(*[int(a) for a in args[:1]])
+    elif action == "chunking":
+        chunkingComparison(*[int(a) for a in args[:1]], *args[1:2])
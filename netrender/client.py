@@ -24,6 +24,7 @@ import json
 
 import netrender
 import netrender.model
+import netrender.tiles
 import netrender.slave as slave
 import netrender.master as master
 from netrender.utils import *
@@ -98,6 +99,7 @@ def fillCommonJobSettings(job, job_name, netsettings):
         job.blacklist.append(bad_slave.id)
 
     job.chunks = netsettings.chunks
+    job.chunk_time = netsettings.chunk_time
     job.priority = netsettings.priority
 
     if netsettings.job_render_engine == "OTHER":
@@ -115,6 +117,15 @@ def fillCommonJobSettings(job, job_name, netsettings):
     elif netsettings.job_type == "JOB_VCS":
         job.type = netrender.model.JOB_VCS
 
+def missingFiles(job, content):
+    # the master lists the files it doesn't have yet (shared storage or its cache
+    # can provide the others), older masters don't and expect all of them
+    if content:
+        indexes = set(json.loads(str(content, encoding='utf8')))
+        return [rfile for rfile in job.files if rfile.index in indexes]
+    else:
+        return job.files
+
 def sendJob(conn, scene, anim = False, can_save = True):
     netsettings = scene.network_render
     if netsettings.job_type == "JOB_BLENDER":
@@ -236,19 +247,14 @@ def sendJobBaking(conn, scene, can_save = True):
     with ConnectionContext():
         conn.request("POST", "/job", json.dumps(job.serialize()))
     response = conn.getresponse()
-    response.read()
+    content = response.read()
 
     job_id = response.getheader("job-id")
 
     # if not ACCEPTED (but not processed), send files
     if response.status == http.client.ACCEPTED:
-        for rfile in job.files:
-            f = open(rfile.filepath, "rb")
-            with ConnectionContext():
-                conn.request("PUT", fileURL(job_id, rfile.index), f)
-            f.close()
-            response = conn.getresponse()
-            response.read()
+        for rfile in missingFiles(job, content):
+            sendFile(conn, fileURL(job_id, rfile.index), rfile.filepath, compress = netsettings.use_compression)
 
     # server will reply with ACCEPTED until all files are found
 
@@ -261,6 +267,16 @@ def sendJobBlender(conn, scene, anim = False, can_save = True):
     if anim:
         for f in range(scene.frame_start, scene.frame_end + 1):
             job.addFrame(f)
+    elif netsettings.tiles_x * netsettings.tiles_y > 1:
+        # single frame split in tiles, rendered as frames and stitched on the master
+        job.subtype = netrender.model.JOB_SUB_TILES
+
+        r = scene.render
+        width = r.resolution_x * r.resolution_percentage // 100
+        height = r.resolution_y * r.resolution_percentage // 100
+
+        for i, rect in enumerate(netrender.tiles.splitTiles(width, height, netsettings.tiles_x, netsettings.tiles_y)):
+            job.addFrame(i + 1, netrender.tiles.tileToCommand(scene.frame_current, rect, width, height))
     else:
         job.addFrame(scene.frame_current)
 
@@ -326,19 +342,14 @@ def sendJobBlender(conn, scene, anim = False, can_save = True):
     with ConnectionContext():
         conn.request("POST", "/job", json.dumps(job.serialize()))
     response = conn.getresponse()
-    response.read()
+    content = response.read()
 
     job_id = response.getheader("job-id")
 
     # if not ACCEPTED (but not processed), send files
     if response.status == http.client.ACCEPTED:
-        for rfile in job.files:
-            f = open(rfile.filepath, "rb")
-            with ConnectionContext():
-                conn.request("PUT", fileURL(job_id, rfile.index), f)
-            f.close()
-            response = conn.getresponse()
-            response.read()
+        for rfile in missingFiles(job, content):
+            sendFile(conn, fileURL(job_id, rfile.index), rfile.filepath, compress = netsettings.use_compression)
 
     # server will reply with ACCEPTED until all files are found
 
@@ -380,7 +391,9 @@ class NetworkRenderEngine(bpy.types.RenderEngine):
                          test_break = self.test_break,
                          use_ssl=netsettings.use_ssl,
                          cert_path=netsettings.cert_path,
-                         key_path=netsettings.key_path)
+                         key_path=netsettings.key_path,
+                         serve_mode=netsettings.master_serve_mode,
+                         cache_size=netsettings.master_cache_size * 1024 * 1024)
 
 
     def render_slave(self, scene):
@@ -0,0 +1,142 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import os, shutil, time
+import threading
+
+from netrender.utils import *
+
+class BlobCache:
+    """
+    Job files stored once, by content signature.
+
+    Blobs are hard linked into job directories (copied when the file system
+    can't link), so the same asset used by many jobs is transferred and stored
+    once. With a budget (in bytes), least recently used blobs are evicted
+    once the cache grows past it. Files already linked in a job directory
+    stay there, only the cache entry goes away.
+    """
+    def __init__(self, path, budget = 0):
+        self.path = path
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.blobs = {} # signature -> [size, last use]
+
+        verifyCreateDir(self.path)
+
+        for directory in os.listdir(self.path):
+            directory_path = os.path.join(self.path, directory)
+            if os.path.isdir(directory_path):
+                for signature in os.listdir(directory_path):
+                    stat = os.stat(os.path.join(directory_path, signature))
+                    self.blobs[signature] = [stat.st_size, stat.st_mtime]
+
+    def blobPath(self, signature):
+        return os.path.join(self.path, signature[:2], signature)
+
+    def has(self, signature):
+        return signature in self.blobs
+
+    def size(self):
+        return sum((size for size, last_use in self.blobs.values()))
+
+    def touch(self, signature):
+        now = time.time()
+        self.blobs[signature][1] = now
+        try:
+            os.utime(self.blobPath(signature), (now, now))
+        except OSError:
+            pass
+
+    def add(self, filepath, signature = None):
+        """Store a file under its signature, computed when not given"""
+        if signature is None:
+            signature = hashFile(filepath)
+
+        with self.lock:
+            if signature not in self.blobs:
+                blob_path = self.blobPath(signature)
+                verifyCreateDir(os.path.dirname(blob_path))
+                linkFile(filepath, blob_path)
+                self.blobs[signature] = [os.path.getsize(blob_path), 0]
+
+            self.touch(signature)
+
+        self.evict()
+
+        return signature
+
+    def link(self, signature, filepath):
+        """Make the blob available at filepath, return False if it isn't cached or doesn't match its signature"""
+        with self.lock:
+            if signature not in self.blobs:
+                return False
+
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            else:
+                verifyCreateDir(os.path.dirname(filepath))
+
+            linkFile(self.blobPath(signature), filepath)
+            self.touch(signature)
+
+        # blobs are hard linked, writing to a job file changes the blob too
+        if hashFile(filepath) != signature:
+            print("Cached file %s but signature mismatch!" % filepath)
+            os.remove(filepath)
+            self.discard(signature)
+            return False
+
+        return True
+
+    def discard(self, signature):
+        with self.lock:
+            if signature in self.blobs:
+                try:
+                    os.remove(self.blobPath(signature))
+                except OSError:
+                    pass
+
+                del self.blobs[signature]
+
+    def evict(self):
+        if not self.budget:
+            return
+
+        with self.lock:
+            total = self.size()
+            if total <= self.budget:
+                return
+
+            for signature, (size, last_use) in sorted(self.blobs.items(), key = lambda item: item[1][1]):
+                try:
+                    os.remove(self.blobPath(signature))
+                except OSError:
+                    continue
+
+                del self.blobs[signature]
+                total -= size
+
+                if total <= self.budget:
+                    break
+
+def linkFile(source, destination):
+    try:
+        os.link(source, destination)
+    except (OSError, AttributeError): # different volumes or no hard link support
+        shutil.copyfile(source, destination)
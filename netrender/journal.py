@@ -0,0 +1,188 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import os, time, shutil
+import threading
+import pickle
+import json
+
+SNAPSHOT_NAME = "blender_master.data"
+JOURNAL_NAME = "blender_master.journal"
+
+COMPACT_ENTRIES = 50000 # compact after that many state changes
+COMPACT_INTERVAL = 600 # or after that many seconds, whichever comes first
+
+def writeSnapshot(filepath, httpd):
+    temp_path = filepath + ".temp"
+
+    with open(temp_path, 'wb') as f:
+        pickle.dump((httpd.path, httpd.jobs, httpd.slaves), f, pickle.HIGHEST_PROTOCOL)
+
+    os.replace(temp_path, filepath)
+
+def readSnapshot(filepath):
+    with open(filepath, 'rb') as f:
+        return pickle.load(f)
+
+class MasterJournal:
+    """
+    Append only log of master state changes.
+
+    Each line is a JSON record holding the new state of a job, frame, file
+    or slave, so replaying a record twice is harmless. Compaction pickles the
+    whole master (the same snapshot that used to be written on exit) and
+    starts a new journal. The previous journal is only removed once the
+    snapshot is safely written, recovery replays both.
+
+    A journal without a path records nothing.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stream = None
+        self.entries = 0
+        self.last_compact = time.time()
+
+        if path:
+            self.snapshot_path = os.path.join(path, SNAPSHOT_NAME)
+            self.journal_path = os.path.join(path, JOURNAL_NAME)
+            self.old_journal_path = self.journal_path + ".old"
+
+    def exists(self):
+        return bool(self.path) and (os.path.exists(self.snapshot_path) or os.path.exists(self.journal_path) or os.path.exists(self.old_journal_path))
+
+    def start(self, httpd):
+        if not self.path:
+            return
+
+        self.stream = open(self.journal_path, 'a', encoding='utf8')
+        self.log("master", path = httpd.path)
+
+    def close(self):
+        with self.lock:
+            if self.stream:
+                self.stream.close()
+                self.stream = None
+
+    def remove(self):
+        self.close()
+
+        if self.path:
+            for filepath in (self.snapshot_path, self.journal_path, self.old_journal_path):
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+
+    def log(self, entry_type, **data):
+        if not self.stream:
+            return
+
+        data["type"] = entry_type
+        line = json.dumps(data) + "\n"
+
+        with self.lock:
+            if self.stream:
+                self.stream.write(line)
+                self.stream.flush()
+                self.entries += 1
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+
+    def addJob(self, job):
+        self.log("job", id = job.id, save_path = job.save_path, data = job.serialize())
+
+    def jobState(self, job):
+        self.log("job_state", id = job.id, status = job.status, priority = job.priority, chunks = job.chunks, chunk_time = job.chunk_time, blacklist = job.blacklist)
+
+    def removeJob(self, job):
+        self.log("remove_job", id = job.id)
+
+    def frames(self, job, frames):
+        self.log("frames", job = job.id, frames = [
+                                                    (f.number, f.status, f.time, f.slave.id if f.slave else None, f.results, f.log_path)
+                                                    for f in frames
+                                                  ])
+
+    def file(self, job, rfile):
+        self.log("file", job = job.id, index = rfile.index, filepath = rfile.filepath, found = rfile.found)
+
+    def addSlave(self, slave):
+        self.log("slave", id = slave.id, data = slave.serialize())
+
+    def removeSlave(self, slave):
+        self.log("remove_slave", id = slave.id)
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+
+    def read(self):
+        """Saved snapshot (or None) and the journal records written after it"""
+        snapshot = None
+        if os.path.exists(self.snapshot_path):
+            snapshot = readSnapshot(self.snapshot_path)
+
+        records = []
+        for filepath in (self.old_journal_path, self.journal_path):
+            if os.path.exists(filepath):
+                with open(filepath, 'r', encoding='utf8') as f:
+                    for line in f:
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError:
+                            # torn write at crash time, nothing valid after that
+                            print("Journal truncated in", filepath)
+                            break
+
+        return snapshot, records
+
+    def needsCompact(self):
+        return self.entries >= COMPACT_ENTRIES or (self.entries and time.time() - self.last_compact >= COMPACT_INTERVAL)
+
+    def compact(self, httpd):
+        if not self.path:
+            return
+
+        with self.lock:
+            if self.stream:
+                self.stream.close()
+
+            if os.path.exists(self.journal_path):
+                if os.path.exists(self.old_journal_path):
+                    # a previous compaction didn't finish, keep everything
+                    with open(self.old_journal_path, 'ab') as old, open(self.journal_path, 'rb') as current:
+                        shutil.copyfileobj(current, old)
+                    os.remove(self.journal_path)
+                else:
+                    os.replace(self.journal_path, self.old_journal_path)
+
+            self.stream = open(self.journal_path, 'a', encoding='utf8')
+            self.entries = 0
+            self.last_compact = time.time()
+
+        self.log("master", path = httpd.path)
+
+        # handlers keep running while pickling, retry if state changed under us
+        for i in range(3):
+            try:
+                writeSnapshot(self.snapshot_path, httpd)
+                break
+            except RuntimeError as err:
+                print("Snapshot failed, retrying:", err)
+        else:
+            return
+
+        if os.path.exists(self.old_journal_path):
+            os.remove(self.old_journal_path)
@@ -18,11 +18,11 @@
 
 import sys, os
 import http, http.client, http.server, socket, socketserver
-import shutil, time, hashlib
-import pickle
+import shutil, time, hashlib, heapq, zlib
 import zipfile
 import select # for select.error
 import json
+import threading
 
 
 from netrender.utils import *
@@ -30,6 +30,16 @@ import netrender.model
 import netrender.balancing
 import netrender.master_html
 import netrender.thumbnail as thumbnail
+import netrender.journal
+import netrender.filecache
+import netrender.metrics
+import netrender.tiles
+
+HOUSEKEEPING_INTERVAL = 2 # seconds between slave timeouts and usage updates
+KEEPALIVE_TIMEOUT = 60 # seconds before an idle slave connection is closed
+
+# one tiles job stitched at a time, they can be large
+stitch_lock = threading.Lock()
 
 class MRenderFile(netrender.model.RenderFile):
     def __init__(self, filepath, index, start, end, signature):
@@ -56,10 +66,16 @@ class MRenderFile(netrender.model.RenderFile):
 
 
 class MRenderSlave(netrender.model.RenderSlave):
+    # time spent with frames, class defaults for slaves saved by older versions
+    busy_time = 0.0
+    busy_since = None
+    first_seen = None
+
     def __init__(self, slave_info):
         super().__init__(slave_info)
         self.id = hashlib.md5(bytes(repr(slave_info.name) + repr(slave_info.address), encoding='utf8')).hexdigest()
         self.last_seen = time.time()
+        self.first_seen = self.last_seen
         
 
         self.job = None
@@ -70,6 +86,27 @@ class MRenderSlave(netrender.model.RenderSlave):
     def seen(self):
         self.last_seen = time.time()
 
+    def updateBusy(self):
+        # call when job_frames changes
+        if self.job_frames and self.busy_since is None:
+            self.busy_since = time.time()
+        elif not self.job_frames and self.busy_since is not None:
+            self.busy_time += time.time() - self.busy_since
+            self.busy_since = None
+
+    def idleRatio(self):
+        t = time.time()
+        total = t - (self.first_seen or self.last_seen)
+
+        if total <= 0:
+            return 0.0
+
+        busy = self.busy_time
+        if self.busy_since is not None:
+            busy += t - self.busy_since
+
+        return max(0.0, 1.0 - busy / total)
+
     def finishedFrame(self, frame_number):
         try:
             self.job_frames.remove(frame_number)
@@ -79,6 +116,8 @@ class MRenderSlave(netrender.model.RenderSlave):
         if not self.job_frames:
             self.job = None
 
+        self.updateBusy()
+
 class MRenderJob(netrender.model.RenderJob):
     def __init__(self, job_id, job_info):
         super().__init__(job_info)
@@ -89,6 +128,7 @@ class MRenderJob(netrender.model.RenderJob):
         # force one chunk for process jobs
         if self.type == netrender.model.JOB_PROCESS:
             self.chunks = 1
+            self.chunk_time = 0
 
         # Force WAITING status on creation
         self.status = netrender.model.JOB_WAITING
@@ -97,6 +137,45 @@ class MRenderJob(netrender.model.RenderJob):
         self.last_update = 0
         self.save_path = ""
         self.files = [MRenderFile(rfile.filepath, rfile.index, rfile.start, rfile.end, rfile.signature) for rfile in job_info.files]
+
+        self.buildIndex()
+
+    def buildIndex(self):
+        # frames by number, frame count per status, heap of queued frame numbers
+        # and dispatched frame numbers, kept up to date by MRenderFrame.status
+        self.frames_map = {}
+        self.status_count = {status: 0 for status in netrender.model.FRAME_STATUS_TEXT}
+        self.queued = []
+        self.dispatched = set()
+        self.frame_stats = netrender.balancing.FrameTimeStats()
+
+        # saved masters from older versions didn't have adaptive chunks
+        self.__dict__.setdefault("chunk_time", 0)
+
+        for frame in self.frames:
+            # saved masters from older versions stored status directly
+            if "status" in frame.__dict__:
+                frame._status = frame.__dict__.pop("status")
+
+            frame.job = self
+            self.frames_map[frame.number] = frame
+            self.frameStatusChanged(frame, None, frame.status)
+
+            if frame.status == netrender.model.FRAME_DONE and frame.time:
+                self.frame_stats.add(frame.time)
+
+    def frameStatusChanged(self, frame, old_status, new_status):
+        if old_status is not None:
+            self.status_count[old_status] -= 1
+        self.status_count[new_status] += 1
+
+        if new_status == netrender.model.FRAME_QUEUED:
+            heapq.heappush(self.queued, frame.number)
+
+        if new_status == netrender.model.FRAME_DISPATCHED:
+            self.dispatched.add(frame.number)
+        elif old_status == netrender.model.FRAME_DISPATCHED:
+            self.dispatched.discard(frame.number)
         
     def setForceUpload(self, force):
         for rfile in self.files:
@@ -122,6 +201,41 @@ class MRenderJob(netrender.model.RenderJob):
         if "chunks" in info_map:
             self.chunks = info_map["chunks"]
 
+        if "chunk_time" in info_map:
+            self.chunk_time = info_map["chunk_time"]
+
+    def localFilePath(self, file_index):
+        main_file = self.files[0].original_path # original path of the first file
+
+        main_path, main_name = os.path.split(main_file)
+
+        if file_index > 0:
+            return createLocalPath(self.files[file_index], self.save_path, main_path, True)
+        else:
+            return os.path.join(self.save_path, main_name)
+
+    def linkCachedFiles(self, cache):
+        """Link files the master already has (from any job) in the job directory, return them"""
+        linked = []
+
+        if not self.version_info:
+            for rfile in self.files:
+                if not rfile.found and rfile.signature and cache.has(rfile.signature):
+                    file_path = self.localFilePath(rfile.index)
+
+                    if cache.link(rfile.signature, file_path):
+                        rfile.filepath = file_path
+                        rfile.found = True
+                        linked.append(rfile)
+
+        return linked
+
+    def missingFiles(self):
+        if self.version_info:
+            return []
+
+        return [rfile.index for rfile in self.files if not rfile.test()]
+
     def testStart(self):
         # Don't test files for versionned jobs
         if not self.version_info:
@@ -134,10 +248,7 @@ class MRenderJob(netrender.model.RenderJob):
         return True
 
     def testFinished(self):
-        for f in self.frames:
-            if f.status == netrender.model.FRAME_QUEUED or f.status == netrender.model.FRAME_DISPATCHED:
-                break
-        else:
+        if self.countFrames(netrender.model.FRAME_QUEUED) == 0 and self.countFrames(netrender.model.FRAME_DISPATCHED) == 0:
             self.status = netrender.model.JOB_FINISHED
             self.finish_time=time.time()
 
@@ -169,8 +280,28 @@ class MRenderJob(netrender.model.RenderJob):
     def addFrame(self, frame_number, command):
         frame = MRenderFrame(frame_number, command)
         self.frames.append(frame)
+
+        frame.job = self
+        self.frames_map[frame_number] = frame
+        self.frameStatusChanged(frame, None, frame.status)
+
         return frame
 
+    def countFrames(self, status=netrender.model.FRAME_QUEUED):
+        return self.status_count[status]
+
+    def countSlaves(self):
+        return len(set((self.frames_map[number].slave for number in self.dispatched)))
+
+    def framesStatus(self):
+        return dict(self.status_count)
+
+    def __contains__(self, frame_number):
+        return frame_number in self.frames_map
+
+    def __getitem__(self, frame_number):
+        return self.frames_map.get(frame_number)
+
     def reset(self, all):
         for f in self.frames:
             f.reset(all)
@@ -178,22 +309,64 @@ class MRenderJob(netrender.model.RenderJob):
         if all:
             self.status = netrender.model.JOB_QUEUED
 
-    def getFrames(self):
+    def chunkSize(self, slaves = 1):
+        """Frames in the next chunk, slaves is how many slaves are free to work on this job"""
+        if not self.chunk_time:
+            return self.chunks
+
+        return netrender.balancing.chunkSize(self.frame_stats.average, self.chunk_time, self.countFrames(netrender.model.FRAME_QUEUED), slaves, self.chunks)
+
+    def getFrames(self, count = None):
+        # Frames are taken off the queue, the caller is expected to dispatch them.
+        # Stale entries (frames that left the queued state or were queued twice)
+        # are dropped lazily here.
+        if count is None:
+            count = self.chunks
+
         frames = []
-        for f in self.frames:
-            if f.status == netrender.model.FRAME_QUEUED:
-                self.last_dispatched = time.time()
+        while self.queued and len(frames) < count:
+            f = self.frames_map[heapq.heappop(self.queued)]
+            if f.status == netrender.model.FRAME_QUEUED and f not in frames:
                 frames.append(f)
-                if len(frames) >= self.chunks:
-                    break
+
+        if frames:
+            self.last_dispatched = time.time()
 
         return frames
     
     def getResultPath(self, filename):
         return os.path.join(self.save_path, filename)
 
+    def tileFrame(self):
+        """Frame a tiles job renders"""
+        return netrender.tiles.commandToTile(self.frames[0].command)[0]
+
+    def stitch(self):
+        """Path of the frame stitched from a tiles job, None until all tiles are done"""
+        if self.countFrames(netrender.model.FRAME_DONE) != len(self.frames):
+            return None
+
+        frame_number, rect, width, height = netrender.tiles.commandToTile(self.frames[0].command)
+        filepath = self.getResultPath("%06d.exr" % frame_number)
+
+        tiles = []
+        for frame in self.frames:
+            tiles.append((self.getResultPath(frame.getRenderFilename()), netrender.tiles.commandToTile(frame.command)[1]))
+
+        with stitch_lock:
+            try:
+                # tiles rendered again after the last stitch
+                if not os.path.exists(filepath) or os.path.getmtime(filepath) < max((os.path.getmtime(tile_path) for tile_path, rect in tiles)):
+                    netrender.tiles.stitch(filepath, tiles, width, height)
+            except (OSError, ValueError) as err:
+                print("Stitching tiles of job", self.id, "failed:", err)
+                return None
+
+        return filepath
+
 class MRenderFrame(netrender.model.RenderFrame):
     def __init__(self, frame, command):
+        self.job = None
         super().__init__()
         self.number = frame
         self.slave = None
@@ -203,10 +376,25 @@ class MRenderFrame(netrender.model.RenderFrame):
 
         self.log_path = None
 
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        old_status = getattr(self, "_status", None)
+        self._status = value
+
+        if self.job and old_status != value:
+            self.job.frameStatusChanged(self, old_status, value)
+
     def addDefaultRenderResult(self):
         self.results.append(self.getRenderFilename())
 
     def getRenderFilename(self):
+        if self.job and self.job.subtype == netrender.model.JOB_SUB_TILES:
+            return "tile_%06d.exr" % self.number
+
         return "%06d.exr" % self.number
 
     def reset(self, all):
@@ -231,14 +419,181 @@ cancel_pattern = re.compile("/cancel_([a-zA-Z0-9]+)")
 pause_pattern = re.compile("/pause_([a-zA-Z0-9]+)")
 edit_pattern = re.compile("/edit_([a-zA-Z0-9]+)")
 
+class CountingWriter:
+    """Response stream counting the bytes written, for the metrics"""
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        return self.wfile.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.wfile, name)
+
 class RenderHandler(http.server.BaseHTTPRequestHandler):
+    # keep-alive, slaves reuse their connections instead of opening one per request
+    protocol_version = "HTTP/1.1"
+    # close idle kept alive connections
+    timeout = KEEPALIVE_TIMEOUT
+
+    body_left = 0
+
+    def setup(self):
+        super().setup()
+        self.wfile = CountingWriter(self.wfile)
+
+    def parse_request(self):
+        self.body_left = 0
+        self.bytes_read = 0
+        self.request_time = time.time()
+
+        if not super().parse_request():
+            return False
+
+        self.body_left = int(self.headers.get('content-length', 0) or 0)
+        return True
+
+    def send_response(self, code, message = None):
+        self.response_code = code
+        super().send_response(code, message)
+
+    def handle_one_request(self):
+        self.command = None
+        self.response_code = 0
+        self.wfile.written = 0
+
+        super().handle_one_request()
+
+        # skip what a handler didn't read (errors, ignored uploads), so the
+        # next request on this connection starts where it should
+        while self.body_left > 0 and not self.close_connection:
+            if not self.read_data(TRANSFER_BLOCK_SIZE):
+                self.close_connection = True
+
+        if self.command:
+            metrics = self.server.metrics
+            path = netrender.metrics.pathLabel(self.path)
+
+            metrics.count("netrender_requests_total", labels = (("method", self.command), ("path", path), ("code", self.response_code)))
+            metrics.observe("netrender_request_seconds", time.time() - self.request_time, (("path", path),))
+            metrics.count("netrender_transfer_bytes_total", self.bytes_read, (("direction", "in"),))
+            metrics.count("netrender_transfer_bytes_total", self.wfile.written, (("direction", "out"),))
+
+    def read_data(self, length = None):
+        """Read the request body, or length bytes of it"""
+        if length is None or length > self.body_left:
+            length = self.body_left
+
+        data = self.rfile.read(length)
+        self.body_left -= len(data)
+        self.bytes_read += len(data)
+        return data
+
+    def read_body(self, f, md5 = None):
+        # stream in blocks, whole renders don't have to fit in memory
+        if self.headers.get('content-encoding', "") == "deflate":
+            decompressor = zlib.decompressobj()
+        else:
+            decompressor = None
+
+        while self.body_left > 0:
+            buf = self.read_data(TRANSFER_BLOCK_SIZE)
+            if not buf:
+                break
+
+            if decompressor:
+                buf = decompressor.decompress(buf)
+
+            f.write(buf)
+            if md5:
+                md5.update(buf)
+
+        if decompressor:
+            buf = decompressor.flush()
+            f.write(buf)
+            if md5:
+                md5.update(buf)
+
     def write_file(self, file_path, mode = 'wb'):
-        length = int(self.headers['content-length'])
-        f = open(file_path, mode)
-        buf = self.rfile.read(length)
-        f.write(buf)
-        f.close()
-        del buf
+        """Receive the request body in file_path, returns False while a chunked upload isn't complete"""
+        content_range = self.headers.get('content-range', None)
+
+        if not content_range:
+            with open(file_path, mode) as f:
+                self.read_body(f)
+            return True
+
+        start, end, total = parseContentRange(content_range)
+
+        # a frame rendered again by another slave must not resume the first upload
+        upload_id = hashData(bytes(self.headers.get('upload-id', ""), encoding='utf8'))
+        part_path = "%s.%s.part" % (file_path, upload_id[:16])
+        self.upload_offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+        if start != self.upload_offset:
+            # offset query or out of step, the client restarts from upload_offset
+            self.read_data()
+            return False
+
+        md5 = hashlib.md5()
+        with open(part_path, 'ab') as f:
+            self.read_body(f, md5)
+
+            if md5.hexdigest() != self.headers.get('chunk-md5', md5.hexdigest()):
+                print("Chunk checksum mismatch for", file_path)
+                f.truncate(start)
+                return False
+
+        self.upload_offset = end + 1
+
+        if self.upload_offset < total:
+            return False
+
+        os.replace(part_path, file_path)
+        return True
+
+    def send_upload_offset(self):
+        self.send_head(http.client.PARTIAL_CONTENT, headers={"upload-offset": str(self.upload_offset)}, content = None, length = 0)
+
+    def send_file(self, file_path, content = "application/octet-stream"):
+        """Send a file, honoring Range requests (to resume downloads) and deflate encoding"""
+        size = os.path.getsize(file_path)
+        start = 0
+
+        range_header = self.headers.get('range', "")
+        if range_header.startswith("bytes=") and range_header.endswith("-"):
+            start = int(range_header[6:-1])
+
+            if start >= size:
+                self.send_head(http.client.REQUESTED_RANGE_NOT_SATISFIABLE, headers={"Content-Range": "bytes */%i" % size}, content = None)
+                return
+
+        headers = {}
+
+        if "deflate" in self.headers.get('accept-encoding', ""):
+            compressor = zlib.compressobj()
+            headers["Content-Encoding"] = "deflate"
+        else:
+            compressor = None
+            headers["Content-Length"] = str(size - start)
+
+        if start:
+            headers["Content-Range"] = contentRange(start, size - 1, size)
+            self.send_head(http.client.PARTIAL_CONTENT, headers = headers, content = None)
+        else:
+            self.send_head(headers = headers, content = content)
+
+        with open(file_path, 'rb') as f:
+            f.seek(start)
+            buf = f.read(TRANSFER_BLOCK_SIZE)
+            while buf:
+                self.wfile.write(compressor.compress(buf) if compressor else buf)
+                buf = f.read(TRANSFER_BLOCK_SIZE)
+
+        if compressor:
+            self.wfile.write(compressor.flush())
         
     def log_message(self, format, *args):
         # override because the original calls self.address_string(), which
@@ -246,15 +601,13 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
         sys.stderr.write("[%s] %s\n" % (self.log_date_time_string(), format%args))
 
     def getInfoMap(self):
-        length = int(self.headers['content-length'])
-
-        if length > 0:
-            msg = str(self.rfile.read(length), encoding='utf8')
+        if self.body_left > 0:
+            msg = str(self.read_data(), encoding='utf8')
             return json.loads(msg)
         else:
             return {}
 
-    def send_head(self, code = http.client.OK, headers = {}, content = "application/octet-stream"):
+    def send_head(self, code = http.client.OK, headers = {}, content = "application/octet-stream", length = None):
         self.send_response(code)
         
         if code == http.client.OK and content:
@@ -263,8 +616,31 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
         for key, value in headers.items():
             self.send_header(key, value)
 
+        if length is not None:
+            self.send_header("Content-Length", str(length))
+        elif "Content-Length" not in headers and code not in {http.client.NO_CONTENT, http.client.NOT_MODIFIED} and self.command != "HEAD":
+            # body delimited by closing the connection
+            self.send_header("Connection", "close")
+
         self.end_headers()
 
+    def send_content(self, data, code = http.client.OK, headers = {}, content = "application/octet-stream"):
+        self.send_head(code, headers, content, length = len(data))
+        self.wfile.write(data)
+
+    def appendLog(self, job, frame):
+        """Append the request body to the frame's log"""
+        offset = os.path.getsize(frame.log_path) if os.path.exists(frame.log_path) else 0
+
+        self.write_file(frame.log_path, 'ab')
+
+        if job.chunk_time and not job.frame_stats.count:
+            # no result yet, frames saved in the log give a first estimate
+            with open(frame.log_path, 'r', encoding='utf8', errors='replace') as f:
+                f.seek(offset)
+                for frame_time in netrender.balancing.logFrameTimes(f.read()):
+                    job.frame_stats.report(frame_time)
+
     def do_HEAD(self):
 
         if self.path == "/status":
@@ -298,6 +674,10 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
             self.server.stats("", "Version check")
             self.wfile.write(VERSION)
         # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+        elif self.path == "/metrics":
+            message = self.server.metrics.render(self.server.metricsGauges())
+            self.send_content(bytes(message, encoding='utf8'), content = "text/plain; version=0.0.4")
+        # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
         elif self.path.startswith("/render"):
             match = render_pattern.match(self.path)
 
@@ -307,7 +687,22 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
 
                 job = self.server.getJobID(job_id)
 
-                if job:
+                if job and job.subtype == netrender.model.JOB_SUB_TILES and frame_number == job.tileFrame():
+                    # the whole frame, once its tiles are stitched
+                    if job.countFrames(netrender.model.FRAME_ERROR):
+                        self.send_head(http.client.PARTIAL_CONTENT)
+                    elif job.status != netrender.model.JOB_FINISHED:
+                        self.send_head(http.client.ACCEPTED)
+                    else:
+                        self.server.stats("", "Sending result to client")
+
+                        filename = job.stitch()
+
+                        if filename:
+                            self.send_file(filename, content = "image/x-exr")
+                        else:
+                            self.send_head(http.client.PARTIAL_CONTENT)
+                elif job:
                     frame = job[frame_number]
 
                     if frame:
@@ -318,10 +713,7 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
 
                             filename = job.getResultPath(frame.getRenderFilename())
 
-                            f = open(filename, 'rb')
-                            self.send_head(content = "image/x-exr")
-                            shutil.copyfileobj(f, self.wfile)
-                            f.close()
+                            self.send_file(filename, content = "image/x-exr")
                         elif frame.status == netrender.model.FRAME_ERROR:
                             self.send_head(http.client.PARTIAL_CONTENT)
                     else:
@@ -353,12 +745,15 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                                     filepath = job.getResultPath(filename)
                                     
                                     zfile.write(filepath, filename)
+
+                        if job.subtype == netrender.model.JOB_SUB_TILES:
+                            filepath = job.stitch()
+
+                            if filepath:
+                                zfile.write(filepath, os.path.basename(filepath))
                                     
                     
-                    f = open(zip_filepath, 'rb')
-                    self.send_head(content = "application/x-zip-compressed")
-                    shutil.copyfileobj(f, self.wfile)
-                    f.close()
+                    self.send_file(zip_filepath, content = "application/x-zip-compressed")
                 else:
                     # no such job id
                     self.send_head(http.client.NO_CONTENT)
@@ -387,10 +782,7 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                             thumbname = thumbnail.generate(filename)
 
                             if thumbname:
-                                f = open(thumbname, 'rb')
-                                self.send_head(content = "image/jpeg")
-                                shutil.copyfileobj(f, self.wfile)
-                                f.close()
+                                self.send_file(thumbname, content = "image/jpeg")
                             else: # thumbnail couldn't be generated
                                 self.send_head(http.client.PARTIAL_CONTENT)
                                 return
@@ -423,13 +815,7 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                             self.send_head(http.client.PROCESSING)
                         else:
                             self.server.stats("", "Sending log to client")
-                            f = open(frame.log_path, 'rb')
-
-                            self.send_head(content = "text/plain")
-
-                            shutil.copyfileobj(f, self.wfile)
-
-                            f.close()
+                            self.send_file(frame.log_path, content = "text/plain")
                     else:
                         # no such frame
                         self.send_head(http.client.NO_CONTENT)
@@ -483,7 +869,8 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
             slave = self.server.getSeenSlave(slave_id)
 
             if slave: # only if slave id is valid
-                job, frames = self.server.newDispatch(slave)
+                with self.server.metrics.timer("netrender_dispatch_seconds"):
+                    job, frames = self.server.newDispatch(slave)
 
                 if job and frames:
                     for f in frames:
@@ -493,19 +880,21 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
 
                     slave.job = job
                     slave.job_frames = [f.number for f in frames]
+                    slave.updateBusy()
 
-                    self.send_head(headers={"job-id": job.id})
+                    self.server.journal.frames(job, frames)
 
                     message = job.serialize(frames)
-                    self.wfile.write(bytes(json.dumps(message), encoding='utf8'))
+                    self.send_content(bytes(json.dumps(message), encoding='utf8'), headers={"job-id": job.id})
 
                     self.server.stats("", "Sending job to slave")
                 else:
                     # no job available, return error code
                     slave.job = None
                     slave.job_frames = []
+                    slave.updateBusy()
 
-                    self.send_head(http.client.ACCEPTED)
+                    self.send_head(http.client.ACCEPTED, length = 0)
             else: # invalid slave id
                 self.send_head(http.client.NO_CONTENT)
         # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
@@ -530,12 +919,7 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
 
                     if render_file:
                         self.server.stats("", "Sending file to slave")
-                        f = open(render_file.filepath, 'rb')
-
-                        self.send_head()
-                        shutil.copyfileobj(f, self.wfile)
-
-                        f.close()
+                        self.send_file(render_file.filepath)
                     else:
                         # no such file
                         self.send_head(http.client.NO_CONTENT)
@@ -571,9 +955,7 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
         # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
         if self.path == "/job":
 
-            length = int(self.headers['content-length'])
-
-            job_info = netrender.model.RenderJob.materialize(json.loads(str(self.rfile.read(length), encoding='utf8')))
+            job_info = netrender.model.RenderJob.materialize(json.loads(str(self.read_data(), encoding='utf8')))
             job_id = self.server.nextJobID()
 
             job = MRenderJob(job_id, job_info)
@@ -585,14 +967,23 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
 
             self.server.addJob(job)
 
+            for rfile in job.linkCachedFiles(self.server.cache):
+                self.server.journal.file(job, rfile)
+
             headers={"job-id": job_id}
 
-            if job.testStart():
+            started = job.testStart()
+            self.server.journal.jobState(job)
+
+            if started:
                 self.server.stats("", "New job, started")
                 self.send_head(headers=headers, content = None)
             else:
-                self.server.stats("", "New job, missing files (%i total)" % len(job.files))
+                # tell the client which files it still has to upload
+                missing = job.missingFiles()
+                self.server.stats("", "New job, missing files (%i of %i total)" % (len(missing), len(job.files)))
                 self.send_head(http.client.ACCEPTED, headers=headers)
+                self.wfile.write(bytes(json.dumps(missing), encoding='utf8'))
         # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
         elif self.path.startswith("/edit"):
             match = edit_pattern.match(self.path)
@@ -606,6 +997,8 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                     info_map = self.getInfoMap()
 
                     job.edit(info_map)
+                    self.server.scheduler.invalidate()
+                    self.server.journal.jobState(job)
                     self.send_head(content = None)
                 else:
                     # no such job id
@@ -671,6 +1064,8 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                 if job:
                     self.server.stats("", "Pausing job")
                     job.pause(status)
+                    self.server.scheduler.invalidate()
+                    self.server.journal.jobState(job)
                     self.send_head(content = None)
                 else:
                     # no such job id
@@ -706,6 +1101,7 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                         if frame:
                             self.server.stats("", "Reset job frame")
                             frame.reset(all)
+                            self.server.journal.frames(job, [frame])
                             self.send_head(content = None)
                         else:
                             # no such frame
@@ -714,6 +1110,9 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                     else:
                         self.server.stats("", "Reset job")
                         job.reset(all)
+                        self.server.scheduler.invalidate()
+                        self.server.journal.frames(job, job.frames)
+                        self.server.journal.jobState(job)
                         self.send_head(content = None)
 
                 else: # job not found
@@ -722,23 +1121,20 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                 self.send_head(http.client.NO_CONTENT)
         # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
         elif self.path == "/slave":
-            length = int(self.headers['content-length'])
             # job_frame_string = self.headers['job-frame']  # UNUSED
 
             self.server.stats("", "New slave connected")
 
-            slave_info = netrender.model.RenderSlave.materialize(json.loads(str(self.rfile.read(length), encoding='utf8')), cache = False)
+            slave_info = netrender.model.RenderSlave.materialize(json.loads(str(self.read_data(), encoding='utf8')), cache = False)
             
             slave_info.address = self.client_address
 
             slave_id = self.server.addSlave(slave_info)
 
-            self.send_head(headers = {"slave-id": slave_id}, content = None)
+            self.send_head(headers = {"slave-id": slave_id}, content = None, length = 0)
         # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
         elif self.path == "/log":
-            length = int(self.headers['content-length'])
-
-            log_info = netrender.model.LogFile.materialize(json.loads(str(self.rfile.read(length), encoding='utf8')))
+            log_info = netrender.model.LogFile.materialize(json.loads(str(self.read_data(), encoding='utf8')))
 
             slave_id = log_info.slave_id
 
@@ -750,12 +1146,34 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                 if job:
                     self.server.stats("", "Log announcement")
                     job.addLog(log_info.frames)
-                    self.send_head(content = None)
+                    self.server.journal.frames(job, [job[number] for number in log_info.frames if number in job])
+                    self.send_head(content = None, length = 0)
                 else:
                     # no such job id
                     self.send_head(http.client.NO_CONTENT)
             else: # invalid slave id
                 self.send_head(http.client.NO_CONTENT)
+        # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+        elif self.path == "/heartbeat":
+            # rendering slave: new log output (if any) and cancel check in one request
+            self.server.getSeenSlave(self.headers.get('slave-id', ""))
+
+            job = self.server.getJobID(self.headers.get('job-id', ""))
+
+            if job:
+                frame = job[int(self.headers.get('job-frame', -1))]
+
+                if frame:
+                    if self.body_left > 0 and frame.log_path:
+                        self.appendLog(job, frame)
+
+                    self.send_head(content = None, length = 0)
+                else:
+                    # no such frame, cancel
+                    self.send_head(http.client.NO_CONTENT)
+            else:
+                # no such job id, cancel
+                self.send_head(http.client.NO_CONTENT)
     # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
     # -=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
     # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
@@ -780,31 +1198,37 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                     rfile = job.files[file_index]
 
                     if rfile:
-                        main_file = job.files[0].original_path # original path of the first file
-
-                        main_path, main_name = os.path.split(main_file)
-
-                        if file_index > 0:
-                            file_path = createLocalPath(rfile, job.save_path, main_path, True)
-                        else:
-                            file_path = os.path.join(job.save_path, main_name)
+                        file_path = job.localFilePath(file_index)
 
                         # add same temp file + renames as slave
+
+                        # may be linked to the cache, don't overwrite it in place
+                        if os.path.exists(file_path):
+                            os.remove(file_path)
                         
-                        self.write_file(file_path)
+                        if not self.write_file(file_path):
+                            self.send_upload_offset()
+                            return
                         
                         rfile.filepath = file_path # set the new path
                         found = rfile.updateStatus() # make sure we have the right file
+                        self.server.journal.file(job, rfile)
+
+                        if found and rfile.signature:
+                            # other jobs using this file won't need it uploaded again
+                            self.server.cache.add(file_path, rfile.signature)
                         
                         if not found: # checksum mismatch
                             self.server.stats("", "File upload but checksum mismatch, this shouldn't happen")
-                            self.send_head(http.client.CONFLICT)
+                            self.send_head(http.client.CONFLICT, length = 0)
                         elif job.testStart(): # started correctly
+                            self.server.scheduler.invalidate()
+                            self.server.journal.jobState(job)
                             self.server.stats("", "File upload, starting job")
-                            self.send_head(content = None)
+                            self.send_head(content = None, length = 0)
                         else:
                             self.server.stats("", "File upload, dependency files still missing")
-                            self.send_head(http.client.ACCEPTED)
+                            self.send_head(http.client.ACCEPTED, length = 0)
                     else: # invalid file
                         print("file not found", job_id, file_index)
                         self.send_head(http.client.NO_CONTENT)
@@ -835,12 +1259,16 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                     frame = job[job_frame]
 
                     if frame:
-                        self.send_head(content = None)
+                        if job.hasRenderResult() and job_result == netrender.model.FRAME_DONE:
+                            if not self.write_file(job.getResultPath(frame.getRenderFilename())):
+                                self.send_upload_offset()
+                                return
+
+                        self.send_head(content = None, length = 0)
 
                         if job.hasRenderResult():
                             if job_result == netrender.model.FRAME_DONE:
                                 frame.addDefaultRenderResult()
-                                self.write_file(job.getResultPath(frame.getRenderFilename()))
 
                             elif job_result == netrender.model.FRAME_ERROR:
                                 # blacklist slave on this job on error
@@ -853,8 +1281,18 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                         frame.status = job_result
                         frame.time = job_time
 
+                        if job_result == netrender.model.FRAME_DONE:
+                            job.frame_stats.add(job_time)
+
                         job.testFinished()
 
+                        self.server.journal.frames(job, [frame])
+                        self.server.journal.jobState(job)
+
+                        if job.subtype == netrender.model.JOB_SUB_TILES and job.status == netrender.model.JOB_FINISHED:
+                            self.server.stats("", "Stitching tiles")
+                            job.stitch()
+
                     else: # frame not found
                         self.send_head(http.client.NO_CONTENT)
                 else: # job not found
@@ -882,14 +1320,18 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                     if frame:
                         job_result = int(self.headers['job-result'])
                         job_finished = self.headers['job-finished'] == str(True)
-                        
-                        self.send_head(content = None)
 
                         if job_result == netrender.model.FRAME_DONE:
                             result_filename = self.headers['result-filename']
-                            
+
+                            if not self.write_file(job.getResultPath(result_filename)):
+                                self.send_upload_offset()
+                                return
+                        
+                        self.send_head(content = None, length = 0)
+
+                        if job_result == netrender.model.FRAME_DONE:
                             frame.results.append(result_filename)
-                            self.write_file(job.getResultPath(result_filename))
                             
                         if job_finished:
                             job_time = float(self.headers['job-time'])
@@ -898,7 +1340,13 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                             frame.status = job_result
                             frame.time = job_time
 
+                            if job_result == netrender.model.FRAME_DONE:
+                                job.frame_stats.add(job_time)
+
                             job.testFinished()
+                            self.server.journal.jobState(job)
+
+                        self.server.journal.frames(job, [frame])
                     else: # frame not found
                         self.send_head(http.client.NO_CONTENT)
                 else: # job not found
@@ -924,11 +1372,11 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                     frame = job[job_frame]
 
                     if frame:
-                        self.send_head(content = None)
-                        
                         if job.hasRenderResult():
                             self.write_file(os.path.join(os.path.join(job.save_path, "%06d.jpg" % job_frame)))
 
+                        self.send_head(content = None, length = 0)
+
                     else: # frame not found
                         self.send_head(http.client.NO_CONTENT)
                 else: # job not found
@@ -952,9 +1400,9 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                     frame = job[job_frame]
 
                     if frame and frame.log_path:
-                        self.send_head(content = None)
+                        self.appendLog(job, frame)
 
-                        self.write_file(frame.log_path, 'ab')
+                        self.send_head(content = None, length = 0)
 
                         self.server.getSeenSlave(self.headers['slave-id'])
 
@@ -966,7 +1414,12 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                 self.send_head(http.client.NO_CONTENT)
 
 class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
-    def __init__(self, address, handler_class, path, force=False, subdir=True):
+    # a full farm polls at the same time, the default backlog of 5 drops connections
+    request_queue_size = 128
+    # don't let a stuck transfer keep the master alive on exit
+    daemon_threads = True
+
+    def __init__(self, address, handler_class, path, force=False, subdir=True, cache_size=0):
         self.jobs = []
         self.jobs_map = {}
         self.slaves = []
@@ -981,6 +1434,9 @@ class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
 
         verifyCreateDir(self.path)
 
+        # job files by signature, shared by all jobs
+        self.cache = netrender.filecache.BlobCache(os.path.join(self.path, "blobs"), cache_size)
+
         self.slave_timeout = 5 # 5 mins: need a parameter for that
 
         self.balancer = netrender.balancing.Balancer()
@@ -991,6 +1447,20 @@ class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
         self.balancer.addPriority(netrender.balancing.NewJobPriority())
         self.balancer.addPriority(netrender.balancing.MinimumTimeBetweenDispatchPriority(limit = 2))
 
+        self.scheduler = netrender.balancing.Scheduler(self.balancer)
+
+        # records nothing until createMaster gives it a path
+        self.journal = netrender.journal.MasterJournal(None)
+
+        self.metrics = netrender.metrics.Metrics()
+        self.metrics.describe("netrender_requests_total", "Requests handled, by method, handler path and status code")
+        self.metrics.describe("netrender_request_seconds", "Time spent handling requests, by handler path")
+        self.metrics.describe("netrender_transfer_bytes_total", "Request and response bytes")
+        self.metrics.describe("netrender_dispatch_seconds", "Time to pick a job and frames for a slave")
+        self.metrics.describe("netrender_balance_seconds", "Time to evaluate the balancer rules and order jobs")
+        self.metrics.describe("netrender_job_frames", "Frames of each job, by status")
+        self.metrics.describe("netrender_slave_idle_ratio", "Part of the time since it connected a slave had no frames")
+
         super().__init__(address, handler_class)
 
     def restore(self, jobs, slaves, balancer = None):
@@ -998,6 +1468,7 @@ class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
         self.jobs_map = {}
         
         for job in self.jobs:
+            job.buildIndex()
             self.jobs_map[job.id] = job
             self.job_id = max(self.job_id, int(job.id))
 
@@ -1007,7 +1478,9 @@ class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
         
         if balancer:
             self.balancer = balancer
-        
+            self.scheduler = netrender.balancing.Scheduler(self.balancer)
+
+        self.scheduler.invalidate()
 
     def nextJobID(self):
         self.job_id += 1
@@ -1018,12 +1491,16 @@ class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
         self.slaves.append(slave)
         self.slaves_map[slave.id] = slave
 
+        self.journal.addSlave(slave)
+
         return slave.id
 
     def removeSlave(self, slave):
         self.slaves.remove(slave)
         self.slaves_map.pop(slave.id)
 
+        self.journal.removeSlave(slave)
+
     def getSlave(self, slave_id):
         return self.slaves_map.get(slave_id)
 
@@ -1047,6 +1524,8 @@ class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
                     for f in slave.job_frames:
                         slave.job[f].status = netrender.model.FRAME_ERROR
 
+                    self.journal.frames(slave.job, [slave.job[f] for f in slave.job_frames])
+
         for slave in removed:
             self.removeSlave(slave)
 
@@ -1070,7 +1549,33 @@ class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
             self.removeJob(job, clear_files)
 
     def balance(self):
-        self.balancer.balance(self.jobs)
+        start = time.time()
+
+        if self.scheduler.update(self.jobs):
+            self.metrics.observe("netrender_balance_seconds", time.time() - start)
+
+    def metricsGauges(self):
+        gauges = [
+                    ("netrender_uptime_seconds", (), time.time() - self.metrics.start_time),
+                    ("netrender_slaves", (), len(self.slaves)),
+                    ("netrender_jobs", (), len(self.jobs))
+                 ]
+
+        frame_status = (
+                            ("queued", netrender.model.FRAME_QUEUED),
+                            ("dispatched", netrender.model.FRAME_DISPATCHED),
+                            ("done", netrender.model.FRAME_DONE),
+                            ("error", netrender.model.FRAME_ERROR)
+                       )
+
+        for job in self.jobs:
+            for label, status in frame_status:
+                gauges.append(("netrender_job_frames", (("job", job.id), ("status", label)), job.countFrames(status)))
+
+        for slave in self.slaves:
+            gauges.append(("netrender_slave_idle_ratio", (("slave", slave.name), ("id", slave.id)), "%.4f" % slave.idleRatio()))
+
+        return gauges
 
     def getJobs(self):
         return self.jobs
@@ -1089,6 +1594,9 @@ class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
     def removeJob(self, job, clear_files = False):
         self.jobs.remove(job)
         self.jobs_map.pop(job.id)
+        self.scheduler.invalidate()
+
+        self.journal.removeJob(job)
 
         if clear_files:
             shutil.rmtree(job.save_path)
@@ -1101,6 +1609,7 @@ class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
     def addJob(self, job):
         self.jobs.append(job)
         self.jobs_map[job.id] = job
+        self.scheduler.invalidate()
 
         # create job directory
         job.save_path = os.path.join(self.path, "job_" + job.id)
@@ -1108,6 +1617,8 @@ class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
 
         job.save()
 
+        self.journal.addJob(job)
+
     def getJobID(self, id):
         return self.jobs_map.get(id)
 
@@ -1115,50 +1626,200 @@ class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
         for job in self.jobs:
             yield job
 
+    def replay(self, record):
+        """Apply a journal record on top of the restored state"""
+        record_type = record["type"]
+
+        if record_type == "job":
+            if record["id"] not in self.jobs_map:
+                job_info = netrender.model.RenderJob.materialize(record["data"])
+                job = MRenderJob(record["id"], job_info)
+
+                for frame in job_info.frames:
+                    job.addFrame(frame.number, frame.command)
+
+                job.save_path = record["save_path"]
+
+                self.jobs.append(job)
+                self.jobs_map[job.id] = job
+                self.job_id = max(self.job_id, int(job.id))
+
+        elif record_type == "job_state":
+            job = self.getJobID(record["id"])
+            if job:
+                job.status = record["status"]
+                job.priority = record["priority"]
+                job.chunks = record["chunks"]
+                job.chunk_time = record.get("chunk_time", job.chunk_time)
+                job.blacklist = record["blacklist"]
+
+        elif record_type == "remove_job":
+            job = self.getJobID(record["id"])
+            if job:
+                self.jobs.remove(job)
+                self.jobs_map.pop(job.id)
+
+        elif record_type == "frames":
+            job = self.getJobID(record["job"])
+            if job:
+                for number, status, frame_time, slave_id, results, log_path in record["frames"]:
+                    frame = job[number]
+                    if frame:
+                        frame.status = status
+                        frame.time = frame_time
+                        frame.slave = self.getSlave(slave_id) if slave_id else None
+                        frame.results = results
+                        frame.log_path = log_path
+
+                        slave = frame.slave
+                        if slave and status == netrender.model.FRAME_DISPATCHED:
+                            slave.job = job
+                            if number not in slave.job_frames:
+                                slave.job_frames.append(number)
+                        elif slave and number in slave.job_frames:
+                            slave.finishedFrame(number)
+
+        elif record_type == "file":
+            job = self.getJobID(record["job"])
+            if job and record["index"] < len(job.files):
+                rfile = job.files[record["index"]]
+                rfile.filepath = record["filepath"]
+                rfile.found = record["found"]
+
+        elif record_type == "slave":
+            if record["id"] not in self.slaves_map:
+                slave_info = netrender.model.RenderSlave.materialize(record["data"], cache = False)
+                slave = MRenderSlave(slave_info)
+                slave.id = record["id"]
+                netrender.model.RenderSlave._slave_map[slave.id] = slave
+
+                self.slaves.append(slave)
+                self.slaves_map[slave.id] = slave
+
+        elif record_type == "remove_slave":
+            slave = self.getSlave(record["id"])
+            if slave:
+                self.slaves.remove(slave)
+                self.slaves_map.pop(slave.id)
+
     def newDispatch(self, slave):
-        if self.jobs:
-            for job in self.jobs:
-                if (
-                    not self.balancer.applyExceptions(job)      # No exceptions
-                    and slave.id not in job.blacklist           # slave is not blacklisted
-                    and (not slave.tags or job.tags.issubset(slave.tags))  # slave doesn't use tags or slave has all job tags
-                         ):
-                    
-                    return job, job.getFrames()
+        # candidates are already filtered on tags and ordered by the balancer,
+        # only recheck what can change between two scheduler updates
+        for job in self.scheduler.candidates(slave):
+            if (
+                job.countFrames(netrender.model.FRAME_QUEUED) > 0
+                and slave.id not in job.blacklist           # slave is not blacklisted
+                and not self.balancer.applyExceptions(job)  # No exceptions
+                    ):
+                if job.chunk_time:
+                    # slaves that will ask for frames of this job before it ends
+                    free_slaves = sum((1 for s in self.slaves if not s.job_frames or s.job == job))
+                    frames = job.getFrames(job.chunkSize(free_slaves))
+                else:
+                    frames = job.getFrames()
+
+                if frames:
+                    return job, frames
 
         return None, None
 
 def clearMaster(path):
     shutil.rmtree(path)
 
-def createMaster(address, clear, force, path):
-    filepath = os.path.join(path, "blender_master.data")
+def createMaster(address, clear, force, path, cache_size=0):
+    journal = netrender.journal.MasterJournal(path)
 
-    if not clear and os.path.exists(filepath):
-        print("loading saved master:", filepath)
-        with open(filepath, 'rb') as f:
-            path, jobs, slaves = pickle.load(f)
-            
-            httpd = RenderMasterServer(address, RenderHandler, path, force=force, subdir=False)
+    if clear:
+        journal.remove()
+    elif journal.exists():
+        print("recovering saved master:", path)
+        start = time.time()
+
+        snapshot, records = journal.read()
+
+        if snapshot:
+            master_path, jobs, slaves = snapshot
+        else:
+            # crashed before the first snapshot, the journal knows where the master was
+            master_path, jobs, slaves = None, [], []
+            for record in records:
+                if record["type"] == "master":
+                    master_path = record["path"]
+                    break
+
+        if master_path:
+            httpd = RenderMasterServer(address, RenderHandler, master_path, force=force, subdir=False, cache_size=cache_size)
             httpd.restore(jobs, slaves)
-            
+
+            for record in records:
+                httpd.replay(record)
+
+            for job in httpd.jobs:
+                job.buildIndex()
+
+            print("replayed %i journal records in %.2fs" % (len(records), time.time() - start))
+
+            # fold the replayed records in a fresh snapshot before serving
+            httpd.journal = journal
+            journal.compact(httpd)
+
             return httpd
 
-    return RenderMasterServer(address, RenderHandler, path, force=force)
+    httpd = RenderMasterServer(address, RenderHandler, path, force=force, cache_size=cache_size)
+    httpd.journal = journal
+    journal.start(httpd)
+
+    return httpd
 
 def saveMaster(path, httpd):
-    filepath = os.path.join(path, "blender_master.data")
-    
-    with open(filepath, 'wb') as f:
-        pickle.dump((httpd.path, httpd.jobs, httpd.slaves), f, pickle.HIGHEST_PROTOCOL)
+    httpd.journal.compact(httpd)
+    httpd.journal.close()
+
+class MasterHousekeeping(threading.Thread):
+    """Periodic master maintenance, run on its own timer instead of between requests"""
+    def __init__(self, httpd, address, broadcast, interval = HOUSEKEEPING_INTERVAL):
+        super().__init__(name = "netrender-housekeeping")
+        self.daemon = True
+        self.httpd = httpd
+        self.address = address
+        self.interval = interval
+        self.stopped = threading.Event()
+
+        if broadcast:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        else:
+            self.socket = None
+
+    def step(self):
+        self.httpd.timeoutSlaves()
+
+        self.httpd.updateUsage()
+
+        if self.httpd.journal.needsCompact():
+            self.httpd.journal.compact(self.httpd)
+
+        if self.socket:
+            print("broadcasting address")
+            self.socket.sendto(bytes("%i" % self.address[1], encoding='utf8'), 0, ('<broadcast>', 8000))
 
-def runMaster(address, broadcast, clear, force, path, update_stats, test_break,use_ssl=False,cert_path="",key_path=""):
-    httpd = createMaster(address, clear, force, path)
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.step()
+            except Exception as e:
+                print("Housekeeping error:", e)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+        if self.socket:
+            self.socket.close()
+
+def runMasterLoop(httpd, address, broadcast, test_break):
     httpd.timeout = 1
-    httpd.stats = update_stats
-    if use_ssl:
-        import ssl
-        httpd.socket=ssl.wrap_socket(httpd.socket,certfile=cert_path,server_side=True,keyfile=key_path,ciphers="ALL",ssl_version=ssl.PROTOCOL_SSLv3)
+
     if broadcast:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
@@ -1171,19 +1832,54 @@ def runMaster(address, broadcast, clear, force, path, update_stats, test_break,u
         except select.error:
             pass
 
-        if time.time() - start_time >= 2: # need constant here
+        if time.time() - start_time >= HOUSEKEEPING_INTERVAL:
             httpd.timeoutSlaves()
 
             httpd.updateUsage()
 
+            if httpd.journal.needsCompact():
+                httpd.journal.compact(httpd)
+
             if broadcast:
                 print("broadcasting address")
                 s.sendto(bytes("%i" % address[1], encoding='utf8'), 0, ('<broadcast>', 8000))
                 start_time = time.time()
 
+def runMasterEvent(httpd, address, broadcast, test_break):
+    # serve_forever multiplexes the listening socket with select and the threading
+    # mixin services each accepted connection concurrently, so a slow transfer
+    # never holds up other slaves. The engine thread only watches for a break.
+    server_thread = threading.Thread(target=httpd.serve_forever, kwargs={"poll_interval": 0.5}, name="netrender-master")
+    server_thread.daemon = True
+
+    housekeeping = MasterHousekeeping(httpd, address, broadcast)
+
+    server_thread.start()
+    housekeeping.start()
+
+    try:
+        while not test_break():
+            time.sleep(0.5)
+    finally:
+        httpd.shutdown()
+        server_thread.join()
+        housekeeping.stop()
+
+def runMaster(address, broadcast, clear, force, path, update_stats, test_break,use_ssl=False,cert_path="",key_path="",serve_mode="LOOP",cache_size=0):
+    httpd = createMaster(address, clear, force, path, cache_size)
+    httpd.stats = update_stats
+    if use_ssl:
+        import ssl
+        httpd.socket=ssl.wrap_socket(httpd.socket,certfile=cert_path,server_side=True,keyfile=key_path,ciphers="ALL",ssl_version=ssl.PROTOCOL_SSLv3)
+
+    if serve_mode == "EVENT":
+        runMasterEvent(httpd, address, broadcast, test_break)
+    else:
+        runMasterLoop(httpd, address, broadcast, test_break)
+
     httpd.server_close()
     if clear:
+        httpd.journal.remove()
         clearMaster(httpd.path)
     else:
         saveMaster(path, httpd)
-
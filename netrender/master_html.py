@@ -351,7 +351,8 @@ def get(handler):
                         "%s [%s]" % (netrender.model.JOB_TYPES[job.type], netrender.model.JOB_SUBTYPES[job.subtype]),
                         str(job.chunks) +
                         """<button title="increase chunks size" onclick="request('/edit_%s', &quot;{'chunks': %i}&quot;);">+</button>""" % (job.id, job.chunks + 1) +
-                        """<button title="decrease chunks size" onclick="request('/edit_%s', &quot;{'chunks': %i}&quot;);" %s>-</button>""" % (job.id, job.chunks - 1, "disabled=True" if job.chunks == 1 else ""),
+                        """<button title="decrease chunks size" onclick="request('/edit_%s', &quot;{'chunks': %i}&quot;);" %s>-</button>""" % (job.id, job.chunks - 1, "disabled=True" if job.chunks == 1 else "") +
+                        (" %is/chunk, %.1fs/frame" % (job.chunk_time, job.frame_stats.average) if job.chunk_time else ""),
                         str(job.priority) +
                         """<button title="increase priority" onclick="request('/edit_%s', &quot;{'priority': %i}&quot;);">+</button>""" % (job.id, job.priority + 1) +
                         """<button title="decrease priority" onclick="request('/edit_%s', &quot;{'priority': %i}&quot;);" %s>-</button>""" % (job.id, job.priority - 1, "disabled=True" if job.priority == 1 else ""),
@@ -445,6 +446,10 @@ def get(handler):
             
             rowTable("results", link("download all", resultURL(job_id)))
 
+            if job.subtype == netrender.model.JOB_SUB_TILES:
+                frame_number = job.tileFrame()
+                rowTable("tiles", "%i tiles of frame %i, %s" % (len(job), frame_number, link("view stitched frame", renderURL(job_id, frame_number)) if job.status == netrender.model.JOB_FINISHED else "stitched when all are done"))
+
             endTable()
 
 
@@ -0,0 +1,133 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import re, time, bisect
+import threading
+
+# seconds, from a quick poll to a large upload
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+path_pattern = re.compile("/[a-z]*")
+
+def pathLabel(path):
+    """Handler a request path goes to, without job ids and frame numbers"""
+    match = path_pattern.match(path)
+    return match.group(0) if match else "/"
+
+def formatLabels(labels):
+    if not labels:
+        return ""
+
+    return "{" + ",".join(('%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"')) for key, value in labels)) + "}"
+
+class Histogram:
+    def __init__(self, buckets = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            yield "%s_bucket%s %i" % (name, formatLabels(labels + (("le", bound),)), cumulative)
+
+        yield "%s_sum%s %f" % (name, formatLabels(labels), self.total)
+        yield "%s_count%s %i" % (name, formatLabels(labels), self.count)
+
+class Metrics:
+    """
+    Counters and histograms kept by the master, in Prometheus text format.
+
+    Values are keyed by metric name and a tuple of (label, value) pairs.
+    Updates only take a lock and a dictionary lookup, so they can stay on
+    the request paths.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def count(self, name, value = 1, labels = ()):
+        with self.lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels = ()):
+        with self.lock:
+            key = (name, labels)
+            histogram = self.histograms.get(key)
+
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+
+            histogram.observe(value)
+
+    def timer(self, name, labels = ()):
+        """Context observing the time spent in it"""
+        return MetricsTimer(self, name, labels)
+
+    def render(self, gauges = ()):
+        """Text exposition of all metrics, gauges are (name, labels, value) computed by the caller"""
+        lines = []
+        described = set()
+
+        def header(name, metric_type):
+            if name not in described:
+                described.add(name)
+                if name in self.help:
+                    lines.append("# HELP %s %s" % (name, self.help[name]))
+                lines.append("# TYPE %s %s" % (name, metric_type))
+
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                header(name, "counter")
+                lines.append("%s%s %s" % (name, formatLabels(labels), value))
+
+            for (name, labels), histogram in sorted(self.histograms.items(), key = lambda item: item[0]):
+                header(name, "histogram")
+                lines.extend(histogram.lines(name, labels))
+
+        for name, labels, value in sorted(gauges):
+            header(name, "gauge")
+            lines.append("%s%s %s" % (name, formatLabels(labels), value))
+
+        return "\n".join(lines) + "\n"
+
+class MetricsTimer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.name, time.time() - self.start, self.labels)
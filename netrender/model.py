@@ -61,11 +61,13 @@ JOB_TYPES = {
 
 JOB_SUB_RENDER = 1
 JOB_SUB_BAKING = 2
+JOB_SUB_TILES = 3
 
 # Job subtypes
 JOB_SUBTYPES = {
                 JOB_SUB_RENDER: "Render",
                 JOB_SUB_BAKING: "Baking",
+                JOB_SUB_TILES: "Tiles",
             }
 
 
@@ -278,6 +280,7 @@ class RenderJob:
             self.status = info.status
             self.files = info.files
             self.chunks = info.chunks
+            self.chunk_time = info.chunk_time
             self.priority = info.priority
             self.blacklist = info.blacklist
             self.version_info = info.version_info
@@ -291,6 +294,7 @@ class RenderJob:
             self.status = JOB_WAITING
             self.files = []
             self.chunks = 0
+            self.chunk_time = 0
             self.priority = 0
             self.blacklist = []
             self.version_info = None
@@ -330,10 +334,10 @@ class RenderJob:
         return finished_time
 
     def hasRenderResult(self):
-        return self.subtype == JOB_SUB_RENDER
+        return self.subtype in {JOB_SUB_RENDER, JOB_SUB_TILES}
 
     def rendersWithBlender(self):
-        return self.subtype == JOB_SUB_RENDER
+        return self.subtype in {JOB_SUB_RENDER, JOB_SUB_TILES}
 
     def addFile(self, file_path, start=-1, end=-1, signed=True):
         def isFileInFrames():
@@ -416,6 +420,7 @@ class RenderJob:
                             "status": self.status,
                             "transitions": self.transitions,
                             "chunks": self.chunks,
+                            "chunk_time": self.chunk_time,
                             "priority": self.priority,
                             "usage": self.usage,
                             "blacklist": self.blacklist,
@@ -448,6 +453,7 @@ class RenderJob:
         job.files = [RenderFile.materialize(f) for f in data["files"]]
         job.frames = [RenderFrame.materialize(f) for f in data["frames"]]
         job.chunks = data["chunks"]
+        job.chunk_time = data.get("chunk_time", 0)
         job.priority = data["priority"]
         job.usage = data["usage"]
         job.blacklist = data["blacklist"]
@@ -18,7 +18,7 @@
 
 import sys, os, platform, shutil
 import http, http.client, http.server
-import subprocess, time, threading
+import subprocess, time, threading, codecs
 import json
 
 import bpy
@@ -27,7 +27,9 @@ from netrender.utils import *
 import netrender.model
 import netrender.repath
 import netrender.baking
+import netrender.tiles
 import netrender.thumbnail as thumbnail
+import netrender.filecache
 
 BLENDER_PATH = sys.argv[0]
 
@@ -55,17 +57,167 @@ def slave_Info(netsettings):
         
     return slave
 
-def testCancel(conn, job_id, frame_number):
-        with ConnectionContext():
-            conn.request("HEAD", "/status", headers={"job-id":job_id, "job-frame": str(frame_number)})
+class Heartbeat(threading.Thread):
+    """
+    Reports a render in progress without blocking the render loop: output
+    gathered since the last beat goes with the cancel check, in one request
+    per interval.
+    """
+    def __init__(self, pool, slave_id, job_id, frame_number, interval = CANCEL_POLL_SPEED):
+        super().__init__()
+        self.daemon = True
+        self.pool = pool
+        self.headers = {"slave-id":slave_id, "job-id":job_id, "job-frame":str(frame_number)}
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.output = bytes()
+        self.cancelled = False
+        self.stopped = threading.Event()
+
+    def add(self, output):
+        with self.lock:
+            self.output += output
+
+    def beat(self):
+        with self.lock:
+            output = self.output
+            self.output = bytes()
+
+        try:
+            status, headers, data = self.pool.request("POST", "/heartbeat", output, self.headers)
+        except (OSError, http.client.HTTPException) as err:
+            print("Heartbeat failed:", err)
+
+            # keep the output for the next beat
+            with self.lock:
+                self.output = output + self.output
+            return
 
         # canceled if job isn't found anymore
-        if responseStatus(conn) == http.client.NO_CONTENT:
-            return True
-        else:
-            return False
+        if status == http.client.NO_CONTENT:
+            self.cancelled = True
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.beat()
+
+    def stop(self):
+        """Stop beating and send what's left of the output"""
+        self.stopped.set()
+        self.join()
+        self.beat()
+
+class RenderProcess:
+    """
+    A render subprocess, the thread reading its output and the frames it renders.
+
+    Frames Blender reports as saved are picked from the output while the
+    process runs, so they can be sent back before the whole chunk is done.
+    """
+    def __init__(self, process, frames, output_path = ""):
+        self.process = process
+        self.frames = frames
+        self.output_path = output_path
+        self.sent = set()
+        self.last_saved = time.time()
+
+        self.lock = threading.Lock()
+        self.stdout = bytes()
+        self.decoder = codecs.getincrementaldecoder("utf8")(errors = "replace")
+        self.line = ""
+
+        self.thread = threading.Thread(target=self.read)
+        self.thread.start()
+
+    def read(self):
+        while True:
+            buf = self.process.stdout.read1(1024)
+
+            if not buf:
+                break
+
+            with self.lock:
+                self.stdout += buf
+
+    def running(self):
+        return self.thread.is_alive()
+
+    def join(self):
+        self.thread.join()
+        self.process.wait()
+
+    def terminate(self):
+        if self.process.poll() is None:
+            try:
+                self.process.terminate()
+            except OSError:
+                pass
+
+    def readLines(self):
+        """Output since the last call and the complete lines in it"""
+        running = self.running()
+
+        with self.lock:
+            stdout = self.stdout
+            self.stdout = bytes()
+
+        lines = (self.line + self.decoder.decode(stdout, final = not running)).split("\n")
+
+        # keep the partial last line for later, unless it's the end of the output
+        self.line = lines.pop() if running else ""
+
+        return stdout, lines
+
+    def savedFrames(self, lines):
+        """Frames Blender saved in these lines, with the time since the previous one"""
+        saved = []
+
+        for line in lines:
+            line = line.strip()
+
+            if line.startswith("Saved:"):
+                filepath = line[6:].split(" Time: ")[0].strip(" '\"")
+
+                try:
+                    number = int(os.path.splitext(os.path.basename(filepath))[0])
+                except ValueError:
+                    continue
+
+                for frame in self.frames:
+                    if frame.number == number and number not in self.sent:
+                        current_time = time.time()
+                        saved.append((frame, current_time - self.last_saved))
+                        self.last_saved = current_time
+                        self.sent.add(number)
+
+        return saved
+
+    def remainingFrames(self):
+        return [frame for frame in self.frames if frame.number not in self.sent]
+
+def sendRenderResult(pool, netsettings, job, frame, output_path, slave_id, frame_time):
+    headers = {
+                "job-id":job.id,
+                "slave-id":slave_id,
+                "job-time":str(frame_time),
+                "job-result":str(netrender.model.FRAME_DONE),
+                "job-frame":str(frame.number)
+              }
 
-def testFile(conn, job_id, slave_id, rfile, job_prefix, main_path=None):
+    filename = os.path.join(output_path, "%06d.exr" % frame.number)
+
+    # thumbnail first
+    if netsettings.use_slave_thumb:
+        thumbname = thumbnail.generate(filename)
+        
+        if thumbname:
+            with open(thumbname, 'rb') as f:
+                pool.request("PUT", "/thumb", f.read(), headers=headers)
+
+    with pool.connection() as conn:
+        return sendFile(conn, "/render", filename, headers=headers, compress = netsettings.use_compression)
+
+def testFile(conn, job_id, slave_id, rfile, job_prefix, main_path=None, cache=None, compress=False):
     job_full_path = createLocalPath(rfile, job_prefix, main_path, rfile.force)
     
     found = os.path.exists(job_full_path)
@@ -78,28 +230,40 @@ def testFile(conn, job_id, slave_id, rfile, job_prefix, main_path=None):
             print("Found file %s at %s but signature mismatch!" % (rfile.filepath, job_full_path))
             os.remove(job_full_path)
 
+    if not found and cache and rfile.signature != None:
+        # already downloaded for another job
+        job_full_path = createLocalPath(rfile, job_prefix, main_path, True)
+        found = cache.link(rfile.signature, job_full_path)
+
+        if found:
+            print("Cached", job_full_path)
+
     if not found:
         # Force prefix path if not found
         job_full_path = createLocalPath(rfile, job_prefix, main_path, True)
         print("Downloading", job_full_path)
-        temp_path = os.path.join(job_prefix, "slave.temp")
-        with ConnectionContext():
-            conn.request("GET", fileURL(job_id, rfile.index), headers={"slave-id":slave_id})
-        response = conn.getresponse()
+        # one temp file per job file, so an interrupted download can resume
+        temp_path = os.path.join(job_prefix, "slave_%i.temp" % rfile.index)
 
-        if response.status != http.client.OK:
-            return None # file for job not returned by server, need to return an error code to server
+        for attempt in range(2):
+            status = getFile(conn, fileURL(job_id, rfile.index), temp_path, headers={"slave-id":slave_id}, compress = compress)
 
-        f = open(temp_path, "wb")
-        buf = response.read(1024)
+            if status != http.client.OK:
+                return None # file for job not returned by server, need to return an error code to server
 
-        while buf:
-            f.write(buf)
-            buf = response.read(1024)
+            # a resumed download may have started from a stale temp file
+            if rfile.signature == None or hashFile(temp_path) == rfile.signature:
+                break
 
-        f.close()
+            print("Downloaded %s but signature mismatch!" % rfile.filepath)
+            os.remove(temp_path)
+        else:
+            return None
 
         os.renames(temp_path, job_full_path)
+
+        if cache and rfile.signature != None:
+            cache.add(job_full_path, rfile.signature)
         
     rfile.filepath = job_full_path
 
@@ -143,27 +307,27 @@ def render_slave(engine, netsettings, threads):
             print("Retry %i failed, waiting %is before retrying" % (i + 1, bisleep.current))
     
     if conn:
-        with ConnectionContext():
-            conn.request("POST", "/slave", json.dumps(slave_Info(netsettings).serialize()))
-        response = conn.getresponse()
-        response.read()
+        pool = ConnectionPool(conn)
 
-        slave_id = response.getheader("slave-id")
+        status, response_headers, data = pool.request("POST", "/slave", bytes(json.dumps(slave_Info(netsettings).serialize()), encoding='utf8'))
+
+        slave_id = response_headers.get("slave-id")
 
         NODE_PREFIX = os.path.join(slave_path, "slave_" + slave_id)
         verifyCreateDir(NODE_PREFIX)
 
+        # outside of the node directory, so it survives clearing on exit
+        cache = netrender.filecache.BlobCache(os.path.join(slave_path, "blobs"), netsettings.slave_cache_size * 1024 * 1024)
+
         engine.update_stats("", "Network render connected to master, waiting for jobs")
 
         while not engine.test_break():
-            with ConnectionContext():
-                conn.request("GET", "/job", headers={"slave-id":slave_id})
-            response = conn.getresponse()
+            status, response_headers, data = pool.request("GET", "/job", headers={"slave-id":slave_id})
 
-            if response.status == http.client.OK:
+            if status == http.client.OK:
                 bisleep.reset()
 
-                job = netrender.model.RenderJob.materialize(json.loads(str(response.read(), encoding='utf8')))
+                job = netrender.model.RenderJob.materialize(json.loads(str(data, encoding='utf8')))
                 engine.update_stats("", "Network render processing job from master")
 
                 job_prefix = os.path.join(NODE_PREFIX, "job_" + job.id)
@@ -178,13 +342,14 @@ def render_slave(engine, netsettings, threads):
                     job_path = job.files[0].original_path # original path of the first file
                     main_path, main_file = os.path.split(job_path)
 
-                    job_full_path = testFile(conn, job.id, slave_id, job.files[0], job_prefix)
-                    print("Fullpath", job_full_path)
-                    print("File:", main_file, "and %i other files" % (len(job.files) - 1,))
+                    with pool.connection() as conn:
+                        job_full_path = testFile(conn, job.id, slave_id, job.files[0], job_prefix, cache=cache, compress=netsettings.use_compression)
+                        print("Fullpath", job_full_path)
+                        print("File:", main_file, "and %i other files" % (len(job.files) - 1,))
 
-                    for rfile in job.files[1:]:
-                        testFile(conn, job.id, slave_id, rfile, job_prefix, main_path)
-                        print("\t", rfile.filepath)
+                        for rfile in job.files[1:]:
+                            testFile(conn, job.id, slave_id, rfile, job_prefix, main_path, cache=cache, compress=netsettings.use_compression)
+                            print("\t", rfile.filepath)
                         
                     netrender.repath.update(job)
 
@@ -206,26 +371,45 @@ def render_slave(engine, netsettings, threads):
 
                 # announce log to master
                 logfile = netrender.model.LogFile(job.id, slave_id, [frame.number for frame in job.frames])
-                with ConnectionContext():
-                    conn.request("POST", "/log", bytes(json.dumps(logfile.serialize()), encoding='utf8'))
-                response = conn.getresponse()
-                response.read()
+                pool.request("POST", "/log", bytes(json.dumps(logfile.serialize()), encoding='utf8'))
 
 
                 first_frame = job.frames[0].number
 
                 # start render
-                start_t = time.time()
+                processes = []
 
                 if job.rendersWithBlender():
-                    frame_args = []
+                    # frames are split over the worker processes, each with its share of threads and its own output
+                    worker_count = max(1, min(netsettings.slave_processes, len(job.frames)))
+                    worker_threads = max(1, threads // worker_count)
 
-                    for frame in job.frames:
-                        print("frame", frame.number)
-                        frame_args += ["-f", str(frame.number)]
+                    for worker in range(worker_count):
+                        worker_frames = job.frames[worker::worker_count]
 
-                    with NoErrorDialogContext():
-                        process = subprocess.Popen([BLENDER_PATH, "-b", "-noaudio", job_full_path, "-t", str(threads), "-o", os.path.join(job_prefix, "######"), "-E", job.render, "-F", "MULTILAYER"] + frame_args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                        if worker_count > 1:
+                            output_path = os.path.join(job_prefix, "worker_%i" % worker)
+                            verifyCreateDir(output_path)
+                        else:
+                            output_path = job_prefix
+
+                        if job.subtype == netrender.model.JOB_SUB_TILES:
+                            for frame in worker_frames:
+                                print("tile", frame.number, frame.command)
+
+                            with NoErrorDialogContext():
+                                process = netrender.tiles.render(job, job_full_path, worker_frames, output_path, worker_threads)
+                        else:
+                            frame_args = []
+
+                            for frame in worker_frames:
+                                print("frame", frame.number)
+                                frame_args += ["-f", str(frame.number)]
+
+                            with NoErrorDialogContext():
+                                process = subprocess.Popen([BLENDER_PATH, "-b", "-noaudio", job_full_path, "-t", str(worker_threads), "-o", os.path.join(output_path, "######"), "-E", job.render, "-F", "MULTILAYER"] + frame_args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+                        processes.append(RenderProcess(process, worker_frames, output_path))
                         
                 elif job.subtype == netrender.model.JOB_SUB_BAKING:
                     tasks = []
@@ -234,189 +418,133 @@ def render_slave(engine, netsettings, threads):
                         
                     with NoErrorDialogContext():
                         process = netrender.baking.bake(job, tasks)
+
+                    processes.append(RenderProcess(process, job.frames))
                         
                 elif job.type == netrender.model.JOB_PROCESS:
                     command = job.frames[0].command
                     with NoErrorDialogContext():
                         process = subprocess.Popen(command.split(" "), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
 
-                headers = {"slave-id":slave_id}
-                
+                    processes.append(RenderProcess(process, job.frames))
+
                 results = []
 
-                line = ""
-                
-                class ProcessData:
-                    def __init__(self):
-                        self.lock = threading.Lock()
-                        self.stdout = bytes()
-                        self.cancelled = False
-                        self.start_time = time.time()
-                        self.last_time = time.time()
-                        
-                data = ProcessData()
-                
-                def run_process(process, data):
-                    while not data.cancelled and process.poll() is None:
-                        buf = process.stdout.read(1024)
-                        
-                        data.lock.acquire()
-                        data.stdout += buf
-                        data.lock.release()
-                        
-                process_thread = threading.Thread(target=run_process, args=(process, data))
-                
-                process_thread.start()
+                def readOutput(render_process):
+                    stdout, lines = render_process.readLines()
+
+                    if stdout:
+                        heartbeat.add(stdout)
+
+                        # Also output on console
+                        if netsettings.use_slave_output_log:
+                            print(str(stdout, encoding='utf8', errors='replace'), end="")
+
+                    if job.subtype == netrender.model.JOB_SUB_BAKING:
+                        results.extend(netrender.baking.resultsFromOuput(lines))
+
+                    if job.hasRenderResult():
+                        # send frames back as soon as they are saved
+                        for frame, frame_time in render_process.savedFrames(lines):
+                            sendRenderResult(pool, netsettings, job, frame, render_process.output_path, slave_id, frame_time)
+
+                # logs and cancel checks go to the master from there
+                # (only need to update on one frame, they are linked
+                heartbeat = Heartbeat(pool, slave_id, job.id, first_frame)
+                heartbeat.start()
+
+                cancelled = False
                 
-                while not data.cancelled and process_thread.is_alive():
+                while not cancelled and any((render_process.running() for render_process in processes)):
                     time.sleep(CANCEL_POLL_SPEED / 2)
-                    current_time = time.time()
-                    data.cancelled = engine.test_break()
-                    if current_time - data.last_time > CANCEL_POLL_SPEED:
-
-                        data.lock.acquire()
-
-                        # update logs if needed
-                        if data.stdout:
-                            # (only need to update on one frame, they are linked
-                            with ConnectionContext():
-                                conn.request("PUT", logURL(job.id, first_frame), data.stdout, headers=headers)
-                            responseStatus(conn)
-                            
-                            stdout_text = str(data.stdout, encoding='utf8')
-                            
-                            # Also output on console
-                            if netsettings.use_slave_output_log:
-                                print(stdout_text, end="")
-                                
-                            lines = stdout_text.split("\n")
-                            lines[0] = line + lines[0]
-                            line = lines.pop()
-                            if job.subtype == netrender.model.JOB_SUB_BAKING:
-                                results.extend(netrender.baking.resultsFromOuput(lines))
-
-                            data.stdout = bytes()
-                            
-                        data.lock.release()
-
-                        data.last_time = current_time
-                        if testCancel(conn, job.id, first_frame):
-                            engine.update_stats("", "Job canceled by Master")
-                            data.cancelled = True
-                
-                process_thread.join()
-                del process_thread
+                    cancelled = engine.test_break() or heartbeat.cancelled
+
+                    for render_process in processes:
+                        readOutput(render_process)
+
+                if heartbeat.cancelled:
+                    engine.update_stats("", "Job canceled by Master")
+
+                if cancelled:
+                    # kill processes if needed
+                    for render_process in processes:
+                        render_process.terminate()
+
+                for render_process in processes:
+                    render_process.join()
 
                 if job.type == netrender.model.JOB_BLENDER:
                     netrender.repath.reset(job)
 
-                # read leftovers if needed
-                data.stdout += process.stdout.read()
-
-                if data.cancelled:
-                    # kill process if needed
-                    if process.poll() is None:
-                        try:
-                            process.terminate()
-                        except OSError:
-                            pass
+                if cancelled:
+                    heartbeat.stop()
                     continue # to next frame
 
                 # flush the rest of the logs
-                if data.stdout:
-                    stdout_text = str(data.stdout, encoding='utf8')
-                    
-                    # Also output on console
-                    if netsettings.use_slave_output_log:
-                        print(stdout_text, end="")
-                    
-                    lines = stdout_text.split("\n")
-                    lines[0] = line + lines[0]
-                    if job.subtype == netrender.model.JOB_SUB_BAKING:
-                        results.extend(netrender.baking.resultsFromOuput(lines))
+                for render_process in processes:
+                    readOutput(render_process)
 
-                    # (only need to update on one frame, they are linked
-                    with ConnectionContext():
-                        conn.request("PUT", logURL(job.id, first_frame), data.stdout, headers=headers)
-                    
-                    if responseStatus(conn) == http.client.NO_CONTENT:
-                        continue
+                heartbeat.stop()
 
-                total_t = time.time() - data.start_time
+                if heartbeat.cancelled:
+                    continue
 
-                avg_t = total_t / len(job.frames)
+                for render_process in processes:
+                    status = render_process.process.returncode
 
-                status = process.returncode
+                    print("status", status)
 
-                print("status", status)
+                    # frames not sent back while rendering
+                    frames = render_process.remainingFrames()
 
-                headers = {"job-id":job.id, "slave-id":slave_id, "job-time":str(avg_t)}
+                    if not frames:
+                        continue
 
+                    avg_t = (time.time() - render_process.last_saved) / len(frames)
 
-                if status == 0: # non zero status is error
-                    headers["job-result"] = str(netrender.model.FRAME_DONE)
-                    for frame in job.frames:
-                        headers["job-frame"] = str(frame.number)
-                        if job.hasRenderResult():
-                            # send image back to server
+                    headers = {"job-id":job.id, "slave-id":slave_id, "job-time":str(avg_t)}
 
-                            filename = os.path.join(job_prefix, "%06d.exr" % frame.number)
+                    if status == 0: # non zero status is error
+                        headers["job-result"] = str(netrender.model.FRAME_DONE)
+                        for frame in frames:
+                            headers["job-frame"] = str(frame.number)
+                            if job.hasRenderResult():
+                                # send image back to server
+                                if sendRenderResult(pool, netsettings, job, frame, render_process.output_path, slave_id, avg_t) == http.client.NO_CONTENT:
+                                    continue
 
-                            # thumbnail first
-                            if netsettings.use_slave_thumb:
-                                thumbname = thumbnail.generate(filename)
+                            elif job.subtype == netrender.model.JOB_SUB_BAKING:
+                                index = job.frames.index(frame)
                                 
-                                if thumbname:
-                                    f = open(thumbname, 'rb')
-                                    with ConnectionContext():
-                                        conn.request("PUT", "/thumb", f, headers=headers)
-                                    f.close()
-                                    responseStatus(conn)
-
-                            f = open(filename, 'rb')
-                            with ConnectionContext():
-                                conn.request("PUT", "/render", f, headers=headers)
-                            f.close()
-                            if responseStatus(conn) == http.client.NO_CONTENT:
-                                continue
-
-                        elif job.subtype == netrender.model.JOB_SUB_BAKING:
-                            index = job.frames.index(frame)
-                            
-                            frame_results = [result_filepath for task_index, result_filepath in results if task_index == index]
-                            
-                            for result_filepath in frame_results:
-                                result_path, result_filename = os.path.split(result_filepath)
-                                headers["result-filename"] = result_filename
-                                headers["job-finished"] = str(result_filepath == frame_results[-1])
-                                    
-                                f = open(result_filepath, 'rb')
-                                with ConnectionContext():
-                                    conn.request("PUT", "/result", f, headers=headers)
-                                f.close()
-                                if responseStatus(conn) == http.client.NO_CONTENT:
+                                frame_results = [result_filepath for task_index, result_filepath in results if task_index == index]
+                                
+                                for result_filepath in frame_results:
+                                    result_path, result_filename = os.path.split(result_filepath)
+                                    headers["result-filename"] = result_filename
+                                    headers["job-finished"] = str(result_filepath == frame_results[-1])
+                                        
+                                    with pool.connection() as conn:
+                                        if sendFile(conn, "/result", result_filepath, headers=headers, compress = netsettings.use_compression) == http.client.NO_CONTENT:
+                                            continue
+                                
+                            elif job.type == netrender.model.JOB_PROCESS:
+                                response_status, response_headers, response_data = pool.request("PUT", "/render", headers=headers)
+                                if response_status == http.client.NO_CONTENT:
                                     continue
-                            
-                        elif job.type == netrender.model.JOB_PROCESS:
-                            with ConnectionContext():
-                                conn.request("PUT", "/render", headers=headers)
-                            if responseStatus(conn) == http.client.NO_CONTENT:
+                    else:
+                        headers["job-result"] = str(netrender.model.FRAME_ERROR)
+                        for frame in frames:
+                            headers["job-frame"] = str(frame.number)
+                            # send error result back to server
+                            response_status, response_headers, response_data = pool.request("PUT", "/render", headers=headers)
+                            if response_status == http.client.NO_CONTENT:
                                 continue
-                else:
-                    headers["job-result"] = str(netrender.model.FRAME_ERROR)
-                    for frame in job.frames:
-                        headers["job-frame"] = str(frame.number)
-                        # send error result back to server
-                        with ConnectionContext():
-                            conn.request("PUT", "/render", headers=headers)
-                        if responseStatus(conn) == http.client.NO_CONTENT:
-                            continue
 
                 engine.update_stats("", "Network render connected to master, waiting for jobs")
             else:
                 bisleep.sleep()
 
-        conn.close()
+        pool.close()
 
         if netsettings.use_slave_clear:
             clearSlave(NODE_PREFIX)
@@ -0,0 +1,346 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import bpy
+import sys, os, subprocess
+import struct, zlib, itertools
+
+BLENDER_PATH = sys.argv[0]
+
+# Tiles are rendered as independent work units, their command holds the
+# frame, the tile rectangle in pixels (top left origin, end excluded) and
+# the full frame size.
+
+def splitTiles(width, height, tiles_x, tiles_y):
+    tiles = []
+    for j in range(tiles_y):
+        for i in range(tiles_x):
+            tiles.append((width * i // tiles_x, height * j // tiles_y, width * (i + 1) // tiles_x, height * (j + 1) // tiles_y))
+
+    return tiles
+
+def tileToCommand(frame, rect, width, height):
+    return " ".join((str(value) for value in (frame,) + tuple(rect) + (width, height)))
+
+def commandToTile(command):
+    values = [int(value) for value in command.split()]
+    return values[0], tuple(values[1:5]), values[5], values[6]
+
+def render(job, job_full_path, frames, output_path, threads):
+    tile_args = []
+    for frame in frames:
+        tile_args.append(str(frame.number))
+        tile_args.extend(frame.command.split())
+
+    process = subprocess.Popen([BLENDER_PATH, "-b", "-noaudio", job_full_path, "-t", str(threads), "-E", job.render, "-P", __file__, "--", output_path] + tile_args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    return process
+
+def renderTile(output_path, number, frame, x_min, y_min, x_max, y_max, width, height):
+    scene = bpy.context.scene
+    render = scene.render
+
+    scene.frame_set(frame)
+
+    # border is in fractions of the frame from the bottom left, half a pixel
+    # in so Blender's truncation lands on the tile edges
+    render.use_border = True
+    render.use_crop_to_border = True
+    render.border_min_x = (x_min + 0.5) / width
+    render.border_max_x = min((x_max + 0.5) / width, 1)
+    render.border_min_y = (height - y_max + 0.5) / height
+    render.border_max_y = min((height - y_min + 0.5) / height, 1)
+
+    # plain uncompressed EXR, the master stitches them by copying scanlines
+    render.image_settings.file_format = 'OPEN_EXR'
+    render.image_settings.exr_codec = 'NONE'
+
+    bpy.ops.render.render()
+
+    filepath = os.path.join(output_path, "%06d.exr" % number)
+    bpy.data.images["Render Result"].save_render(filepath, scene)
+
+    print("Saved:", filepath)
+    sys.stdout.flush()
+
+# =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+# OpenEXR scanline files, only what's needed to stitch tiles without loading
+# them whole. Single part scanline images only, uncompressed or zip compressed.
+
+EXR_MAGIC = 20000630
+EXR_VERSION = 2
+EXR_LONG_NAMES = 0x400
+EXR_UNSUPPORTED = 0x200 | 0x800 | 0x1000 # tiled, deep and multipart
+
+EXR_NO_COMPRESSION = 0
+EXR_ZIPS_COMPRESSION = 2
+EXR_ZIP_COMPRESSION = 3
+
+# scanlines in each block, per compression
+EXR_BLOCK_LINES = {
+                    EXR_NO_COMPRESSION: 1,
+                    EXR_ZIPS_COMPRESSION: 1,
+                    EXR_ZIP_COMPRESSION: 16,
+                  }
+
+# bytes per value: uint, half, float
+EXR_PIXEL_SIZE = {0: 4, 1: 2, 2: 4}
+
+def readString(f):
+    data = bytearray()
+    while True:
+        c = f.read(1)
+        if not c:
+            raise ValueError("Truncated OpenEXR header")
+        if c == b"\0":
+            return data.decode("utf8")
+        data += c
+
+def readHeader(f):
+    """Attributes of an OpenEXR file, name -> (type, raw value)"""
+    magic, version = struct.unpack("<ii", f.read(8))
+
+    if magic != EXR_MAGIC:
+        raise ValueError("Not an OpenEXR file")
+
+    if version & EXR_UNSUPPORTED:
+        raise ValueError("Only single part scanline OpenEXR files are supported")
+
+    attributes = {}
+    while True:
+        name = readString(f)
+        if not name:
+            return attributes
+
+        attribute_type = readString(f)
+        size, = struct.unpack("<i", f.read(4))
+        attributes[name] = (attribute_type, f.read(size))
+
+def parseChannels(data):
+    """Channel list as (name, pixel type, linear, x sampling, y sampling)"""
+    channels = []
+    index = 0
+    while data[index]:
+        end = data.index(b"\0", index)
+        name = data[index:end].decode("utf8")
+        pixel_type, linear, x_sampling, y_sampling = struct.unpack_from("<iB3xii", data, end + 1)
+        channels.append((name, pixel_type, linear, x_sampling, y_sampling))
+        index = end + 17
+
+    return channels
+
+def packChannels(channels):
+    data = bytearray()
+    for name, pixel_type, linear, x_sampling, y_sampling in channels:
+        data += name.encode("utf8") + b"\0"
+        data += struct.pack("<iB3xii", pixel_type, linear, x_sampling, y_sampling)
+
+    return bytes(data + b"\0")
+
+def unzipBlock(data):
+    raw = zlib.decompress(data)
+
+    # undo the predictor, each byte is stored as a difference to the previous one
+    values = itertools.chain(raw[:1], map((-128).__add__, raw[1:]))
+    predicted = bytes(map((255).__and__, itertools.accumulate(values)))
+
+    # and the interleaving, even bytes were stored first
+    half = (len(predicted) + 1) // 2
+    block = bytearray(len(predicted))
+    block[0::2] = predicted[:half]
+    block[1::2] = predicted[half:]
+
+    return block
+
+class ExrScanlines:
+    """Reads an OpenEXR image one scanline at a time, top to bottom"""
+    def __init__(self, filepath):
+        self.file = open(filepath, "rb")
+
+        try:
+            attributes = readHeader(self.file)
+
+            self.channels = parseChannels(attributes["channels"][1])
+            self.compression = attributes["compression"][1][0]
+
+            if self.compression not in EXR_BLOCK_LINES:
+                raise ValueError("Unsupported OpenEXR compression in %s" % filepath)
+
+            if any((channel[3] != 1 or channel[4] != 1 for channel in self.channels)):
+                raise ValueError("Subsampled OpenEXR channels in %s" % filepath)
+
+            x_min, y_min, x_max, y_max = struct.unpack("<iiii", attributes["dataWindow"][1])
+            self.width = x_max - x_min + 1
+            self.height = y_max - y_min + 1
+
+            self.channel_sizes = [self.width * EXR_PIXEL_SIZE[channel[1]] for channel in self.channels]
+            self.line_size = sum(self.channel_sizes)
+
+            self.block_lines = EXR_BLOCK_LINES[self.compression]
+            blocks = (self.height + self.block_lines - 1) // self.block_lines
+            self.offsets = struct.unpack("<%iQ" % blocks, self.file.read(8 * blocks))
+        except:
+            self.file.close()
+            raise
+
+        self.block = None
+        self.block_data = None
+
+    def close(self):
+        self.file.close()
+
+    def readBlock(self, block):
+        self.file.seek(self.offsets[block])
+        y, size = struct.unpack("<ii", self.file.read(8))
+        data = self.file.read(size)
+
+        lines = min(self.block_lines, self.height - block * self.block_lines)
+
+        # blocks that didn't compress well are stored as is
+        if self.compression != EXR_NO_COMPRESSION and size < lines * self.line_size:
+            data = unzipBlock(data)
+
+        if len(data) != lines * self.line_size:
+            raise ValueError("Corrupted OpenEXR block")
+
+        self.block = block
+        self.block_data = data
+
+    def line(self, y):
+        """Scanline y (from the top of the data window), each channel one after the other"""
+        block = y // self.block_lines
+
+        if block != self.block:
+            self.readBlock(block)
+
+        start = (y - block * self.block_lines) * self.line_size
+        return memoryview(self.block_data)[start:start + self.line_size]
+
+def writeHeader(f, channels, width, height):
+    window = struct.pack("<iiii", 0, 0, width - 1, height - 1)
+
+    attributes = (
+                    ("channels", "chlist", packChannels(channels)),
+                    ("compression", "compression", bytes((EXR_NO_COMPRESSION,))),
+                    ("dataWindow", "box2i", window),
+                    ("displayWindow", "box2i", window),
+                    ("lineOrder", "lineOrder", bytes((0,))), # increasing y
+                    ("pixelAspectRatio", "float", struct.pack("<f", 1)),
+                    ("screenWindowCenter", "v2f", struct.pack("<ff", 0, 0)),
+                    ("screenWindowWidth", "float", struct.pack("<f", 1)),
+                 )
+
+    version = EXR_VERSION
+    if any((len(channel[0]) > 31 for channel in channels)):
+        version |= EXR_LONG_NAMES
+
+    f.write(struct.pack("<ii", EXR_MAGIC, version))
+
+    for name, attribute_type, value in attributes:
+        f.write(name.encode("utf8") + b"\0" + attribute_type.encode("utf8") + b"\0")
+        f.write(struct.pack("<i", len(value)) + value)
+
+    f.write(b"\0")
+
+def stitch(filepath, tiles, width, height):
+    """
+    Assemble a frame from tile images, tiles are (tile filepath, rectangle).
+
+    The output is written one scanline at a time and tile files are only
+    open while the scanlines they cover are written, so memory use stays at
+    about a scanline per tile in the current row. Parts not covered by any
+    tile are left black.
+    """
+    tiles = sorted(tiles, key = lambda tile: tile[1][1])
+
+    channels = None
+    open_tiles = []
+    next_tile = 0
+
+    temp_path = filepath + ".temp"
+
+    try:
+        with open(temp_path, "wb") as f:
+            for y in range(height):
+                while next_tile < len(tiles) and tiles[next_tile][1][1] <= y:
+                    tile_path, rect = tiles[next_tile]
+                    next_tile += 1
+
+                    reader = ExrScanlines(tile_path)
+                    open_tiles.append((rect, reader))
+
+                    if channels is None:
+                        channels = [channel[:3] + (1, 1) for channel in reader.channels]
+                        pixel_sizes = [EXR_PIXEL_SIZE[channel[1]] for channel in channels]
+                        line_size = width * sum(pixel_sizes)
+
+                        writeHeader(f, channels, width, height)
+
+                        # offsets are known up front, scanlines all have the same size
+                        start = f.tell() + 8 * height
+                        f.write(struct.pack("<%iQ" % height, *(start + line * (8 + line_size) for line in range(height))))
+                    elif [channel[:2] for channel in reader.channels] != [channel[:2] for channel in channels]:
+                        raise ValueError("Tile %s doesn't have the same channels as the others" % tile_path)
+
+                if channels is None:
+                    raise ValueError("No tile covers the first scanline")
+
+                line = bytearray(line_size)
+
+                for (x_min, y_min, x_max, y_max), reader in open_tiles:
+                    tile_y = y - y_min
+                    if tile_y >= reader.height:
+                        continue
+
+                    tile_line = reader.line(tile_y)
+                    tile_width = max(min(x_max - x_min, reader.width, width - x_min), 0)
+
+                    source = 0
+                    destination = 0
+                    for pixel_size, channel_size in zip(pixel_sizes, reader.channel_sizes):
+                        line[destination + x_min * pixel_size:destination + (x_min + tile_width) * pixel_size] = tile_line[source:source + tile_width * pixel_size]
+                        source += channel_size
+                        destination += width * pixel_size
+
+                f.write(struct.pack("<ii", y, line_size))
+                f.write(line)
+
+                # done with tiles ending on this scanline
+                for tile in [tile for tile in open_tiles if tile[0][3] <= y + 1]:
+                    tile[1].close()
+                    open_tiles.remove(tile)
+
+        os.replace(temp_path, filepath)
+    finally:
+        for rect, reader in open_tiles:
+            reader.close()
+
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+if __name__ == "__main__":
+    try:
+        i = sys.argv.index("--")
+    except:
+        i = 0
+
+    if i:
+        output_path = sys.argv[i+1]
+        tile_args = [int(value) for value in sys.argv[i+2:]]
+        for i in range(0, len(tile_args), 8):
+            renderTile(output_path, *tile_args[i:i+8])
@@ -135,6 +135,7 @@ class RENDER_PT_network_settings(NetRenderButtonsPanel, bpy.types.Panel):
 
         if netsettings.mode != "RENDER_MASTER":
             layout.operator("render.netclientscan", icon='FILE_REFRESH', text="")
+            layout.prop(netsettings, "use_compression")
             
         if not netrender.valid_address:
             layout.label(text="No master at specified address")
@@ -167,6 +168,8 @@ class RENDER_PT_network_slave_settings(NetRenderButtonsPanel, bpy.types.Panel):
         layout.prop(netsettings, "slave_render")
         layout.prop(netsettings, "slave_bake")
         layout.prop(netsettings, "use_slave_clear")
+        layout.prop(netsettings, "slave_cache_size")
+        layout.prop(netsettings, "slave_processes")
         layout.prop(netsettings, "use_slave_thumb")
         layout.prop(netsettings, "use_slave_output_log")
         layout.label(text="Threads:")
@@ -190,9 +193,11 @@ class RENDER_PT_network_master_settings(NetRenderButtonsPanel, bpy.types.Panel):
 
         netsettings = context.scene.network_render
 
+        layout.prop(netsettings, "master_serve_mode")
         layout.prop(netsettings, "use_master_broadcast")
         layout.prop(netsettings, "use_master_force_upload")
         layout.prop(netsettings, "use_master_clear")
+        layout.prop(netsettings, "master_cache_size")
 
 class RENDER_PT_network_job(NetRenderButtonsPanel, bpy.types.Panel):
     bl_label = "Job Settings"
@@ -232,6 +237,11 @@ class RENDER_PT_network_job(NetRenderButtonsPanel, bpy.types.Panel):
         row = layout.row()
         row.prop(netsettings, "priority")
         row.prop(netsettings, "chunks")
+        row.prop(netsettings, "chunk_time")
+
+        row = layout.row()
+        row.prop(netsettings, "tiles_x")
+        row.prop(netsettings, "tiles_y")
         
         if netsettings.job_type == "JOB_BLENDER":
             layout.prop(netsettings, "save_before_job")
@@ -416,6 +426,10 @@ class NetRenderSettings(bpy.types.PropertyGroup):
                         name="Broadcast",
                         description="broadcast master server address on local network",
                         default = True)
+        NetRenderSettings.use_compression = BoolProperty(
+                        name="Compress transfers",
+                        description="deflate files sent to and from the master, for slow networks",
+                        default = False)
         NetRenderSettings.use_ssl = BoolProperty(
                         name="use ssl",
                         description="use ssl encryption for communication",
@@ -438,6 +452,19 @@ class NetRenderSettings(bpy.types.PropertyGroup):
                         description="delete downloaded files on exit",
                         default = True)
         
+        NetRenderSettings.slave_processes = IntProperty(
+                        name="Processes",
+                        description="Number of Blender processes rendering the frames of a chunk at the same time, threads are split between them",
+                        default = 1,
+                        min=1,
+                        max=64)
+
+        NetRenderSettings.slave_cache_size = IntProperty(
+                        name="Cache Size (MB)",
+                        description="Disk space for job files kept between jobs, 0 for no limit",
+                        default = 0,
+                        min=0)
+        
         NetRenderSettings.use_slave_thumb = BoolProperty(
                         name="Generate thumbnails",
                         description="Generate thumbnails on slaves instead of master",
@@ -469,6 +496,21 @@ class NetRenderSettings(bpy.types.PropertyGroup):
                         description="Delete saved files on exit",
                         default = False)
 
+        NetRenderSettings.master_serve_mode = EnumProperty(
+                                items=(
+                                                ("LOOP", "Polling", "Handle one request per loop tick"),
+                                                ("EVENT", "Event-driven", "Serve connections concurrently, housekeeping on its own timer"),
+                                            ),
+                                name="Serving mode",
+                                description="How the master accepts and services slave connections",
+                                default="LOOP")
+
+        NetRenderSettings.master_cache_size = IntProperty(
+                        name="Cache Size (MB)",
+                        description="Disk space for job files shared between jobs, 0 for no limit",
+                        default = 10240,
+                        min=0)
+
         NetRenderSettings.use_master_force_upload = BoolProperty(
                         name="Force Dependency Upload",
                         description="Force client to upload dependency files to master",
@@ -546,6 +588,27 @@ class NetRenderSettings(bpy.types.PropertyGroup):
                         default = 5,
                         min=1,
                         max=65535)
+
+        NetRenderSettings.chunk_time = IntProperty(
+                        name="Chunk Time",
+                        description="Size chunks to take about that many seconds once frame times are known (0 for fixed chunks)",
+                        default = 0,
+                        min=0,
+                        max=86400)
+        
+        NetRenderSettings.tiles_x = IntProperty(
+                        name="Tiles X",
+                        description="Split single frame jobs in that many tiles horizontally, rendered by different slaves",
+                        default = 1,
+                        min=1,
+                        max=64)
+
+        NetRenderSettings.tiles_y = IntProperty(
+                        name="Tiles Y",
+                        description="Split single frame jobs in that many tiles vertically, rendered by different slaves",
+                        default = 1,
+                        min=1,
+                        max=64)
         
         NetRenderSettings.priority = IntProperty(
                         name="Priority",
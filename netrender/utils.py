@@ -17,8 +17,9 @@
 # ##### END GPL LICENSE BLOCK #####
 
 import sys, os, re, platform
-import http, http.client, http.server, socket
-import subprocess, time, hashlib
+import http, http.client, http.server, socket, select
+import subprocess, time, hashlib, zlib
+import threading
 
 import netrender, netrender.model
 
@@ -231,17 +232,312 @@ def renderURL(job_id, frame_number):
 def cancelURL(job_id):
     return "/cancel_%s" % (job_id)
 
+HASH_BLOCK_SIZE = 1024 * 1024
+
 def hashFile(path):
-    f = open(path, "rb")
-    value = hashData(f.read())
-    f.close()
-    return value
+    # streamed, big files shouldn't be loaded in memory just to sign them
+    m = hashlib.md5()
+    with open(path, "rb") as f:
+        buf = f.read(HASH_BLOCK_SIZE)
+        while buf:
+            m.update(buf)
+            buf = f.read(HASH_BLOCK_SIZE)
+    return m.hexdigest()
     
 def hashData(data):
     m = hashlib.md5()
     m.update(data)
     return m.hexdigest()
 
+# Chunked transfers
+#
+# Uploads are sent as "content-range: bytes start-end/total" PUTs, each with
+# the MD5 of the chunk. The master answers PARTIAL_CONTENT with the
+# "upload-offset" it has until the last chunk, then its usual response. A PUT
+# with "bytes */total" and no body only asks for that offset, which is how an
+# interrupted upload resumes. The "upload-id" header identifies the upload, so
+# a different file sent to the same path starts over. Downloads resume with a
+# Range request.
+# Bodies can be deflate compressed on the fly in both directions.
+TRANSFER_CHUNK_SIZE = 16 * 1024 * 1024
+TRANSFER_BLOCK_SIZE = 64 * 1024
+TRANSFER_RETRIES = 5
+
+def contentRange(start, end, total):
+    return "bytes %i-%i/%i" % (start, end, total)
+
+def parseContentRange(value):
+    """(start, end, total) of a content-range header, start and end are None for offset queries"""
+    unit, _, value = value.partition(" ")
+    span, _, total = value.partition("/")
+
+    if span == "*":
+        return None, None, int(total)
+
+    start, _, end = span.partition("-")
+    return int(start), int(end), int(total)
+
+def sendFile(conn, url, filepath, headers = {}, compress = False, chunk_size = TRANSFER_CHUNK_SIZE):
+    """Upload a file in checksummed chunks, resuming where the master is. Returns the final response status"""
+    total = os.path.getsize(filepath)
+
+    if total == 0:
+        with ConnectionContext():
+            conn.request("PUT", url, bytes(), headers=headers)
+        return responseStatus(conn)
+
+    retries = 0
+    offset = None
+
+    headers = dict(headers)
+    headers["upload-id"] = hashData(bytes("%s %s %i %f" % (socket.gethostname(), filepath, total, os.path.getmtime(filepath)), encoding='utf8'))
+
+    with open(filepath, 'rb') as f:
+        while True:
+            try:
+                if offset is None:
+                    # ask the master how much it already has
+                    query_headers = dict(headers)
+                    query_headers["content-range"] = "bytes */%i" % total
+                    query_headers["content-length"] = "0"
+                    with ConnectionContext():
+                        conn.request("PUT", url, bytes(), headers=query_headers)
+                    with conn.getresponse() as response:
+                        response.read()
+                        if response.status != http.client.PARTIAL_CONTENT:
+                            return response.status
+                        offset = int(response.getheader("upload-offset", "0"))
+
+                f.seek(offset)
+                data = f.read(chunk_size)
+                end = offset + len(data) - 1
+
+                chunk_headers = dict(headers)
+                chunk_headers["content-range"] = contentRange(offset, end, total)
+                chunk_headers["chunk-md5"] = hashData(data)
+
+                if compress:
+                    data = zlib.compress(data)
+                    chunk_headers["content-encoding"] = "deflate"
+
+                chunk_headers["content-length"] = str(len(data))
+
+                with ConnectionContext():
+                    conn.request("PUT", url, data, headers=chunk_headers)
+                with conn.getresponse() as response:
+                    response.read()
+
+                    if response.status != http.client.PARTIAL_CONTENT:
+                        return response.status
+
+                    # next chunk, or the same one again if it was corrupted
+                    offset = int(response.getheader("upload-offset", str(end + 1)))
+            except (OSError, http.client.HTTPException) as err:
+                retries += 1
+                if retries > TRANSFER_RETRIES:
+                    raise
+
+                print("Upload of %s interrupted (%s), resuming" % (filepath, err))
+                conn.close()
+                offset = None
+                time.sleep(retries)
+
+class StaleDownload(Exception):
+    pass
+
+def removeFile(filepath):
+    try:
+        os.remove(filepath)
+    except FileNotFoundError:
+        pass
+
+def getFile(conn, url, filepath, headers = {}, compress = False):
+    """
+    Download to filepath, resuming after what a previous attempt left in it. Returns the response status,
+    OK once filepath is as long as the file sent by the master (callers check its signature).
+    """
+    retries = 0
+
+    while True:
+        offset = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+
+        request_headers = dict(headers)
+        if offset:
+            request_headers["range"] = "bytes=%i-" % offset
+        if compress:
+            request_headers["accept-encoding"] = "deflate"
+
+        try:
+            with ConnectionContext():
+                conn.request("GET", url, headers=request_headers)
+            response = conn.getresponse()
+
+            total = None
+
+            if response.status == http.client.PARTIAL_CONTENT and offset:
+                start, end, total = parseContentRange(response.getheader("content-range", "bytes */-1"))
+                if start != offset:
+                    raise StaleDownload("range starting at %s instead of %i" % (start, offset))
+                mode = 'ab'
+            elif response.status == http.client.OK:
+                mode = 'wb'
+                if response.getheader("content-encoding", "") != "deflate":
+                    total = int(response.getheader("content-length", "-1"))
+            elif response.status == http.client.REQUESTED_RANGE_NOT_SATISFIABLE:
+                response.read()
+                start, end, total = parseContentRange(response.getheader("content-range", "bytes */-1"))
+                if total != offset:
+                    raise StaleDownload("%i bytes already there for a file of %i" % (offset, total))
+                # already complete
+                return http.client.OK
+            else:
+                response.read()
+                removeFile(filepath)
+                return response.status
+
+            if response.getheader("content-encoding", "") == "deflate":
+                decompressor = zlib.decompressobj()
+            else:
+                decompressor = None
+
+            with open(filepath, mode) as f:
+                buf = response.read(TRANSFER_BLOCK_SIZE)
+                while buf:
+                    f.write(decompressor.decompress(buf) if decompressor else buf)
+                    buf = response.read(TRANSFER_BLOCK_SIZE)
+
+                if decompressor:
+                    f.write(decompressor.flush())
+
+            response.close()
+
+            if total is not None and total >= 0 and os.path.getsize(filepath) != total:
+                # resumed, or started again by the range check if it's too long
+                raise http.client.IncompleteRead(b"", total - os.path.getsize(filepath))
+
+            return http.client.OK
+        except StaleDownload as err:
+            # what a previous attempt left isn't the start of this file
+            print("Download of %s started again (%s)" % (filepath, err))
+            conn.close()
+            removeFile(filepath)
+
+            retries += 1
+            if retries > TRANSFER_RETRIES:
+                raise
+        except (OSError, http.client.HTTPException) as err:
+            retries += 1
+            if retries > TRANSFER_RETRIES:
+                raise
+
+            print("Download of %s interrupted (%s), resuming" % (filepath, err))
+            conn.close()
+            time.sleep(retries)
+
+IDEMPOTENT_METHODS = {"GET", "HEAD"}
+
+def connectionDropped(conn):
+    """True when an idle connection can't be used anymore, nothing is expected to be read on it"""
+    if conn.sock is None:
+        return False
+
+    try:
+        readable, writable, errors = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+
+    # either closed by the peer or unexpected data, both unusable
+    return bool(readable)
+
+class ConnectionPool:
+    """
+    Kept alive connections to the master, shared by the threads of a slave.
+
+    Requests take an idle connection or open a new one, idle connections
+    closed by the master are dropped first. Failed GET and HEAD requests are
+    sent again on a fresh connection, with a growing delay after the first
+    retry. Other methods aren't idempotent, they are only sent again when
+    connecting failed, so the master never got them.
+    """
+    def __init__(self, conn, retries = TRANSFER_RETRIES):
+        self.connection_class = type(conn)
+        self.host = conn.host
+        self.port = conn.port
+        self.timeout = conn.timeout
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.idle = [conn]
+
+    def get(self):
+        with self.lock:
+            while self.idle:
+                conn = self.idle.pop()
+                if not connectionDropped(conn):
+                    return conn
+                conn.close()
+
+        return self.connection_class(self.host, self.port, timeout = self.timeout)
+
+    def put(self, conn):
+        with self.lock:
+            self.idle.append(conn)
+
+    def connection(self):
+        """Context giving a connection for a whole exchange (file transfers)"""
+        return PooledConnection(self)
+
+    def close(self):
+        with self.lock:
+            for conn in self.idle:
+                conn.close()
+            self.idle = []
+
+    def request(self, method, url, body = None, headers = {}):
+        """Send a request and read the response, returns (status, headers, data). body can't be a file, it may be sent again"""
+        retries = 0
+
+        while True:
+            conn = self.get()
+            sent = False
+
+            try:
+                with ConnectionContext():
+                    if conn.sock is None:
+                        conn.connect()
+                    sent = True
+                    conn.request(method, url, body, headers)
+                with conn.getresponse() as response:
+                    data = response.read()
+
+                self.put(conn)
+
+                return response.status, response.msg, data
+            except (OSError, http.client.HTTPException) as err:
+                conn.close()
+
+                retries += 1
+                if retries > self.retries or (sent and method not in IDEMPOTENT_METHODS):
+                    raise
+
+                if retries > 1:
+                    print("Request %s %s failed (%s), retrying" % (method, url, err))
+                    time.sleep(retries - 1)
+
+class PooledConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = None
+
+    def __enter__(self):
+        self.conn = self.pool.get()
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.conn.close()
+
+        self.pool.put(self.conn)
+
 def verifyCreateDir(directory_path):
     original_path = directory_path
     directory_path = os.path.expanduser(directory_path)